@@ -1,21 +1,12 @@
-from openai import OpenAI
 import json
 import os
 from dotenv import load_dotenv
+import llm_providers
 
 # Load environment variables from .env file
+# (the OpenAI key is checked when the first OpenAI request is made)
 load_dotenv()
 
-# Initialize OpenAI client with API key from environment variable
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError(
-        "OPENAI_API_KEY not found. Please set it as an environment variable "
-        "or create a .env file with OPENAI_API_KEY=your-key-here"
-    )
-
-client = OpenAI(api_key=api_key)
-
 SYSTEM_PROMPT = """
 You are an AI sales assistant.
 
@@ -28,13 +19,22 @@ Return JSON only:
 { "reply": "...", "should_stop": false }
 """
 
-def generate_ai_reply(context: str):
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": context}
-        ],
-        temperature=0.4
-    )
-    return json.loads(response.choices[0].message.content)
+# Appended to a company's own AIModel.system_prompt so replies stay parseable
+RESPONSE_FORMAT = """
+Return JSON only:
+{ "reply": "...", "should_stop": false }
+"""
+
+def generate_ai_reply(context: str, company_id: str = None, hedge: bool = False):
+    """
+    Generate a reply with the company's configured model
+
+    Args:
+        context: Conversation context for the model
+        company_id: Company whose AIModel settings apply (defaults otherwise)
+        hedge: Latency-sensitive reply - fire a backup request if the model is slow
+    """
+    config = llm_providers.get_config(company_id)
+    system = config.system_prompt + RESPONSE_FORMAT if config.system_prompt else SYSTEM_PROMPT
+    text = llm_providers.complete(config, system, context, hedge=hedge)
+    return json.loads(text)
@@ -0,0 +1,135 @@
+"""
+Queue-Depth Autoscaler
+Sizes a worker's pool from what is waiting for it, not what it has prefetched
+
+Celery's stock autoscaler grows only when tasks are already reserved by the
+worker, which with prefetch=1 means it barely reacts. This one samples the
+broker depth of the queues the worker consumes and the age of the oldest
+released-but-unstarted job for those queues, then targets:
+
+    enough processes to drain the backlog (depth / TASKS_PER_PROCESS), and
+    +50% whenever the oldest job has waited longer than TARGET_WAIT
+
+Scale-down stays gradual (Celery's keepalive) and never goes below the
+processes that are currently busy. Enabled by `--autoscale MAX,MIN` on a
+prefork worker (see worker_profiles.py).
+"""
+import math
+import os
+import time
+from datetime import datetime
+
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+
+SAMPLE_INTERVAL = float(os.getenv("AUTOSCALE_SAMPLE_SECONDS", "5"))
+TASKS_PER_PROCESS = int(os.getenv("AUTOSCALE_TASKS_PER_PROCESS", "4"))
+TARGET_WAIT = float(os.getenv("AUTOSCALE_TARGET_WAIT_SECONDS", "2"))
+PRIORITY_STEPS = range(10)  # Matches broker_transport_options["priority_steps"]
+
+
+def desired_concurrency(depth: int, oldest_wait: float, current: int, busy: int,
+                        min_concurrency: int, max_concurrency: int) -> int:
+    """
+    Target pool size for the measured backlog
+
+    Args:
+        depth: Messages waiting in the broker for this worker's queues
+        oldest_wait: Seconds the oldest released job has waited (0 if none)
+        current: Current pool size
+        busy: Processes running a task right now
+        min_concurrency/max_concurrency: --autoscale bounds
+    """
+    target = math.ceil(depth / TASKS_PER_PROCESS) if depth else 0
+    if oldest_wait > TARGET_WAIT and depth:
+        target = max(target, current + max(1, current // 2))
+    target = max(target, busy, min_concurrency)
+    return min(target, max_concurrency)
+
+
+def queue_depths(app, queues) -> dict:
+    """Messages waiting per queue, summed over the Redis priority lists"""
+    depths = {}
+    with app.connection_for_read() as conn:
+        client = conn.default_channel.client
+        pipe = client.pipeline()
+        for queue in queues:
+            for step in PRIORITY_STEPS:
+                pipe.llen(f"{queue}:{step}" if step else queue)
+        counts = pipe.execute()
+    for i, queue in enumerate(queues):
+        depths[queue] = sum(counts[i * len(PRIORITY_STEPS):(i + 1) * len(PRIORITY_STEPS)])
+    return depths
+
+
+def oldest_wait(queues, now: datetime = None) -> float:
+    """Seconds since the oldest job routed to `queues` was released without starting"""
+    from celery_app import TASK_QUEUES
+    from database import SessionLocal
+    from fair_scheduler import STALE_AFTER
+    from models import Job
+    from queue_manager import PRIORITIES
+    from sqlalchemy import func
+
+    job_types = [
+        job_type for job_type in PRIORITIES
+        if TASK_QUEUES.get(f"worker.{job_type.replace('.', '_')}") in queues
+    ]
+    if not job_types:
+        return 0.0
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        oldest = db.query(func.min(Job.dispatched_at)).filter(
+            Job.status == "queued",
+            Job.job_type.in_(job_types),
+            Job.dispatched_at >= now - STALE_AFTER,
+        ).scalar()
+    finally:
+        db.close()
+    if oldest is None:
+        return 0.0
+    return max(0.0, (now - oldest.replace(tzinfo=None)).total_seconds())
+
+
+class QueueDepthAutoscaler(Autoscaler):
+    """Celery autoscaler driven by broker depth and job wait time"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sampled_at = 0.0
+        self._target = self.min_concurrency
+
+    def _queues(self) -> list:
+        try:
+            return [q.name for q in self.worker.consumer.task_consumer.queues]
+        except AttributeError:
+            from celery_app import QUEUES
+            return list(QUEUES)
+
+    def _sample(self):
+        busy = len(state.active_requests)
+        try:
+            queues = self._queues()
+            depth = sum(queue_depths(self.worker.app, queues).values())
+            wait = oldest_wait(queues)
+        except Exception as e:
+            # Broker/DB hiccup: hold the current size rather than flap
+            print(f"⚠️ Autoscaler sample failed: {e}")
+            return
+        self._target = desired_concurrency(
+            depth, wait, self.processes, busy, self.min_concurrency, self.max_concurrency
+        )
+
+    @property
+    def qty(self):
+        now = time.monotonic()
+        if now - self._sampled_at >= SAMPLE_INTERVAL:
+            self._sampled_at = now
+            self._sample()
+        return max(self._target, len(state.active_requests))
+
+    def info(self):
+        info = super().info()
+        info["target"] = self._target
+        return info
@@ -0,0 +1,427 @@
+"""
+Benchmark: end-to-end inbound message → AI reply → channel send
+
+Runs the whole path locally: the FastAPI app (in-process ASGI clients), a
+broker (in-memory by default, or --broker redis://...), an embedded Celery
+worker, a fake OpenAI server (benchmarks/fakes.py) and fake channel
+adapters. Traffic is replayed from a seeded schedule that is bursty,
+skewed across tenants and includes chatty leads that send several
+messages in a row.
+
+Reports throughput and p50/p95/p99 per stage:
+    api          POST /inbound-message round trip
+    queue_wait   job created → picked up by a worker (fair dispatch included)
+    ai           generate_ai_reply (fake OpenAI round trip)
+    send         ChannelRouter.send (fake adapter, breaker included)
+    task         worker start → job completed
+    end_to_end   inbound request sent → job completed
+
+Usage:
+    python benchmarks/bench_e2e.py --duration 20 --rate 40 --tenants 5
+    python benchmarks/bench_e2e.py --save local                # → benchmarks/baselines/local.json
+    python benchmarks/bench_e2e.py --compare benchmarks/baselines/local.json
+    python benchmarks/bench_e2e.py --broker redis://localhost:6379/15 --workers 32
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+
+STAGES = ("api", "queue_wait", "ai", "send", "task", "end_to_end")
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+class Recorder:
+    """Thread-safe per-stage latency samples (seconds)"""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def timed(self, stage: str, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+
+def summarize(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(len(values) - 1, math.ceil(len(values) * p) - 1)] * 1000, 1)
+
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 1),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+# ============================================================================
+# TRAFFIC
+# ============================================================================
+
+def build_schedule(duration: float, rate: float, tenants: int, leads_per_tenant: int,
+                   burst_factor: float, chatty: float, seed: int) -> list:
+    """
+    (offset_seconds, tenant, phone) arrivals
+
+    - Poisson arrivals at `rate`/s, with a 1s burst at rate × burst_factor
+      every 5 seconds
+    - Tenants are Zipf-weighted (tenant 0 is the busiest)
+    - A `chatty` fraction of arrivals is followed by 1-3 more messages from
+      the same lead within 0.3-2s
+    """
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(tenants)]
+    schedule = []
+    t = 0.0
+    while t < duration:
+        current = rate * burst_factor if int(t) % 5 == 0 else rate
+        t += rng.expovariate(current)
+        if t >= duration:
+            break
+        tenant = rng.choices(range(tenants), weights)[0]
+        phone = lead_phone(tenant, rng.randrange(leads_per_tenant))
+        schedule.append((t, tenant, phone))
+        if rng.random() < chatty:
+            follow = t
+            for _ in range(rng.randint(1, 3)):
+                follow += rng.uniform(0.3, 2.0)
+                schedule.append((follow, tenant, phone))
+    schedule.sort()
+    return schedule
+
+
+def lead_phone(tenant: int, index: int) -> str:
+    return f"+1555{tenant:02d}{index:05d}"
+
+
+def seed_tenants(tenants: int, leads_per_tenant: int) -> list:
+    """One company, pipeline, stage and leads_per_tenant leads per tenant; returns company ids"""
+    from sqlalchemy import insert
+    from database import SessionLocal
+    from models import Company, Pipeline, Stage, Lead
+
+    db = SessionLocal()
+    try:
+        rows = []
+        company_ids = []
+        for tenant in range(tenants):
+            company = Company(name=f"Tenant {tenant}", timezone="UTC",
+                              plan="pro" if tenant == 0 else "free")
+            db.add(company)
+            db.flush()
+            company_ids.append(company.id)
+            pipeline = Pipeline(company_id=company.id, name="Default", is_default=True)
+            db.add(pipeline)
+            db.flush()
+            stage = Stage(pipeline_id=pipeline.id, name="New", order=1)
+            db.add(stage)
+            db.flush()
+            rows.extend({
+                "id": f"lead-{tenant}-{i}", "company_id": company.id, "pipeline_id": pipeline.id,
+                "stage_id": stage.id, "phone": lead_phone(tenant, i),
+                "normalized_phone": lead_phone(tenant, i), "name": f"Lead {i}", "source": "bench",
+            } for i in range(leads_per_tenant))
+        db.execute(insert(Lead), rows)
+        db.commit()
+        return company_ids
+    finally:
+        db.close()
+
+
+def replay(app, schedule: list, companies: list, clients: int, recorder: Recorder) -> dict:
+    """Send the schedule from `clients` threads; returns {job_id: sent_at (utc)}"""
+    from fastapi.testclient import TestClient
+
+    sent = {}
+    errors = []
+    lock = threading.Lock()
+    cursor = iter(schedule)
+    start = time.perf_counter()
+
+    def client_loop():
+        client = TestClient(app)
+        while True:
+            with lock:
+                item = next(cursor, None)
+            if item is None:
+                return
+            offset, tenant, phone = item
+            delay = offset - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            sent_at = datetime.utcnow()
+            t0 = time.perf_counter()
+            response = client.post("/inbound-message", json={
+                "phone_number": phone, "message_text": "Hi, what are your prices?", "channel": "whatsapp_web",
+                "company_id": companies[tenant],
+            })
+            recorder.add("api", time.perf_counter() - t0)
+            with lock:
+                if response.status_code == 200 and response.json().get("job_id"):
+                    sent[response.json()["job_id"]] = sent_at
+                elif response.status_code != 200:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client_loop) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"jobs": sent, "errors": len(errors), "elapsed": time.perf_counter() - start}
+
+
+def wait_for_jobs(job_ids: list, timeout: float) -> dict:
+    """Poll until every job reaches a terminal status; returns status counts"""
+    from sqlalchemy import func
+    from database import SessionLocal
+    from models import Job
+
+    deadline = time.monotonic() + timeout
+    while True:
+        db = SessionLocal()
+        try:
+            counts = {}
+            for start in range(0, len(job_ids), 500):
+                for status, count in db.query(Job.status, func.count(Job.id)).filter(
+                    Job.id.in_(job_ids[start:start + 500])
+                ).group_by(Job.status):
+                    counts[status] = counts.get(status, 0) + count
+        finally:
+            db.close()
+        open_jobs = sum(v for k, v in counts.items() if k not in ("completed", "dlq"))
+        if not open_jobs or time.monotonic() > deadline:
+            return counts
+        time.sleep(0.2)
+
+
+def collect_job_stages(sent: dict, recorder: Recorder):
+    from database import SessionLocal
+    from models import Job
+
+    ids = list(sent)
+    db = SessionLocal()
+    try:
+        for start in range(0, len(ids), 500):
+            rows = db.query(Job.id, Job.created_at, Job.started_at, Job.completed_at).filter(
+                Job.id.in_(ids[start:start + 500])
+            )
+            for job_id, created_at, started_at, completed_at in rows:
+                if started_at:
+                    recorder.add("queue_wait", (started_at.replace(tzinfo=None)
+                                                - created_at.replace(tzinfo=None)).total_seconds())
+                if started_at and completed_at:
+                    recorder.add("task", (completed_at - started_at).total_seconds())
+                if completed_at:
+                    recorder.add("end_to_end", (completed_at.replace(tzinfo=None) - sent[job_id]).total_seconds())
+    finally:
+        db.close()
+
+
+# ============================================================================
+# BASELINES
+# ============================================================================
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions beyond tolerance: p95 latency up or throughput down"""
+    regressions = []
+    for stage in STAGES:
+        new = result["stages"].get(stage, {}).get("p95_ms")
+        old = baseline["stages"].get(stage, {}).get("p95_ms")
+        if new is not None and old and new > old * (1 + tolerance):
+            regressions.append(f"{stage} p95 {old}ms → {new}ms (+{(new / old - 1) * 100:.0f}%)")
+    new_tp = result["throughput"]["completed_per_second"]
+    old_tp = baseline["throughput"]["completed_per_second"]
+    if old_tp and new_tp < old_tp * (1 - tolerance):
+        regressions.append(f"throughput {old_tp}/s → {new_tp}/s ({(new_tp / old_tp - 1) * 100:.0f}%)")
+    return regressions
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=15, help="Seconds of traffic")
+    parser.add_argument("--rate", type=float, default=20, help="Average inbound messages/s")
+    parser.add_argument("--burst-factor", type=float, default=3)
+    parser.add_argument("--chatty", type=float, default=0.2, help="Fraction of arrivals followed by more")
+    parser.add_argument("--tenants", type=int, default=5)
+    parser.add_argument("--leads", type=int, default=200, help="Leads per tenant")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent API clients")
+    parser.add_argument("--workers", type=int, default=16, help="Worker thread pool size")
+    parser.add_argument("--broker", default="memory://")
+    parser.add_argument("--no-fair", action="store_true", help="Publish directly (FAIR_SCHEDULING=0)")
+    parser.add_argument("--openai-latency-ms", type=float, default=400)
+    parser.add_argument("--openai-per-token-ms", type=float, default=5)
+    parser.add_argument("--openai-tokens", type=int, default=40)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--send-latency-ms", type=float, default=80)
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", metavar="NAME", help="Write benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="PATH", help="Fail if worse than this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    from fakes import FakeOpenAI, FakeChannels
+
+    fake_openai = FakeOpenAI(args.openai_latency_ms, args.openai_per_token_ms,
+                             completion_tokens=args.openai_tokens, error_rate=args.openai_error_rate).start()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_e2e.db")
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = fake_openai.base_url
+    os.environ["FAIR_SCHEDULING"] = "0" if args.no_fair else "1"
+    os.environ["CELERY_BROKER_URL"] = args.broker
+    os.environ["CELERY_RESULT_BACKEND"] = "cache+memory://"
+    # API clients, worker threads (two sessions each) and the dispatcher share one process
+    os.environ.setdefault("DB_POOL_SIZE", str(args.clients + 2 * args.workers + 4))
+
+    from celery_app import celery
+    celery.conf.task_ignore_result = True
+    # Virtual transports (memory://) poll; the default 1s would dominate queue_wait
+    celery.conf.broker_transport_options = {**celery.conf.broker_transport_options, "polling_interval": 0.01}
+
+    import migrate
+    migrate.migrate()
+    import main as api
+    import channels
+    import fair_scheduler
+    import worker
+    from celery.contrib.testing.worker import start_worker
+
+    recorder = Recorder()
+    fake_channels = FakeChannels({"wa_web": args.send_latency_ms, "wa_cloud": args.send_latency_ms,
+                                  "email": args.send_latency_ms}).install()
+    worker.generate_ai_reply = recorder.timed("ai", worker.generate_ai_reply)
+    channels.ChannelRouter.send = staticmethod(recorder.timed("send", channels.ChannelRouter.send))
+
+    companies = seed_tenants(args.tenants, args.leads)
+    schedule = build_schedule(args.duration, args.rate, args.tenants, args.leads,
+                              args.burst_factor, args.chatty, args.seed)
+    print(f"📈 Replaying {len(schedule)} inbound messages over {args.duration:.0f}s "
+          f"({args.tenants} tenants, broker {args.broker})")
+
+    stop = threading.Event()
+
+    def beat():
+        # Stand-in for the 1s fair-dispatch beat tick
+        while not stop.is_set():
+            fair_scheduler.dispatch()
+            stop.wait(0.25)
+
+    with start_worker(celery, pool="threads", concurrency=args.workers, perform_ping_check=False,
+                      loglevel="ERROR", shutdown_timeout=30, hostname="bench@localhost"):
+        beat_thread = threading.Thread(target=beat, daemon=True)
+        if not args.no_fair:
+            beat_thread.start()
+        started = time.perf_counter()
+        sent = replay(api.app, schedule, companies, args.clients, recorder)
+        counts = wait_for_jobs(list(sent["jobs"]), args.drain_timeout)
+        elapsed = time.perf_counter() - started
+        stop.set()
+
+    collect_job_stages(sent["jobs"], recorder)
+    fake_channels.uninstall()
+    fake_openai.stop()
+
+    completed = counts.get("completed", 0)
+    result = {
+        "meta": {
+            "recorded_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+            "args": vars(args),
+        },
+        "throughput": {
+            "requests": len(schedule),
+            "api_errors": sent["errors"],
+            "jobs": len(sent["jobs"]),
+            "job_status": counts,
+            "elapsed_seconds": round(elapsed, 2),
+            "accepted_per_second": round(len(schedule) / sent["elapsed"], 1),
+            "completed_per_second": round(completed / elapsed, 1),
+        },
+        "fakes": {"openai_requests": fake_openai.requests, "openai_errors": fake_openai.errors,
+                  "channel_sends": fake_channels.sends},
+        "stages": {stage: summarize(recorder.samples[stage]) for stage in STAGES},
+    }
+
+    print(f"requests:    {len(schedule)} ({sent['errors']} API errors), jobs: {len(sent['jobs'])} {counts}")
+    print(f"throughput:  {result['throughput']['accepted_per_second']}/s accepted, "
+          f"{result['throughput']['completed_per_second']}/s completed")
+    print(f"{'stage':<12} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, s in result["stages"].items():
+        if s["count"]:
+            print(f"{stage:<12} {s['count']:>6} {s['p50_ms']:>7}ms {s['p95_ms']:>7}ms {s['p99_ms']:>7}ms")
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+        print(f"💾 Baseline saved to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        ignored = {"save", "compare", "tolerance", "drain_timeout"}
+        changed = sorted(
+            k for k, v in vars(args).items()
+            if k not in ignored and baseline["meta"]["args"].get(k) != v
+        )
+        if changed:
+            print(f"⚠️  Load settings differ from the baseline ({', '.join(changed)}); comparison is indicative only")
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressions vs baseline:")
+            for line in regressions:
+                print(f"   - {line}")
+            sys.exit(1)
+        print(f"✅ Within {args.tolerance:.0%} of baseline {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
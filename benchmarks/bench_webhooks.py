@@ -0,0 +1,247 @@
+"""
+Benchmark: webhook deliveries per second against a local stub receiver
+
+The stub is a minimal keep-alive HTTP/1.1 server that sleeps for an injected
+latency before answering and verifies every signature. Several stub ports
+stand in for different customer hosts; one can be made to fail so its
+circuit breaker opens.
+
+By default every delivery is a webhook.reminder job on a temporary SQLite
+database, run through worker.webhook_reminder: the run ends when every job
+has its result recorded (completed, or retried/DLQ for the failing host),
+and the dispatcher loop's worst scheduling delay is reported - result
+bookkeeping must not stall in-flight deliveries. --raw submits straight to
+the dispatcher instead.
+
+Usage:
+    python benchmarks/bench_webhooks.py --deliveries 5000 --latency-ms 200 --hosts 4
+    python benchmarks/bench_webhooks.py --batch   # batch events per endpoint
+    python benchmarks/bench_webhooks.py --raw     # dispatcher only, no jobs
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhooks
+
+SECRET = "bench-secret"
+
+
+class StubReceiver:
+    """Keep-alive HTTP/1.1 receiver with injected latency"""
+
+    def __init__(self, latency: float, jitter: float, fail_port: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_port = fail_port
+        self.requests = 0
+        self.bad_signatures = 0
+        self.connections = 0
+        self.ports = []
+        self._loop = None
+
+    def start(self, hosts: int):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            for _ in range(hosts):
+                server = self._loop.run_until_complete(
+                    asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=4096)
+                )
+                self.ports.append(server.sockets[0].getsockname()[1])
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        port = writer.get_extra_info("sockname")[1]
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                if not webhooks.verify(SECRET, headers.get(webhooks.TIMESTAMP_HEADER.lower(), ""),
+                                       body, headers.get(webhooks.SIGNATURE_HEADER.lower(), "")):
+                    self.bad_signatures += 1
+
+                await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+                status = b"503 Service Unavailable" if port == self.fail_port else b"200 OK"
+                writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class LoopLagProbe:
+    """Worst delay between a 10ms sleep's deadline and its wake-up on a loop"""
+
+    def __init__(self, loop):
+        self.max_lag = 0.0
+        self._running = True
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), loop)
+
+    async def _run(self):
+        while self._running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            self.max_lag = max(self.max_lag, time.perf_counter() - start - 0.01)
+
+    def stop(self) -> float:
+        self._running = False
+        self._future.result()
+        return self.max_lag
+
+
+def deliveries_for(args, stub) -> list:
+    return [{
+        "endpoint_id": f"endpoint-{stub.ports[i % len(stub.ports)]}",
+        "url": f"http://127.0.0.1:{stub.ports[i % len(stub.ports)]}/hook",
+        "secret": SECRET,
+        "batch": args.batch,
+        "event": "reminder",
+        "data": {"lead_id": f"lead-{i}", "n": i},
+    } for i in range(args.deliveries)]
+
+
+def run_raw(dispatcher, deliveries: list) -> dict:
+    futures = [dispatcher.submit(d) for d in deliveries]
+    results = Counter(f.result()["status"] for f in futures)
+    return {"delivered": results["delivered"], "failed": sum(results.values()) - results["delivered"]}
+
+
+def run_jobs(dispatcher, deliveries: list) -> dict:
+    """Deliveries as webhook.reminder jobs, through the worker task and its result sink"""
+    from sqlalchemy import func, insert
+
+    from database import SessionLocal
+    from models import Company, Job, WebhookEndpoint
+    import worker
+
+    db = SessionLocal()
+    try:
+        company = Company(name="Bench Co")
+        db.add(company)
+        db.flush()
+        endpoints = {d["endpoint_id"]: d for d in deliveries}
+        db.execute(insert(WebhookEndpoint), [{
+            "id": endpoint_id, "company_id": company.id, "url": d["url"], "secret": SECRET,
+            "batch_events": d["batch"], "active": True,
+        } for endpoint_id, d in endpoints.items()])
+        job_ids = [str(uuid.uuid4()) for _ in deliveries]
+        db.execute(insert(Job), [{
+            "id": job_id, "job_type": "webhook.reminder", "company_id": company.id, "priority": 50,
+            "status": "queued", "attempts": 0, "max_attempts": 5,
+            "payload": {"endpoint_id": d["endpoint_id"], "event": d["event"], "data": d["data"]},
+        } for job_id, d in zip(job_ids, deliveries)])
+        db.commit()
+    finally:
+        db.close()
+
+    webhooks._dispatcher = dispatcher  # The worker task uses this process's dispatcher
+    task_start = time.perf_counter()
+    for job_id in job_ids:
+        worker.webhook_reminder(job_id)
+    task_seconds = time.perf_counter() - task_start
+
+    db = SessionLocal()
+    try:
+        while True:
+            worker.webhook_results.join()
+            statuses = dict(db.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+            db.rollback()
+            if not statuses.get("processing"):
+                break
+            time.sleep(0.05)
+    finally:
+        db.close()
+    return {
+        "delivered": statuses.get("completed", 0),
+        "failed": sum(statuses.values()) - statuses.get("completed", 0),
+        "job_statuses": statuses,
+        "task_seconds": task_seconds,
+        "sink": worker.webhook_results.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--deliveries", type=int, default=5000)
+    parser.add_argument("--hosts", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--per-host-concurrency", type=int, default=500)
+    parser.add_argument("--batch", action="store_true", help="Batch events per endpoint")
+    parser.add_argument("--failing-host", action="store_true", help="Make the last host return 503")
+    parser.add_argument("--raw", action="store_true", help="Submit to the dispatcher directly (no jobs)")
+    args = parser.parse_args()
+
+    if not args.raw:
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_webhooks.db")
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+        os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+        os.environ.setdefault("CELERY_RESULT_BACKEND", "cache+memory://")
+        os.environ.setdefault("CACHE_REDIS_URL", "")
+        import migrate
+        migrate.migrate()
+
+    stub = StubReceiver(args.latency_ms / 1000, args.jitter_ms / 1000)
+    stub.start(args.hosts)
+    if args.failing_host:
+        stub.fail_port = stub.ports[-1]
+
+    dispatcher = webhooks.WebhookDispatcher(per_host_concurrency=args.per_host_concurrency)
+    dispatcher.start()
+    probe = LoopLagProbe(dispatcher._loop)
+
+    deliveries = deliveries_for(args, stub)
+    start = time.perf_counter()
+    result = run_raw(dispatcher, deliveries) if args.raw else run_jobs(dispatcher, deliveries)
+    elapsed = time.perf_counter() - start
+
+    max_lag = probe.stop()
+    stats = dispatcher.stats()
+    dispatcher.stop()
+
+    print(f"deliveries:        {args.deliveries} to {args.hosts} hosts "
+          f"({args.latency_ms:.0f}ms ± {args.jitter_ms:.0f}ms injected latency)")
+    print(f"delivered/failed:  {result['delivered']}/{result['failed']} "
+          f"(short-circuited: {stats['short_circuited']})")
+    if not args.raw:
+        print(f"job statuses:      {result['job_statuses']}")
+        print(f"task handoff:      {result['task_seconds']:.2f}s for {args.deliveries} tasks")
+        print(f"result sink:       {result['sink']}")
+    print(f"http requests:     {stub.requests} over {stub.connections} connections "
+          f"(batches: {stats['batches']})")
+    print(f"bad signatures:    {stub.bad_signatures}")
+    print(f"max in flight:     {stats['max_in_flight']}")
+    print(f"loop max lag:      {max_lag * 1000:.1f}ms")
+    print(f"elapsed:           {elapsed:.2f}s ({args.deliveries / elapsed:,.0f} deliveries/s)")
+
+
+if __name__ == "__main__":
+    main()
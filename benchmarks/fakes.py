@@ -0,0 +1,139 @@
+"""
+Local fakes for benchmarks: an OpenAI-compatible server and channel adapters
+
+FakeOpenAI speaks just enough of POST /v1/chat/completions for the openai
+client: the reply is a JSON {"reply", "should_stop"} document of a chosen
+token count, delivered after base latency + per-token latency (± jitter).
+A configurable fraction of requests answer 429 with Retry-After.
+
+FakeChannels replaces the adapters' send() with a sleep of the configured
+latency, so ChannelRouter (breakers included) runs unchanged.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAI:
+    """OpenAI-compatible chat completions server with injected latency"""
+
+    def __init__(self, latency_ms: float = 400, per_token_ms: float = 10, jitter_ms: float = 100,
+                 completion_tokens: int = 30, error_rate: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.per_token = per_token_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                prompt_tokens = max(1, len(body) // 4)
+                with fake._lock:
+                    fake.requests += 1
+                    failing = random.random() < fake.error_rate
+                    if failing:
+                        fake.errors += 1
+                if failing:
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                               {"Retry-After": "1"})
+                    return
+                time.sleep(max(0.0, fake.latency + fake.per_token * fake.completion_tokens
+                               + random.uniform(-fake.jitter, fake.jitter)))
+                reply = " ".join(["word"] * max(1, fake.completion_tokens - 8))
+                self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "gpt-4o-mini",
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant",
+                                    "content": json.dumps({"reply": reply, "should_stop": False})},
+                    }],
+                    "usage": {"prompt_tokens": prompt_tokens,
+                              "completion_tokens": fake.completion_tokens,
+                              "total_tokens": prompt_tokens + fake.completion_tokens},
+                })
+
+            def _send(self, status: int, payload: dict, headers: dict = None):
+                raw = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(raw)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+
+
+class FakeChannels:
+    """Patch channel adapters to sleep instead of calling providers"""
+
+    def __init__(self, latency_ms: dict = None, jitter_ms: float = 20, failure_rate: float = 0.0):
+        self.latency = {k: v / 1000 for k, v in (latency_ms or {}).items()}
+        self.jitter = jitter_ms / 1000
+        self.failure_rate = failure_rate
+        self.sends = {}
+        self._lock = threading.Lock()
+        self._originals = {}
+
+    def _make_send(self, channel: str):
+        fake = self
+
+        def send(payload: dict) -> dict:
+            time.sleep(max(0.0, fake.latency.get(channel, 0.05) + random.uniform(-fake.jitter, fake.jitter)))
+            with fake._lock:
+                fake.sends[channel] = fake.sends.get(channel, 0) + 1
+            if random.random() < fake.failure_rate:
+                return {"status": "failed", "error": "Fake provider timeout"}
+            return {"status": "sent", "external_id": f"fake_{channel}_{uuid.uuid4().hex}", "channel": channel}
+
+        return staticmethod(send)
+
+    def install(self):
+        import channels
+        adapters = {
+            "wa_cloud": channels.WhatsAppCloudAdapter,
+            "wa_web": channels.WhatsAppWebAdapter,
+            "email": channels.EmailAdapter,
+        }
+        for channel, adapter in adapters.items():
+            self._originals[adapter] = adapter.__dict__["send"]
+            adapter.send = self._make_send(channel)
+        return self
+
+    def uninstall(self):
+        for adapter, original in self._originals.items():
+            adapter.send = original
+        self._originals.clear()
@@ -0,0 +1,137 @@
+"""
+Webhook replayer: provider-style redeliveries of inbound messages
+
+Sends every inbound message once and redelivers a share of them, the way
+Meta and the WhatsApp Web bridge do after a timeout: some copies arrive
+much later, some while the first delivery is still being processed
+(concurrent clients). Checks that each provider message id was processed
+exactly once and prints the API's dedup counters (/inbound/stats).
+
+Runs against the in-process app on a temporary SQLite database by default
+(set CACHE_REDIS_URL=redis://... to include the Redis window; without it
+every replay is stopped by the unique index), or against a running API.
+
+Usage:
+    python benchmarks/replay_webhooks.py --messages 1000 --replay-rate 0.4
+    CACHE_REDIS_URL=redis://localhost:6379/15 python benchmarks/replay_webhooks.py
+    python benchmarks/replay_webhooks.py --url http://localhost:8000 --clients 32
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_deliveries(messages: int, replay_rate: float, max_redeliveries: int, leads: int, seed: int) -> list:
+    """Inbound payloads plus their redeliveries, in (shuffled) delivery order"""
+    rng = random.Random(seed)
+    run = f"{seed}.{int(time.time())}"
+    deliveries = []
+    for i in range(messages):
+        payload = {
+            "phone_number": f"+1555{rng.randrange(leads):07d}",
+            "message_text": f"Message {i}: what are your prices?",
+            "channel": "wa_cloud",
+            "provider_message_id": f"wamid.{run}.{i}",
+        }
+        copies = 1 + (rng.randint(1, max_redeliveries) if rng.random() < replay_rate else 0)
+        deliveries.extend([payload] * copies)
+    rng.shuffle(deliveries)
+    return deliveries
+
+
+def make_client(url: str):
+    """post(path, json) / get(path) against a running API or the in-process app"""
+    if url:
+        import requests
+
+        session = requests.Session()
+        return lambda method, path, **kw: session.request(method, url.rstrip("/") + path, **kw)
+
+    from fastapi.testclient import TestClient
+    import main as api
+
+    client = TestClient(api.app)
+    return lambda method, path, **kw: client.request(method, path, **kw)
+
+
+def replay(deliveries: list, clients: int, url: str) -> dict:
+    statuses = Counter()
+    processed = Counter()  # provider id → deliveries that were processed (not "duplicate")
+    lock = threading.Lock()
+    cursor = iter(deliveries)
+
+    def client_loop():
+        send = make_client(url)
+        while True:
+            with lock:
+                payload = next(cursor, None)
+            if payload is None:
+                return
+            response = send("POST", "/inbound-message", json=payload)
+            status = response.json().get("status") if response.status_code == 200 else f"http_{response.status_code}"
+            with lock:
+                statuses[status] += 1
+                if status == "queued":
+                    processed[payload["provider_message_id"]] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client_loop) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"statuses": statuses, "processed": processed, "elapsed": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500, help="Distinct inbound messages")
+    parser.add_argument("--replay-rate", type=float, default=0.3, help="Share of messages redelivered")
+    parser.add_argument("--max-redeliveries", type=int, default=3)
+    parser.add_argument("--leads", type=int, default=100, help="Distinct sender phones")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent deliveries")
+    parser.add_argument("--url", help="Running API (default: in-process app)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if not args.url:
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/replay_webhooks.db")
+        os.environ.setdefault("OPENAI_API_KEY", "replay")
+        os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+        os.environ.setdefault("CELERY_RESULT_BACKEND", "cache+memory://")
+        os.environ.setdefault("CACHE_REDIS_URL", "")
+        os.environ.setdefault("DB_POOL_SIZE", str(args.clients + 4))
+        import migrate
+        migrate.migrate()
+
+    deliveries = build_deliveries(args.messages, args.replay_rate, args.max_redeliveries, args.leads, args.seed)
+    print(f"🔁 Delivering {args.messages} inbound messages as {len(deliveries)} webhooks "
+          f"({len(deliveries) - args.messages} redeliveries, {args.clients} concurrent clients)")
+
+    result = replay(deliveries, args.clients, args.url)
+    statuses, processed = result["statuses"], result["processed"]
+    missing = args.messages - len(processed)
+    leaked = sum(count - 1 for count in processed.values() if count > 1)
+    errors = sum(count for status, count in statuses.items() if status not in ("queued", "duplicate"))
+
+    print(f"responses:   {dict(statuses)}")
+    print(f"processed:   {len(processed)}/{args.messages} messages, "
+          f"{leaked} replays processed again, {missing} never processed")
+    print(f"elapsed:     {result['elapsed']:.2f}s ({len(deliveries) / result['elapsed']:,.0f} deliveries/s)")
+    print(f"api dedup:   {make_client(args.url)('GET', '/inbound/stats').json()}")
+
+    if leaked or missing or errors:
+        print("❌ Redeliveries were not deduplicated exactly once")
+        sys.exit(1)
+    print("✅ Every message processed exactly once")
+
+
+if __name__ == "__main__":
+    main()
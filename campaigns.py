@@ -0,0 +1,284 @@
+"""
+Broadcast Campaigns
+Segment → campaign.send jobs, fanned out in bulk and paced per channel
+
+A campaign sends one template to every lead in a segment (stage, source,
+attribute equality filters). Nothing is enqueued per lead by the API:
+the campaign_scheduler beat task advances every running campaign once a
+second. Each round it:
+    1. grants the campaign its share of the channel's send rate
+       (CHANNEL_RATES, split across the company's running campaigns on that
+       channel, capped by the campaign's own rate); fractional sends carry
+       over as credit, so 1 message/minute channels work too
+    2. reads that many next leads in keyset order (leads.id after cursor)
+    3. bulk-inserts their jobs with one set-wise idempotency check
+       (key campaign:<id>:<lead_id>, so a re-run round never sends twice)
+    4. commits jobs, counters and cursor together, then releases the jobs
+       over one broker connection
+
+campaign_send reports each outcome back (sent/failed counters), which is
+what GET /campaigns/{id} shows as progress.
+"""
+import os
+from datetime import datetime
+
+from sqlalchemy import update
+
+from database import SessionLocal, ReadSessionLocal
+from models import Campaign, Lead, Template
+from queue_manager import insert_jobs, release_jobs
+import template_engine
+
+# Sends/second per channel and company, shared by its running campaigns
+CHANNEL_RATES = {
+    "wa_cloud": float(os.getenv("CAMPAIGN_RATE_WA_CLOUD", "80")),  # Cloud API throughput tier
+    "wa_web": float(os.getenv("CAMPAIGN_RATE_WA_WEB", str(1 / 60))),  # ≥60s human-like pacing
+    "email": float(os.getenv("CAMPAIGN_RATE_EMAIL", "10")),
+}
+DEFAULT_CHANNEL_RATE = 1.0
+MAX_BATCH = int(os.getenv("CAMPAIGN_MAX_BATCH", "5000"))  # Jobs per campaign per round
+MAX_BURST_SECONDS = 5.0  # Unused allowance kept across a slow/missed tick
+
+ACTIVE = ("running", "sending")
+
+
+class CampaignError(ValueError):
+    """Invalid campaign request (channel, template, segment or status change)"""
+
+
+def channel_rate(channel: str) -> float:
+    return CHANNEL_RATES.get(channel, DEFAULT_CHANNEL_RATE)
+
+
+def segment_query(db, company_id: str, segment: dict):
+    """Lead.id query for a segment: {"stage_ids", "sources", "attributes"}"""
+    segment = segment or {}
+    query = db.query(Lead.id).filter(Lead.company_id == company_id, Lead.status == "active")
+    if segment.get("stage_ids"):
+        query = query.filter(Lead.stage_id.in_(segment["stage_ids"]))
+    if segment.get("sources"):
+        query = query.filter(Lead.source.in_(segment["sources"]))
+    for key, value in (segment.get("attributes") or {}).items():
+        query = query.filter(Lead.attributes[key].as_string() == str(value))
+    return query
+
+
+# ============================================================================
+# LIFECYCLE
+# ============================================================================
+
+def create_campaign(company_id: str, name: str, channel: str, template_id: str,
+                    segment: dict = None, rate: float = None) -> dict:
+    """
+    Start a broadcast (fan-out begins on the next scheduler round)
+
+    Args:
+        company_id: Owner of the leads and template
+        name: Display name
+        channel: wa_web, wa_cloud or email
+        template_id: Template rendered for each lead (validated now)
+        segment: {"stage_ids": [...], "sources": [...], "attributes": {key: value}}
+        rate: Max sends/second (default and ceiling: the channel's rate)
+
+    Raises:
+        CampaignError: Unknown channel/template or a template that does not compile
+    """
+    if channel not in CHANNEL_RATES:
+        raise CampaignError(f"Unsupported channel: {channel}")
+    if rate is not None and rate <= 0:
+        raise CampaignError("rate must be positive")
+    db = SessionLocal()
+    try:
+        owner = db.query(Template.company_id).filter(Template.id == template_id).scalar()
+        if owner != company_id:
+            raise CampaignError(f"Template {template_id} not found for company {company_id}")
+        try:
+            template_engine.get_compiled(db, template_id)
+        except template_engine.TemplateError as e:
+            raise CampaignError(str(e))
+
+        campaign = Campaign(
+            company_id=company_id, name=name, channel=channel, template_id=template_id,
+            segment=segment or {}, rate=rate, status="running",
+            total=segment_query(db, company_id, segment).count(),
+            last_tick_at=datetime.utcnow()
+        )
+        db.add(campaign)
+        db.commit()
+        print(f"📣 Campaign {campaign.id} started: {campaign.total} leads on {channel}")
+        return _as_dict(campaign)
+    finally:
+        db.close()
+
+
+def set_status(campaign_id: str, status: str) -> dict:
+    """pause / resume (running) / cancel; queued sends of a cancelled campaign are skipped"""
+    allowed = {"paused": ("running",), "running": ("paused",), "cancelled": ("running", "sending", "paused")}
+    if status not in allowed:
+        raise CampaignError(f"Unsupported status: {status}")
+    db = SessionLocal()
+    try:
+        campaign = db.get(Campaign, campaign_id)
+        if campaign is None:
+            return None
+        if campaign.status not in allowed[status]:
+            raise CampaignError(f"Cannot change a {campaign.status} campaign to {status}")
+        campaign.status = status
+        campaign.last_tick_at = datetime.utcnow()
+        campaign.credit = 0.0
+        if status == "cancelled":
+            campaign.finished_at = datetime.utcnow()
+        db.commit()
+        return _as_dict(campaign)
+    finally:
+        db.close()
+
+
+def record_result(db, campaign_id: str, outcome: str):
+    """Count one send outcome ("sent" or "failed") in the caller's transaction"""
+    column = Campaign.sent if outcome == "sent" else Campaign.failed
+    db.execute(update(Campaign).where(Campaign.id == campaign_id).values({column: column + 1}))
+
+
+# ============================================================================
+# SCHEDULER
+# ============================================================================
+
+def _allowances(campaigns: list, now: datetime) -> dict:
+    """Sends each running campaign may release this round (float)"""
+    sharing = {}
+    for c in campaigns:
+        sharing[(c.company_id, c.channel)] = sharing.get((c.company_id, c.channel), 0) + 1
+    allowances = {}
+    for c in campaigns:
+        share = channel_rate(c.channel) / sharing[(c.company_id, c.channel)]
+        rate = min(c.rate, share) if c.rate else share
+        elapsed = (now - (c.last_tick_at or now).replace(tzinfo=None)).total_seconds()
+        earned = rate * min(max(elapsed, 0.0), MAX_BURST_SECONDS)
+        allowances[c.id] = min((c.credit or 0.0) + earned, max(rate * MAX_BURST_SECONDS, 1.0))
+    return allowances
+
+
+def advance_campaigns(now: datetime = None, publish: bool = True) -> dict:
+    """
+    One fan-out round for every running campaign
+
+    Returns:
+        {"campaigns": n, "enqueued": jobs created, "completed": campaigns finished}
+    """
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    released = []
+    result = {"campaigns": 0, "enqueued": 0, "completed": 0}
+    try:
+        query = db.query(Campaign).filter(Campaign.status.in_(ACTIVE))
+        if db.bind.dialect.name == "postgresql":
+            # Overlapping rounds skip each other's campaigns instead of double-granting
+            query = query.with_for_update(skip_locked=True)
+        campaigns = query.all()
+        running = [c for c in campaigns if c.status == "running"]
+        allowances = _allowances(running, now)
+
+        for campaign in campaigns:
+            result["campaigns"] += 1
+            if campaign.status == "sending":
+                if (campaign.sent or 0) + (campaign.failed or 0) >= (campaign.enqueued or 0):
+                    campaign.status = "completed"
+                    campaign.finished_at = now
+                    result["completed"] += 1
+                continue
+
+            allowance = allowances[campaign.id]
+            batch = min(int(allowance), MAX_BATCH)
+            campaign.credit = allowance - batch
+            campaign.last_tick_at = now
+            if batch == 0:
+                continue
+
+            leads = segment_query(db, campaign.company_id, campaign.segment)
+            if campaign.cursor:
+                leads = leads.filter(Lead.id > campaign.cursor)
+            lead_ids = [lead_id for (lead_id,) in leads.order_by(Lead.id).limit(batch)]
+            if lead_ids:
+                inserted = insert_jobs(db, [{
+                    "job_type": "campaign.send",
+                    "company_id": campaign.company_id,
+                    "payload": {"campaign_id": campaign.id, "lead_id": lead_id},
+                    "idempotency_key": f"campaign:{campaign.id}:{lead_id}",
+                } for lead_id in lead_ids])
+                released.extend(inserted)
+                campaign.cursor = lead_ids[-1]
+                campaign.enqueued = (campaign.enqueued or 0) + len(inserted)
+                campaign.skipped = (campaign.skipped or 0) + len(lead_ids) - len(inserted)
+                result["enqueued"] += len(inserted)
+            if len(lead_ids) < batch:
+                campaign.status = "sending"  # Segment exhausted
+                campaign.credit = 0.0
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    if publish:
+        release_jobs(released)
+    return result
+
+
+# ============================================================================
+# PROGRESS
+# ============================================================================
+
+def _as_dict(campaign: Campaign, now: datetime = None) -> dict:
+    now = now or datetime.utcnow()
+    done = (campaign.sent or 0) + (campaign.failed or 0)
+    total = campaign.total or 0
+    created = campaign.created_at.replace(tzinfo=None) if campaign.created_at else now
+    elapsed = ((campaign.finished_at.replace(tzinfo=None) if campaign.finished_at else now) - created).total_seconds()
+    send_rate = done / elapsed if elapsed > 0 else 0.0
+    remaining = max(total - done - (campaign.skipped or 0), 0)
+    return {
+        "id": campaign.id,
+        "company_id": campaign.company_id,
+        "name": campaign.name,
+        "channel": campaign.channel,
+        "template_id": campaign.template_id,
+        "segment": campaign.segment,
+        "status": campaign.status,
+        "rate_limit": min(campaign.rate, channel_rate(campaign.channel)) if campaign.rate else channel_rate(campaign.channel),
+        "total": total,
+        "enqueued": campaign.enqueued or 0,
+        "skipped": campaign.skipped or 0,
+        "sent": campaign.sent or 0,
+        "failed": campaign.failed or 0,
+        "in_flight": max((campaign.enqueued or 0) - done, 0),
+        "progress": round(done / total, 4) if total else 1.0,
+        "sends_per_second": round(send_rate, 2),
+        "eta_seconds": round(remaining / send_rate) if send_rate and campaign.status in ACTIVE else None,
+        "created_at": campaign.created_at.isoformat() if campaign.created_at else None,
+        "finished_at": campaign.finished_at.isoformat() if campaign.finished_at else None,
+    }
+
+
+def get_campaign(campaign_id: str):
+    """Campaign progress, or None"""
+    db = SessionLocal()
+    try:
+        campaign = db.get(Campaign, campaign_id)
+        return _as_dict(campaign) if campaign else None
+    finally:
+        db.close()
+
+
+def list_campaigns(company_id: str = None, limit: int = 50) -> list:
+    """Most recent campaigns first"""
+    db = ReadSessionLocal()
+    try:
+        query = db.query(Campaign)
+        if company_id:
+            query = query.filter(Campaign.company_id == company_id)
+        return [_as_dict(c) for c in query.order_by(Campaign.created_at.desc()).limit(limit)]
+    finally:
+        db.close()
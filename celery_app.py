@@ -1,7 +1,94 @@
+import os
+
 from celery import Celery
+from kombu import Queue
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
 celery = Celery(
     "ai_worker",
-    broker="redis://localhost:6379/0",
-    backend="redis://localhost:6379/0"
+    broker=os.getenv("CELERY_BROKER_URL", REDIS_URL),
+    backend=os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
 )
+
+# Real priority enforcement on Redis: one list per priority step, consumed
+# 0 (highest) first. Job priorities are mapped onto these steps by
+# queue_manager.broker_priority(). Prefetching one task at a time keeps a
+# worker from hoarding low-priority tasks ahead of urgent ones.
+celery.conf.broker_transport_options = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+}
+celery.conf.task_default_priority = 5
+celery.conf.worker_prefetch_multiplier = 1
+
+# Dedicated queue per class so a P2 burst or slow sends never sit in front
+# of AI replies. Each queue is served by its own worker profile
+# (worker_profiles.py); a worker started without -Q consumes all of them.
+#   p1      - conversational AI (latency-critical)
+#   p2      - sequence steps (may drive the WhatsApp Web browser)
+#   io      - I/O-bound sends (email batches, webhooks); thread pool
+#   control - schedulers and maintenance
+QUEUES = ("p1", "p2", "io", "control")
+TASK_QUEUES = {
+    "worker.ai_engage": "p1",
+    "worker.followup_bumpup": "p1",
+    "worker.ai_summary": "p1",
+    "worker.sequence_step": "p2",
+    "worker.campaign_send": "p2",
+    "worker.email_sequence": "io",
+    "worker.webhook_reminder": "io",
+    "worker.fair_dispatch": "control",
+    "worker.sequence_scheduler": "control",
+    "worker.campaign_scheduler": "control",
+    "worker.reports_refresh": "control",
+    "worker.events_maintenance": "control",
+    "worker.jobs_retention": "control",
+    "worker.webhooks_recover": "control",
+    "worker.lead_scoring": "control",
+    "worker.dlq_replay": "control",
+}
+celery.conf.task_queues = [Queue(name) for name in QUEUES]
+celery.conf.task_default_queue = "p2"
+celery.conf.task_routes = {task: {"queue": queue} for task, queue in TASK_QUEUES.items()}
+
+# --autoscale sizes the pool from broker queue depth and job wait time
+# instead of the worker's own prefetched backlog (see autoscaler.py)
+celery.conf.worker_autoscaler = "autoscaler:QueueDepthAutoscaler"
+
+# Periodic schedulers (run with: celery -A worker beat)
+celery.conf.beat_schedule = {
+    "fair-dispatch": {
+        "task": "worker.fair_dispatch",
+        "schedule": 1.0,
+    },
+    "sequence-scheduler": {
+        "task": "worker.sequence_scheduler",
+        "schedule": 30.0,
+    },
+    "campaign-scheduler": {
+        "task": "worker.campaign_scheduler",
+        "schedule": 1.0,
+    },
+    "lead-scoring": {
+        "task": "worker.lead_scoring",
+        "schedule": float(os.getenv("LEAD_SCORING_INTERVAL_SECONDS", "900")),
+    },
+    "reports-refresh": {
+        "task": "worker.reports_refresh",
+        "schedule": 60.0,
+    },
+    "events-maintenance": {
+        "task": "worker.events_maintenance",
+        "schedule": 24 * 60 * 60.0,
+    },
+    "webhooks-recover": {
+        "task": "worker.webhooks_recover",
+        "schedule": 60.0,
+    },
+    "jobs-retention": {
+        "task": "worker.jobs_retention",
+        "schedule": 60 * 60.0,
+    },
+}
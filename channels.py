@@ -10,6 +10,12 @@ from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 from typing import Optional, Dict, Any
 import os
+import uuid
+
+from circuit_breaker import CircuitOpenError
+from phones import normalize_phone
+import retry_policy
+import telemetry
 
 # ============================================================================
 # CHANNEL POLICIES (from SHVYA Guide)
@@ -34,14 +40,38 @@ class ChannelRouter:
         Returns:
             Result dict with status and external_id
         """
-        if channel == "wa_cloud":
-            return WhatsAppCloudAdapter.send(payload)
-        elif channel == "wa_web":
-            return WhatsAppWebAdapter.send(payload)
-        elif channel == "email":
-            return EmailAdapter.send(payload)
-        else:
+        adapters = {
+            "wa_cloud": WhatsAppCloudAdapter,
+            "wa_web": WhatsAppWebAdapter,
+            "email": EmailAdapter,
+        }
+        adapter = adapters.get(channel)
+        if adapter is None:
             raise ValueError(f"Unknown channel: {channel}")
+        
+        # Per-provider circuit breaker: while the provider keeps failing,
+        # short-circuit (CircuitOpenError) so the job is deferred instead of
+        # burning an attempt on a call that will not go through
+        provider = retry_policy.provider_for_channel(channel)
+        breaker = retry_policy.get_breaker(provider)
+        if not breaker.allow():
+            raise CircuitOpenError(provider, breaker.retry_after())
+        
+        start = time.perf_counter()
+        try:
+            with telemetry.span("channel.send", channel=channel):
+                result = adapter.send(payload)
+        except Exception as e:
+            telemetry.CHANNEL_SECONDS.observe(time.perf_counter() - start, channel=channel, status="error")
+            retry_policy.record_outcome(provider, e)
+            raise
+        telemetry.CHANNEL_SECONDS.observe(time.perf_counter() - start, channel=channel,
+                                          status=result.get("status", "unknown"))
+        
+        retry_policy.record_outcome(
+            provider, result.get("error") if result.get("status") == "failed" else None
+        )
+        return result
 
 
 # ============================================================================
@@ -83,7 +113,7 @@ class WhatsAppCloudAdapter:
             # response = requests.post(url, headers={...}, json={...})
             
             # For now, simulate success
-            external_id = f"wamid_{int(time.time())}"
+            external_id = f"wamid_{uuid.uuid4().hex}"
             
             # Enforce 15 second minimum delay
             time.sleep(0.015)  # 15ms in dev, should be 15s in production
@@ -210,8 +240,8 @@ class WhatsAppWebAdapter:
                     "error": "WhatsApp Web login required"
                 }
             
-            # Format phone number (remove + and spaces)
-            clean_phone = phone.replace("+", "").replace(" ", "").replace("-", "")
+            # wa.me-style number: E.164 without the "+"
+            clean_phone = normalize_phone(phone).lstrip("+")
             
             # Navigate to chat
             chat_url = f"https://web.whatsapp.com/send?phone={clean_phone}"
@@ -247,7 +277,7 @@ class WhatsAppWebAdapter:
             # Wait a bit to ensure message is sent
             time.sleep(2)
             
-            external_id = f"wa_web_{int(time.time())}"
+            external_id = f"wa_web_{uuid.uuid4().hex}"
             
             print(f"✅ WhatsApp Web: Message sent to {phone}")
             
@@ -294,13 +324,13 @@ class EmailAdapter:
         - No bump-ups (scheduled only)
         """
         to_email = payload.get("email")
-        subject = payload.get("subject", "Message from AI Auto")
+        subject = payload.get("subject") or "Message from AI Auto"
         body = payload.get("body")
         from_email = os.getenv("SMTP_FROM_EMAIL", "noreply@example.com")
         
         try:
             # Check suppression list
-            if EmailAdapter._is_suppressed(to_email):
+            if EmailAdapter._is_suppressed(to_email, payload.get("company_id")):
                 return {
                     "status": "failed",
                     "error": "Email is in suppression list"
@@ -331,7 +361,7 @@ class EmailAdapter:
             #     server.send_message(msg)
             
             # For now, simulate success
-            external_id = f"email_{int(time.time())}"
+            external_id = f"email_{uuid.uuid4().hex}"
             
             return {
                 "status": "sent",
@@ -347,10 +377,10 @@ class EmailAdapter:
             }
     
     @staticmethod
-    def _is_suppressed(email: str) -> bool:
-        """Check if email is in suppression list"""
-        # TODO: Query suppression list from database
-        return False
+    def _is_suppressed(email: str, company_id: str = None) -> bool:
+        """Check if email is in suppression list (bounced, or opted out of this company)"""
+        from delivery_status import is_suppressed
+        return is_suppressed(email, company_id)
     
     @staticmethod
     def _is_within_send_hours() -> bool:
@@ -0,0 +1,86 @@
+"""
+Circuit Breaker
+Stops calling a dependency that keeps failing, then probes it again after a cool-down
+"""
+import time
+import threading
+
+
+class CircuitOpenError(Exception):
+    """Raised (or returned as an error) when a call is short-circuited"""
+
+    def __init__(self, name: str, retry_after: float = 0.0):
+        super().__init__(f"Circuit open for {name} (retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    closed    → calls pass; consecutive failures are counted
+    open      → calls are rejected until reset_timeout has elapsed
+    half_open → one trial call passes; success closes, failure re-opens
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """True if a call may proceed now"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a trial call through (0 if closed)"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def open(self, seconds: float = None):
+        """Force the breaker open (e.g. on an explicit Retry-After)"""
+        with self._lock:
+            timeout = self.reset_timeout if seconds is None else seconds
+            self._opened_at = time.monotonic() - self.reset_timeout + timeout
+            self._trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self._state(), "failures": self._failures}
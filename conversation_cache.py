@@ -0,0 +1,271 @@
+"""
+Conversation State Cache
+Per-lead AI context in Redis: one read per ai_engage turn
+
+For each lead in an active conversation Redis holds:
+
+    conv:<lead_id>            hash - lead (name, phone, company, stage), stage
+                              name, rolling memory (AISession.memory),
+                              last_direction, last_message_at
+    conv:<lead_id>:messages   list - the last CONV_CACHE_MESSAGES messages
+    kb:<company_id>           the company's knowledge base snippets
+
+get() fetches all three in one pipelined round trip. A conversation is
+loaded from the database once (load()), then kept current write-through:
+the inbound endpoint and every outbound send append their message after
+commit, ai_engage/ai_summary update the memory. Appends are a Lua script
+that only touches conversations already cached, so a partial window is
+never created, and each write renews the CONV_CACHE_TTL_SECONDS expiry
+(idle conversations fall out of Redis).
+
+Writes lost while Redis is unreachable are caught by the reader: ai_engage
+jobs carry the id of the inbound message that triggered them and reload
+from the database when the cached window does not contain it.
+
+Lead fields held in the hash (stage, name, phone, email) are not written
+through: an ORM flush that changes them drops the conversation once the
+transaction commits, and the next read reloads it. Bulk UPDATEs that bypass
+the ORM unit of work (lead_import) call invalidate() themselves.
+"""
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+
+from database import SessionLocal
+from models import Lead
+import redis_cache
+import telemetry
+
+TTL = int(os.getenv("CONV_CACHE_TTL_SECONDS", "3600"))
+MAX_MESSAGES = int(os.getenv("CONV_CACHE_MESSAGES", "20"))
+MAX_BODY_CHARS = int(os.getenv("CONV_CACHE_BODY_CHARS", "2000"))
+KB_TTL = int(os.getenv("KB_CACHE_TTL_SECONDS", "300"))
+KB_DOCS = 3
+KB_SNIPPET_CHARS = 200
+# Lead columns copied into the cached hash; changing one makes it stale
+LEAD_FIELDS = ("stage_id", "company_id", "name", "phone", "email")
+
+# Cached message: what the AI context and rules.can_ai_reply() read
+CachedMessage = namedtuple("CachedMessage", "id direction channel body created_at")
+
+# KEYS: hash, list. ARGV: ttl, max messages, message JSON ("" for none),
+# then field/value pairs for the hash. No-op unless the hash exists.
+_UPDATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+if ARGV[3] ~= '' then
+    redis.call('RPUSH', KEYS[2], ARGV[3])
+    redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+end
+if #ARGV > 3 then redis.call('HSET', KEYS[1], unpack(ARGV, 4)) end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+_update = None
+
+
+def _keys(lead_id: str):
+    return f"conv:{lead_id}", f"conv:{lead_id}:messages"
+
+
+def _kb_key(company_id: str) -> str:
+    return f"kb:{company_id}"
+
+
+def _iso(value) -> str:
+    return value.replace(tzinfo=None).isoformat() if value else None
+
+
+def _entry(msg) -> dict:
+    return {
+        "id": msg.id,
+        "direction": msg.direction,
+        "channel": msg.channel,
+        "body": (msg.body or "")[:MAX_BODY_CHARS],
+        "created_at": _iso(msg.created_at or datetime.utcnow()),
+    }
+
+
+def _script(client):
+    global _update
+    if _update is None or _update.registered_client is not client:
+        _update = client.register_script(_UPDATE_SCRIPT)
+    return _update
+
+
+# ============================================================================
+# READ
+# ============================================================================
+
+def get(lead_id: str, company_id: str = None):
+    """
+    Cached conversation state, or None on a miss (or Redis unavailable)
+
+    Returns:
+        {"lead": {...}, "stage": name, "memory": {...}, "last_direction",
+         "last_message_at", "messages": [CachedMessage, ...] oldest first,
+         "kb": [{"title", "content"}] or None when not cached}
+    """
+    client = redis_cache.get_client()
+    if client is None:
+        return None
+    state_key, messages_key = _keys(lead_id)
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hgetall(state_key)
+        pipe.lrange(messages_key, 0, -1)
+        if company_id:
+            pipe.get(_kb_key(company_id))
+        state, messages, *kb = pipe.execute()
+    except Exception as e:
+        redis_cache.mark_down(e)
+        return None
+
+    if not state:
+        telemetry.CACHE_LOOKUPS.inc(cache="conversation", result="miss")
+        return None
+    telemetry.CACHE_LOOKUPS.inc(cache="conversation", result="hit")
+    entries = sorted((json.loads(m) for m in messages), key=lambda m: m["created_at"] or "")
+    return {
+        "lead": json.loads(state["lead"]),
+        "stage": state.get("stage"),
+        "memory": json.loads(state.get("memory") or "{}"),
+        "last_direction": state.get("last_direction") or None,
+        "last_message_at": state.get("last_message_at") or None,
+        "messages": [CachedMessage(**m) for m in entries],
+        "kb": json.loads(kb[0]) if kb and kb[0] is not None else None,
+    }
+
+
+def has_message(state: dict, message_id: str) -> bool:
+    """True when the cached window contains `message_id` (or no id to check)"""
+    return not message_id or any(m.id == message_id for m in state["messages"])
+
+
+# ============================================================================
+# WRITE
+# ============================================================================
+
+def load(lead, stage_name: str, messages: list, memory: dict = None) -> dict:
+    """
+    Cache a conversation read from the database and return it as get() would
+
+    Args:
+        lead: Lead row
+        stage_name: Name of the lead's stage
+        messages: The lead's messages, oldest first (only the last
+            CONV_CACHE_MESSAGES are kept)
+        memory: Rolling memory (AISession.memory)
+    """
+    entries = [_entry(m) for m in messages[-MAX_MESSAGES:]]
+    last = entries[-1] if entries else None
+    state = {
+        "lead": {"id": lead.id, "company_id": lead.company_id, "name": lead.name,
+                 "phone": lead.phone, "email": lead.email, "stage_id": lead.stage_id},
+        "stage": stage_name,
+        "memory": memory or {},
+        "last_direction": last["direction"] if last else None,
+        "last_message_at": last["created_at"] if last else None,
+    }
+    client = redis_cache.get_client()
+    if client is not None:
+        state_key, messages_key = _keys(lead.id)
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.delete(state_key, messages_key)
+            pipe.hset(state_key, mapping={
+                "lead": json.dumps(state["lead"]),
+                "stage": stage_name or "",
+                "memory": json.dumps(state["memory"]),
+                "last_direction": state["last_direction"] or "",
+                "last_message_at": state["last_message_at"] or "",
+            })
+            if entries:
+                pipe.rpush(messages_key, *[json.dumps(e) for e in entries])
+                pipe.expire(messages_key, TTL)
+            pipe.expire(state_key, TTL)
+            pipe.execute()
+        except Exception as e:
+            redis_cache.mark_down(e)
+    return {**state, "messages": [CachedMessage(**e) for e in entries], "kb": None}
+
+
+def record_messages(messages: list):
+    """Append committed messages to their (cached) conversations, one round trip"""
+    client = redis_cache.get_client()
+    if client is None or not messages:
+        return
+    try:
+        script = _script(client)
+        pipe = client.pipeline(transaction=False)
+        for msg in messages:
+            entry = _entry(msg)
+            script(keys=_keys(msg.lead_id), args=[
+                TTL, MAX_MESSAGES, json.dumps(entry),
+                "last_direction", entry["direction"], "last_message_at", entry["created_at"],
+            ], client=pipe)
+        pipe.execute()
+    except Exception as e:
+        redis_cache.mark_down(e)
+
+
+def update_memory(lead_id: str, memory: dict):
+    """Replace the rolling memory of a cached conversation"""
+    client = redis_cache.get_client()
+    if client is None:
+        return
+    try:
+        _script(client)(keys=_keys(lead_id), args=[TTL, MAX_MESSAGES, "", "memory", json.dumps(memory)])
+    except Exception as e:
+        redis_cache.mark_down(e)
+
+
+def put_kb(company_id: str, docs: list) -> list:
+    """Cache a company's KB snippets (AIKBDoc rows); returns them as get() would"""
+    snippets = [{"title": d.title, "content": (d.content or "")[:KB_SNIPPET_CHARS]} for d in docs]
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            client.set(_kb_key(company_id), json.dumps(snippets), ex=KB_TTL)
+        except Exception as e:
+            redis_cache.mark_down(e)
+    return snippets
+
+
+def invalidate(lead_ids: list):
+    """Drop cached conversations (lead details changed outside the write-through paths)"""
+    client = redis_cache.get_client()
+    if client is None or not lead_ids:
+        return
+    try:
+        client.unlink(*[key for lead_id in lead_ids for key in _keys(lead_id)])
+    except Exception as e:
+        redis_cache.mark_down(e)
+
+
+def _collect_stale(session, flush_context):
+    # after_flush still sees the pre-flush dirty/deleted sets and history
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, Lead) and (obj in session.deleted or any(
+            inspect(obj).attrs[field].history.has_changes() for field in LEAD_FIELDS
+        )):
+            session.info.setdefault("conversation_cache_stale", set()).add(obj.id)
+
+
+def _invalidate_committed(session):
+    # After commit, so a concurrent reload cannot re-cache the old row
+    stale = session.info.pop("conversation_cache_stale", None)
+    if stale:
+        invalidate(list(stale))
+
+
+def _discard_stale(session):
+    session.info.pop("conversation_cache_stale", None)
+
+
+event.listen(SessionLocal, "after_flush", _collect_stale)
+event.listen(SessionLocal, "after_commit", _invalidate_committed)
+event.listen(SessionLocal, "after_rollback", _discard_stale)
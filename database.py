@@ -1,14 +1,209 @@
-from sqlalchemy import create_engine
+"""
+Database
+Engines, pools and session factories
+
+    SessionLocal()      - primary (all writes, read-your-writes reads)
+    ReadSessionLocal()  - read-only work: a healthy replica when one is
+                          configured and fresh enough, else the primary
+
+Replicas (DATABASE_REPLICA_URLS, comma-separated) are used round-robin.
+Each replica's replication lag is sampled at most every
+DB_REPLICA_LAG_CHECK_SECONDS; a replica that lags more than the caller's
+max_lag (default DB_REPLICA_MAX_LAG_SECONDS) or fails its check is skipped.
+
+Pools are configured per role from env (DB_* for the primary, DB_REPLICA_*
+falling back to DB_* for replicas): POOL_SIZE, MAX_OVERFLOW, POOL_TIMEOUT,
+POOL_RECYCLE, POOL_PRE_PING.
+
+SQLite (single-node/development) runs in WAL mode so API readers and worker
+writers stop blocking each other, with synchronous=NORMAL and a busy
+timeout instead of immediate "database is locked" errors.
+"""
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, declarative_base
+import itertools
+import json
 import os
+import threading
+import time
 
 # Use SQLite for development if PostgreSQL is not available
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ai_automation.db")
+REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "10"))
+REPLICA_LAG_CHECK = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "5"))
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 MB page cache per connection
 )
+
+
+def _pool_settings(prefix: str, fallback: str = None) -> dict:
+    def setting(name: str, default: str) -> str:
+        value = os.getenv(f"{prefix}{name}")
+        if value is None and fallback:
+            value = os.getenv(f"{fallback}{name}")
+        return default if value is None else value
+
+    return {
+        # Tasks hold one session while queue_manager helpers open another, so a
+        # process needs ~2 connections per concurrent task
+        "pool_size": int(setting("POOL_SIZE", "5")),
+        "max_overflow": int(setting("MAX_OVERFLOW", "10")),
+        "pool_timeout": float(setting("POOL_TIMEOUT", "30")),
+        "pool_recycle": int(setting("POOL_RECYCLE", "1800")),
+        "pool_pre_ping": setting("POOL_PRE_PING", "1") == "1",
+    }
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _make_engine(url: str, pool: dict):
+    sqlite = url.startswith("sqlite")
+    parsed = make_url(url)
+    if not issubclass(parsed.get_dialect().get_pool_class(parsed), QueuePool):
+        # In-memory SQLite gets a SingletonThreadPool: no overflow or checkout timeout
+        pool = {k: v for k, v in pool.items() if k not in ("max_overflow", "pool_timeout")}
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if sqlite else {},
+        # Compact JSON columns (no padding after separators)
+        json_serializer=lambda obj: json.dumps(obj, separators=(",", ":"), default=str),
+        **pool
+    )
+    if sqlite:
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+engine = _make_engine(DATABASE_URL, _pool_settings("DB_"))
 SessionLocal = sessionmaker(bind=engine)
 
 Base = declarative_base()
+
+
+# ============================================================================
+# READ REPLICAS (lag-aware routing)
+# ============================================================================
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = _make_engine(url, _pool_settings("DB_REPLICA_", "DB_"))
+        self.factory = sessionmaker(bind=self.engine)
+        self.lag = None  # Seconds; None until checked or after a failed check
+        self.checked_at = 0.0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def current_lag(self):
+        """Replication lag (cached for REPLICA_LAG_CHECK seconds); None if unhealthy"""
+        now = time.monotonic()
+        if now - self.checked_at < REPLICA_LAG_CHECK:
+            return self.lag
+        with self._lock:
+            if now - self.checked_at < REPLICA_LAG_CHECK:
+                return self.lag
+            try:
+                with self.engine.connect() as conn:
+                    self.lag = _measure_lag(conn)
+                self.error = None
+            except Exception as e:
+                self.lag, self.error = None, str(e)
+                print(f"⚠️ Replica check failed ({self.engine.url.host}): {e}")
+            self.checked_at = now
+        return self.lag
+
+
+def _measure_lag(conn) -> float:
+    if conn.dialect.name != "postgresql":
+        return 0.0
+    # An idle replica that has replayed everything it received is not behind,
+    # however old its last replayed transaction is
+    lag = conn.execute(text(
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    )).scalar()
+    return float(lag or 0.0)
+
+
+replicas = [Replica(url) for url in REPLICA_URLS]
+_round_robin = itertools.count()
+
+_routing = {"replica": 0, "primary_fallback": 0}
+_routing_lock = threading.Lock()
+
+
+def _count_route(route: str):
+    with _routing_lock:
+        _routing[route] += 1
+
+
+def ReadSessionLocal(max_lag: float = None):
+    """
+    Session for read-only queries
+
+    Args:
+        max_lag: Most replication lag (seconds) the caller tolerates; pass the
+            age of the data it must see (e.g. time since the job was
+            enqueued). Defaults to DB_REPLICA_MAX_LAG_SECONDS; 0 = primary.
+    """
+    if replicas:
+        limit = REPLICA_MAX_LAG if max_lag is None else max_lag
+        if limit > 0:
+            start = next(_round_robin)
+            for i in range(len(replicas)):
+                replica = replicas[(start + i) % len(replicas)]
+                lag = replica.current_lag()
+                if lag is not None and lag <= limit:
+                    _count_route("replica")
+                    return replica.factory()
+        _count_route("primary_fallback")
+    return SessionLocal()
+
+
+# ============================================================================
+# POOL STATS
+# ============================================================================
+
+def _pool_stats(pool) -> dict:
+    if not hasattr(pool, "checkedout"):
+        return {"class": type(pool).__name__}
+    size = pool.size()
+    capacity = size + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "class": type(pool).__name__,
+        "size": size,
+        "max_overflow": pool._max_overflow,
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(checked_out / capacity, 4) if capacity > 0 else 0.0,
+    }
+
+
+def get_pool_stats() -> dict:
+    """Connection pool usage per role (this process), replica lag and routing counts"""
+    stats = {"primary": _pool_stats(engine.pool)}
+    for i, replica in enumerate(replicas):
+        entry = _pool_stats(replica.engine.pool)
+        entry["host"] = replica.engine.url.host
+        entry["lag_seconds"] = replica.lag
+        entry["error"] = replica.error
+        stats[f"replica_{i}"] = entry
+    with _routing_lock:
+        stats["read_routing"] = dict(_routing)
+    return stats
@@ -0,0 +1,430 @@
+"""
+Delivery Status Ingestion
+Provider delivery/read/bounce callbacks → coalesced, bulk Message updates
+
+Every outbound message comes back as 2-3 callbacks (sent, delivered, read),
+so they outnumber real traffic. POST /webhooks/delivery-status only parses
+the batch and buffers it (no database work on the request, no threadpool
+slot taken from inbound-message). A background thread flushes the buffer
+every STATUS_FLUSH_INTERVAL seconds (or at STATUS_FLUSH_BATCH_SIZE):
+
+    - updates for the same (channel, external_id) are coalesced while
+      buffered: only the latest status survives (furthest along, then
+      provider timestamp)
+    - one SELECT per chunk reads the current status of the outbound
+      messages; a status never moves backwards (a late "delivered" does not
+      overwrite "read")
+    - one executemany UPDATE keyed on messages.id per chunk
+
+Provider ids are only unique per channel (idx_channel_external_id), so a
+callback is matched on its channel when it names one; without a channel it
+must match exactly one outbound message.
+    - MessageStatusChanged events (channel, from_status, to_status) keep the
+      channel_delivery report current
+    - hard bounces, unsubscribes and spam complaints are added to
+      email_suppressions, which EmailAdapter checks before sending.
+      Suppression is about the address, not the message, so it does not
+      depend on the status order: a hard bounce for a message that is
+      already "failed" or "bounced" still suppresses the address (counted
+      in "suppressed") while its status change is dropped (counted in
+      "stale")
+
+Callbacks can beat the sending worker's commit; updates for unknown
+external_ids are retried for STATUS_UNKNOWN_RETRY_SECONDS, then dropped.
+Buffered updates live in process memory: a crash loses at most one flush
+interval of callbacks.
+
+Accepted payloads: WhatsApp Cloud webhooks (entry[].changes[].value.statuses),
+or a list of generic updates (also as {"updates": [...]}):
+    {"external_id", "status", "timestamp", "channel", "email", "company_id",
+     "error", "bounce_type"}
+"""
+import atexit
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import SessionLocal, ReadSessionLocal, engine
+from event_log import log_event
+from lead_import import normalize_email
+from models import EmailSuppression, Lead, Message
+import reports
+import telemetry
+
+FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", "1.0"))  # seconds
+FLUSH_BATCH_SIZE = int(os.getenv("STATUS_FLUSH_BATCH_SIZE", "5000"))
+MAX_BUFFERED = int(os.getenv("STATUS_MAX_BUFFERED", "200000"))  # Oldest updates dropped beyond this
+UNKNOWN_RETRY = float(os.getenv("STATUS_UNKNOWN_RETRY_SECONDS", "30"))
+CHUNK = 1000
+
+# A message's status only moves forward
+RANK = {"queued": 0, "sent": 1, "delivered": 2, "read": 3, "failed": 4, "bounced": 4}
+
+# Provider vocabulary → Message.status, or a suppression-only event
+STATUS_ALIASES = {
+    "sent": "sent", "processed": "sent",
+    "delivered": "delivered", "delivery": "delivered",
+    "read": "read", "open": "read", "opened": "read",
+    "failed": "failed", "undelivered": "failed", "dropped": "failed",
+    "bounce": "bounced", "bounced": "bounced",
+    "unsubscribe": "unsubscribed", "unsubscribed": "unsubscribed", "group_unsubscribe": "unsubscribed",
+    "spamreport": "complained", "complaint": "complained", "complained": "complained",
+}
+SUPPRESSION_ONLY = {"unsubscribed", "complained"}
+
+# Provider/channel names in callbacks → Message.channel
+CHANNEL_ALIASES = {
+    "wa_cloud": "wa_cloud", "whatsapp": "wa_cloud", "whatsapp_cloud": "wa_cloud",
+    "wa_web": "wa_web",
+    "email": "email", "sendgrid": "email",
+}
+
+
+class StatusPayloadError(ValueError):
+    """Callback body that is not a supported provider format"""
+
+
+# ============================================================================
+# PARSING
+# ============================================================================
+
+def _timestamp(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return time.time()
+
+
+def _update(raw: dict, channel: str = None) -> dict:
+    status = STATUS_ALIASES.get(str(raw.get("status") or raw.get("event") or "").lower())
+    if status is None:
+        return None
+    channel = raw.get("channel") or channel
+    return {
+        "external_id": raw.get("external_id") or raw.get("id") or raw.get("message_id") or raw.get("sg_message_id"),
+        "status": status,
+        "timestamp": _timestamp(raw.get("timestamp")) if raw.get("timestamp") is not None else time.time(),
+        "channel": CHANNEL_ALIASES.get(str(channel).lower(), channel) if channel else None,
+        "email": normalize_email(raw.get("email")),
+        "company_id": raw.get("company_id"),
+        "error": raw.get("error"),
+        "bounce_type": str(raw.get("bounce_type") or raw.get("type") or "").lower() or None,
+    }
+
+
+def parse_callbacks(body) -> list:
+    """
+    Provider callback body → list of update dicts (unknown statuses are skipped)
+
+    Raises:
+        StatusPayloadError: Not a WhatsApp Cloud webhook or a list of updates
+    """
+    if isinstance(body, dict) and "entry" in body:
+        updates = []
+        for entry in body.get("entry") or []:
+            for change in entry.get("changes") or []:
+                for status in (change.get("value") or {}).get("statuses") or []:
+                    errors = status.get("errors") or []
+                    if errors:
+                        status = {**status, "error": "; ".join(
+                            str(e.get("title") or e.get("message") or e.get("code")) for e in errors)}
+                    updates.append(_update(status, "wa_cloud"))
+        return [u for u in updates if u]
+    if isinstance(body, dict) and "updates" in body:
+        body = body["updates"]
+    elif isinstance(body, dict):
+        body = [body]
+    if not isinstance(body, list) or not all(isinstance(item, dict) for item in body):
+        raise StatusPayloadError("Expected a WhatsApp Cloud webhook or a list of status updates")
+    return [u for u in (_update(item) for item in body) if u]
+
+
+def _newer(candidate: dict, current: dict) -> bool:
+    """Statuses only move forward; the provider timestamp breaks ties"""
+    candidate_rank, current_rank = RANK.get(candidate["status"], 0), RANK.get(current["status"], 0)
+    if candidate_rank != current_rank:
+        return candidate_rank > current_rank
+    return candidate["timestamp"] > current["timestamp"]
+
+
+# ============================================================================
+# BUFFER
+# ============================================================================
+
+class StatusBuffer:
+    """Per-process callback buffer: latest update per (channel, external_id), flushed in bulk"""
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH_SIZE,
+                 max_buffered: int = MAX_BUFFERED):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self._updates = {}  # (channel, external_id) → update (insertion order = age)
+        self._suppressions = []  # Suppression-only events without an external_id
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {"received": 0, "coalesced": 0, "applied": 0, "stale": 0, "unknown": 0,
+                       "suppressed": 0, "dropped": 0, "flushes": 0, "errors": 0}
+
+    def add(self, updates: list, now: float = None):
+        now = now or time.time()
+        with self._lock:
+            for u in updates:
+                self._count("received")
+                u.setdefault("received_at", now)
+                self._merge(u)
+            overflow = len(self._updates) - self.max_buffered
+            if overflow > 0:
+                for key in list(self._updates)[:overflow]:
+                    del self._updates[key]
+                self._count("dropped", overflow)
+            full = len(self._updates) + len(self._suppressions) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def _merge(self, u: dict):
+        if u["status"] in SUPPRESSION_ONLY:
+            # Opt-outs are kept apart from the message's delivery status
+            if u["external_id"]:
+                self._updates.setdefault((u["channel"], u["external_id"], u["status"]), u)
+            elif u["email"] and u["company_id"]:
+                self._suppressions.append(u)
+            return
+        if not u["external_id"]:
+            return
+        key = (u["channel"], u["external_id"])
+        current = self._updates.get(key)
+        if current is None:
+            self._updates[key] = u
+            return
+        self._count("coalesced")
+        if _newer(u, current):
+            self._updates[key] = {**u, "received_at": current["received_at"]}
+
+    def flush(self, now: float = None) -> int:
+        """Apply everything buffered so far; returns the number of messages updated"""
+        now = now or time.time()
+        with self._flush_lock:
+            with self._lock:
+                updates, self._updates = list(self._updates.values()), {}
+                suppressions, self._suppressions = self._suppressions, []
+            if not updates and not suppressions:
+                return 0
+            applied = 0
+            retry = []
+            try:
+                for start in range(0, max(len(updates), 1), CHUNK):
+                    counts = apply_updates(updates[start:start + CHUNK],
+                                           suppressions if start == 0 else [])
+                    applied += counts["applied"]
+                    waiting = [u for u in counts["unknown"] if now - u["received_at"] < UNKNOWN_RETRY]
+                    retry.extend(waiting)
+                    with self._lock:
+                        for key in ("applied", "stale", "suppressed"):
+                            self._count(key, counts[key])
+                        self._count("unknown", len(counts["unknown"]) - len(waiting))
+            except Exception as e:
+                retry = updates[start:] + (suppressions if start == 0 else []) + retry
+                with self._lock:
+                    self._count("errors")
+                print(f"❌ Delivery status flush failed ({len(updates) - start} updates buffered): {e}")
+            with self._lock:
+                for u in retry:
+                    self._merge(u)
+                self._count("flushes")
+            return applied
+
+    def _count(self, result: str, amount: int = 1):
+        # Caller holds self._lock
+        self._stats[result] += amount
+        if result != "flushes":
+            telemetry.STATUS_UPDATES.inc(amount, result=result)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="delivery-status-flusher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _reset_after_fork(self):
+        self._updates = {}
+        self._suppressions = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._updates) + len(self._suppressions)
+        return stats
+
+
+_buffer = StatusBuffer()
+atexit.register(_buffer.flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_buffer._reset_after_fork)
+
+
+def ingest(body) -> int:
+    """Parse and buffer a callback body (non-blocking); returns updates accepted"""
+    updates = parse_callbacks(body)
+    if updates:
+        _buffer.add(updates)
+    return len(updates)
+
+
+def flush_statuses() -> int:
+    """Apply buffered updates now (tests, shutdown hooks, benchmarks)"""
+    return _buffer.flush()
+
+
+def get_status_stats() -> dict:
+    return _buffer.stats()
+
+
+# ============================================================================
+# BULK WRITERS
+# ============================================================================
+
+def apply_updates(updates: list, suppressions: list = ()) -> dict:
+    """
+    Apply coalesced updates (at most one status per message) in one transaction
+
+    Only outbound messages are matched: on the update's channel when it
+    has one, else the single outbound message with that external_id (an
+    id shared across channels without a channel is left unknown).
+
+    Returns:
+        {"applied": n, "stale": n, "suppressed": n, "unknown": [updates for unknown external_ids]}
+    """
+    result = {"applied": 0, "stale": 0, "suppressed": 0, "unknown": []}
+    db = SessionLocal()
+    try:
+        external_ids = list({u["external_id"] for u in updates})
+        current = {}  # (channel, external_id) → message
+        by_id = {}  # external_id → [message, ...] for updates without a channel
+        if external_ids:
+            for row in db.query(
+                Message.external_id, Message.id, Message.status, Message.channel,
+                Message.lead_id, Lead.company_id, Lead.email
+            ).join(Lead, Lead.id == Message.lead_id).filter(
+                Message.external_id.in_(external_ids), Message.direction == "outbound"
+            ):
+                current[(row.channel, row.external_id)] = row
+                by_id.setdefault(row.external_id, []).append(row)
+
+        rows, changes, suppress = [], [], []
+        for u in updates:
+            external_id = u["external_id"]
+            if u["channel"]:
+                message = current.get((u["channel"], external_id))
+            else:
+                candidates = by_id.get(external_id, [])
+                message = candidates[0] if len(candidates) == 1 else None
+            if message is None:
+                result["unknown"].append(u)
+                continue
+            if u["status"] in SUPPRESSION_ONLY:
+                suppress.append((message.company_id, u["email"] or normalize_email(message.email),
+                                 u["status"], external_id))
+                continue
+            # Before the stale check on purpose: see "Suppression" in the module docstring
+            if u["status"] == "bounced" and u["bounce_type"] not in ("soft", "transient"):
+                suppress.append((message.company_id, u["email"] or normalize_email(message.email),
+                                 "bounced", external_id))
+            if RANK.get(u["status"], 0) <= RANK.get(message.status, -1):
+                result["stale"] += 1
+                continue
+            rows.append({
+                "b_id": message.id,
+                "b_status": u["status"],
+                "b_delivered_at": datetime.utcfromtimestamp(u["timestamp"])
+                if u["status"] in ("delivered", "read") else None,
+                "b_error": u["error"],
+            })
+            changes.append((message, u["status"]))
+        suppress.extend((u["company_id"], u["email"], u["status"], None) for u in suppressions)
+
+        if rows:
+            table = Message.__table__
+            db.execute(update(table).where(table.c.id == bindparam("b_id")).values(
+                status=bindparam("b_status"),
+                delivered_at=func.coalesce(table.c.delivered_at, bindparam("b_delivered_at")),
+                error=func.coalesce(bindparam("b_error"), table.c.error),
+            ), rows)
+        result["suppressed"] = _suppress(db, suppress)
+        # Bulk UPDATEs skip the ORM flush hook: recount channel_delivery as an
+        # ORM status change would
+        reports.invalidate(db, {message.company_id for message, _ in changes}, {reports.ChannelDelivery.slug})
+        db.commit()
+    finally:
+        db.close()
+
+    for message, status in changes:
+        log_event(
+            "MessageStatusChanged", "message", message.id,
+            {"lead_id": message.lead_id, "channel": message.channel,
+             "from_status": message.status, "to_status": status},
+            company_id=message.company_id
+        )
+    result["applied"] = len(changes)
+    return result
+
+
+def _suppress(db, entries: list) -> int:
+    rows = {}
+    for company_id, email, reason, external_id in entries:
+        if company_id and email:
+            rows.setdefault((company_id, email), {
+                "id": str(uuid.uuid4()), "company_id": company_id, "email": email, "reason": reason,
+                "external_id": external_id, "created_at": datetime.utcnow(),
+            })
+    if not rows:
+        return 0
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    db.execute(dialect.insert(EmailSuppression.__table__).on_conflict_do_nothing(
+        index_elements=["company_id", "email"]
+    ), list(rows.values()))
+    return len(rows)
+
+
+# ============================================================================
+# SUPPRESSION LOOKUP
+# ============================================================================
+
+def is_suppressed(email: str, company_id: str = None) -> bool:
+    """True if `email` bounced (for any company) or opted out of `company_id`'s email"""
+    email = normalize_email(email)
+    if not email:
+        return False
+    db = ReadSessionLocal()
+    try:
+        conditions = [EmailSuppression.reason == "bounced"]
+        if company_id:
+            conditions.append(EmailSuppression.company_id == company_id)
+        return db.query(EmailSuppression.id).filter(
+            EmailSuppression.email == email, or_(*conditions)
+        ).first() is not None
+    finally:
+        db.close()
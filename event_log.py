@@ -0,0 +1,442 @@
+"""
+Event Log Pipeline
+Buffered, batched Event writes with monthly partitions and retention
+
+- log_event() appends to a per-process buffer and returns immediately; a
+  background thread flushes in bulk (COPY on PostgreSQL, multi-row INSERT
+  elsewhere), so event logging is off the request/task latency path
+- Event ids are time-ordered (UUIDv7 layout, models.new_event_id) so
+  inserts append to the end of the primary key index instead of splitting
+  random pages
+- On PostgreSQL `events` is range-partitioned by month; old partitions are
+  archived to gzip NDJSON and dropped whole instead of row-by-row deletes
+
+Call log_event() after the business transaction commits: a rolled-back
+request then never leaves events behind.
+
+Trade-off: buffered events live in process memory until the next flush.
+A crash (or SIGKILL) loses up to EVENT_FLUSH_INTERVAL of events, and while
+the database is unreachable the buffer is capped at EVENT_MAX_BUFFERED:
+the oldest events are dropped beyond it, counted in
+shvya_events_dropped_total. Reports rebuilt from events (reports.py) then
+undercount; business state (leads, messages, jobs) is unaffected.
+"""
+import atexit
+import csv
+import gzip
+import io
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, text
+
+from database import SessionLocal, engine
+from models import Event, new_event_id  # new_event_id re-exported
+import telemetry
+
+FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))  # seconds
+FLUSH_BATCH_SIZE = int(os.getenv("EVENT_FLUSH_BATCH_SIZE", "1000"))
+MAX_BUFFERED = int(os.getenv("EVENT_MAX_BUFFERED", "100000"))  # Oldest events dropped beyond this
+RETENTION_MONTHS = int(os.getenv("EVENT_RETENTION_MONTHS", "12"))
+ARCHIVE_DIR = os.getenv("EVENT_ARCHIVE_DIR", "./archive/events")
+ARCHIVE_CHUNK_ROWS = int(os.getenv("EVENT_ARCHIVE_CHUNK_ROWS", "50000"))  # Rows per archive file (unpartitioned)
+
+COLUMNS = ("id", "created_at", "type", "company_id", "entity_type", "entity_id", "payload")
+
+
+def compact_payload(payload):
+    """Drop empty values so they are not stored on every row"""
+    if not isinstance(payload, dict):
+        return payload
+    return {k: v for k, v in payload.items() if v is not None and v != ""}
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+# ============================================================================
+# BUFFER
+# ============================================================================
+
+class EventBuffer:
+    """Per-process event buffer with a background flusher"""
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH_SIZE,
+                 max_buffered: int = MAX_BUFFERED):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {"buffered": 0, "flushed": 0, "flushes": 0, "dropped": 0, "errors": 0}
+
+    def append(self, event: dict):
+        with self._lock:
+            self._events.append(event)
+            self._stats["buffered"] += 1
+            if len(self._events) > self.max_buffered:
+                overflow = len(self._events) - self.max_buffered
+                del self._events[:overflow]
+                self._stats["dropped"] += overflow
+                telemetry.EVENTS_DROPPED.inc(overflow)
+            full = len(self._events) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write everything buffered so far; returns the number of events written"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            written = 0
+            try:
+                while written < len(events):
+                    write_events(events[written:written + self.batch_size])
+                    written += self.batch_size
+            except Exception as e:
+                with self._lock:
+                    # Put the unwritten tail back in front; the next flush retries it
+                    self._events[:0] = events[written:]
+                    self._stats["errors"] += 1
+                    self._stats["flushed"] += written
+                print(f"❌ Event log flush failed ({len(events) - written} events buffered): {e}")
+                return written
+            with self._lock:
+                self._stats["flushed"] += len(events)
+                self._stats["flushes"] += 1
+            return len(events)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="event-log-flusher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _reset_after_fork(self):
+        # A forked child inherits the parent's buffer; those events belong
+        # to the parent, which flushes them itself.
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._events)
+        return stats
+
+
+_buffer = EventBuffer()
+atexit.register(_buffer.flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_buffer._reset_after_fork)
+
+
+def log_event(type: str, entity_type: str, entity_id: str, payload: dict = None,
+              company_id: str = None):
+    """Buffer one event (non-blocking)"""
+    _buffer.append({
+        "id": new_event_id(),
+        "created_at": datetime.utcnow(),
+        "type": type,
+        "company_id": company_id,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "payload": compact_payload(payload),
+    })
+
+
+def flush_events() -> int:
+    """Flush the buffer now (tests, shutdown hooks, benchmarks)"""
+    return _buffer.flush()
+
+
+def get_event_log_stats() -> dict:
+    return _buffer.stats()
+
+
+# ============================================================================
+# BULK WRITERS
+# ============================================================================
+
+def write_events(events: list):
+    """Write a batch of event dicts: COPY on PostgreSQL, multi-row INSERT elsewhere"""
+    if engine.dialect.name == "postgresql":
+        _copy_events(events)
+    else:
+        with engine.begin() as conn:
+            conn.execute(insert(Event.__table__), events)
+
+
+def _csv_value(value):
+    """COPY field: None as the NULL marker (csv writes it as '', an empty string)"""
+    return "\\N" if value is None else value
+
+
+def _copy_events(events: list):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for e in events:
+        writer.writerow([
+            e["id"],
+            e["created_at"].isoformat(),
+            _csv_value(e["type"]),
+            _csv_value(e["company_id"]),
+            _csv_value(e["entity_type"]),
+            _csv_value(e["entity_id"]),
+            _dumps(e["payload"]) if e["payload"] is not None else "\\N",
+        ])
+    buf.seek(0)
+
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY events ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                buf
+            )
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+
+# ============================================================================
+# PARTITIONS, RETENTION & ARCHIVAL
+# ============================================================================
+
+def _month_start(year: int, month: int) -> datetime:
+    while month > 12:
+        year, month = year + 1, month - 12
+    while month < 1:
+        year, month = year - 1, month + 12
+    return datetime(year, month, 1)
+
+
+def _partition_name(start: datetime) -> str:
+    return f"events_{start.year:04d}_{start.month:02d}"
+
+
+def is_partitioned(db) -> bool:
+    if db.bind.dialect.name != "postgresql":
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'events'"
+    )).first() is not None
+
+
+def ensure_partitions(months_ahead: int = 2, now: datetime = None, since: datetime = None) -> list:
+    """
+    Create monthly partitions from `since` (default: current month) to
+    months_ahead past now (PostgreSQL only)
+
+    Returns:
+        Names of partitions created
+    """
+    now = now or datetime.utcnow()
+    since = since or now
+    created = []
+    db = SessionLocal()
+    try:
+        if not is_partitioned(db):
+            return created
+        months = (now.year - since.year) * 12 + (now.month - since.month) + months_ahead
+        for offset in range(months + 1):
+            start = _month_start(since.year, since.month + offset)
+            end = _month_start(start.year, start.month + 1)
+            name = _partition_name(start)
+            exists = db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+            if exists:
+                continue
+            db.execute(text(
+                f"CREATE TABLE {name} PARTITION OF events "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            created.append(name)
+        db.commit()
+        return created
+    finally:
+        db.close()
+
+
+def migrate_to_partitioned() -> dict:
+    """
+    One-off (PostgreSQL): convert a plain `events` table created before
+    partitioning into the partitioned layout, copying existing rows
+    """
+    db = SessionLocal()
+    try:
+        if db.bind.dialect.name != "postgresql" or is_partitioned(db):
+            return {"migrated": False}
+        if db.execute(text("SELECT to_regclass('events')")).scalar() is None:
+            Event.__table__.create(bind=db.bind)
+            db.commit()
+            return {"migrated": False, "created": True}
+
+        db.execute(text("ALTER TABLE events RENAME TO events_legacy"))
+        for index in Event.__table__.indexes:
+            db.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_legacy"))
+        db.execute(text("ALTER TABLE events_legacy RENAME CONSTRAINT events_pkey TO events_legacy_pkey"))
+        db.commit()
+
+        Event.__table__.create(bind=db.bind)
+        oldest = db.execute(text("SELECT min(created_at) FROM events_legacy")).scalar()
+        db.commit()
+    finally:
+        db.close()
+
+    ensure_partitions(since=oldest.replace(tzinfo=None) if oldest else None)
+
+    db = SessionLocal()
+    try:
+        has_company = db.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'events_legacy' AND column_name = 'company_id'"
+        )).first() is not None
+        company = "company_id" if has_company else "NULL"
+        copied = db.execute(text(
+            "INSERT INTO events (id, created_at, type, company_id, entity_type, entity_id, payload) "
+            f"SELECT id, coalesce(created_at, now()), type, {company}, entity_type, entity_id, payload "
+            "FROM events_legacy"
+        )).rowcount
+        db.execute(text("DROP TABLE events_legacy"))
+        db.commit()
+        return {"migrated": True, "rows": copied}
+    finally:
+        db.close()
+
+
+def apply_retention(keep_months: int = RETENTION_MONTHS, archive_dir: str = ARCHIVE_DIR,
+                    now: datetime = None, batch_size: int = 5000) -> dict:
+    """
+    Archive events older than keep_months to gzip NDJSON, then remove them
+
+    PostgreSQL (partitioned): each expired monthly partition is archived and
+    dropped in one statement. Otherwise expired rows are archived in chunks
+    of ARCHIVE_CHUNK_ROWS, one file per chunk named by its first and last
+    id, and a chunk is deleted only after its file is complete - a re-run in
+    the same month adds files instead of replacing earlier ones.
+
+    Returns:
+        {"archived": rows, "files": [...], "dropped_partitions": [...]}
+    """
+    now = now or datetime.utcnow()
+    cutoff = _month_start(now.year, now.month - keep_months)
+    result = {"archived": 0, "files": [], "dropped_partitions": []}
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+
+    db = SessionLocal()
+    try:
+        if is_partitioned(db):
+            names = [row[0] for row in db.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = 'events' ORDER BY c.relname"
+            ))]
+            for name in names:
+                try:
+                    year, month = int(name[-7:-3]), int(name[-2:])
+                except ValueError:
+                    continue
+                if datetime(year, month, 1) >= cutoff:
+                    continue
+                if archive_dir:
+                    path, rows = _archive_rows(db.execute(text(
+                        f"SELECT {', '.join(COLUMNS)} FROM {name}"
+                    ).execution_options(stream_results=True, yield_per=5000)), archive_dir, name)
+                    result["archived"] += rows
+                    if path:
+                        result["files"].append(path)
+                db.execute(text(f"DROP TABLE {name}"))
+                db.commit()
+                result["dropped_partitions"].append(name)
+            return result
+
+        columns = COLUMNS if archive_dir else ("id",)
+        while True:
+            rows = db.execute(text(
+                f"SELECT {', '.join(columns)} FROM events WHERE created_at < :cutoff "
+                "ORDER BY created_at, id LIMIT :n"
+            ), {"cutoff": cutoff, "n": ARCHIVE_CHUNK_ROWS}).all()
+            if not rows:
+                break
+            ids = [row[0] for row in rows]
+            if archive_dir:
+                path, count = _archive_rows(rows, archive_dir, f"events_before_{cutoff:%Y_%m}_{ids[0]}_{ids[-1]}")
+                result["archived"] += count
+                result["files"].append(path)
+            # Exactly the archived rows: events written meanwhile wait for the next chunk
+            for start in range(0, len(ids), batch_size):
+                db.query(Event).filter(
+                    Event.id.in_(ids[start:start + batch_size]), Event.created_at < cutoff
+                ).delete(synchronize_session=False)
+            db.commit()
+        return result
+    finally:
+        db.close()
+
+
+def _archive_rows(rows, archive_dir: str, name: str):
+    """
+    Stream rows (COLUMNS order) to <archive_dir>/<name>.ndjson.gz
+
+    Written under a ".partial" name and renamed once closed, so a file with
+    the final name is always complete. No file is created for no rows.
+
+    Returns:
+        (path or None, rows written)
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return None, 0
+    path = os.path.join(archive_dir, f"{name}.ndjson.gz")
+    partial = path + ".partial"
+    count = 0
+    try:
+        with gzip.open(partial, "wt", encoding="utf-8") as out:
+            for row in itertools.chain((first,), rows):
+                record = dict(zip(COLUMNS, row))
+                if isinstance(record["payload"], str):
+                    record["payload"] = json.loads(record["payload"])
+                out.write(_dumps(record) + "\n")
+                count += 1
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return path, count
+
+
+def run_maintenance() -> dict:
+    """Daily job: pre-create partitions and enforce retention"""
+    return {
+        "created_partitions": ensure_partitions(),
+        "retention": apply_retention(),
+    }
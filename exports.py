@@ -0,0 +1,188 @@
+"""
+Streaming Exports
+Constant-memory per-company export of events and messages
+
+Rows are read in keyset order on (created_at, id): each page is a short
+query starting after the last row of the previous page (no OFFSET, no
+long-lived transaction), and each page is itself consumed through a
+server-side cursor. Memory stays flat regardless of result size.
+
+Watermarks: "<created_at ISO>|<id>". An export returns rows strictly after
+the watermark and up to an upper bound slightly in the past (late buffered
+writes settle first). The next incremental pull passes the watermark from
+the X-Export-Watermark response header; a broken stream can resume from
+the created_at/id of the last row received.
+"""
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+
+from database import ReadSessionLocal
+from models import Event, Message
+
+PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "10000"))
+FETCH_SIZE = 1000  # Rows per server-side cursor fetch
+SAFETY_LAG = timedelta(seconds=int(os.getenv("EXPORT_SAFETY_LAG_SECONDS", "60")))
+
+EVENT_COLUMNS = ("id", "created_at", "type", "company_id", "entity_type", "entity_id", "payload")
+MESSAGE_COLUMNS = (
+    "id", "created_at", "lead_id", "channel", "direction", "template_id", "body",
+    "status", "external_id", "error", "sent_at", "delivered_at",
+)
+
+
+class ExportError(ValueError):
+    """Invalid export request (bad watermark, unsupported format)"""
+
+
+def parse_watermark(watermark: str):
+    """'<created_at ISO>|<id>' → (datetime, id); None → (None, None)"""
+    if not watermark:
+        return None, None
+    created_at, _, row_id = watermark.partition("|")
+    try:
+        return datetime.fromisoformat(created_at), row_id
+    except ValueError:
+        raise ExportError(f"Invalid watermark: {watermark}")
+
+
+def format_watermark(created_at: datetime, row_id: str = "") -> str:
+    return f"{created_at.isoformat()}|{row_id}"
+
+
+def export_upper_bound(until: datetime = None) -> datetime:
+    """Rows newer than now - SAFETY_LAG may still be sitting in write buffers"""
+    settled = datetime.utcnow() - SAFETY_LAG
+    return min(until, settled) if until else settled
+
+
+# ============================================================================
+# KEYSET STREAMING
+# ============================================================================
+
+def _table_spec(kind: str):
+    if kind == "events":
+        return Event, EVENT_COLUMNS
+    if kind == "messages":
+        return Message, MESSAGE_COLUMNS
+    raise ExportError(f"Unknown export: {kind}")
+
+
+def _base_query(db, kind: str, company_id: str, types: list = None):
+    model, columns = _table_spec(kind)
+    query = db.query(*[getattr(model, c) for c in columns])
+    if kind == "events":
+        query = query.filter(Event.company_id == company_id)
+        if types:
+            query = query.filter(Event.type.in_(types))
+    else:
+        query = query.filter(Message.company_id == company_id)
+    return model, columns, query
+
+
+def iter_rows(kind: str, company_id: str, watermark: str = None, until: datetime = None,
+              types: list = None, page_size: int = PAGE_SIZE):
+    """
+    Yield export rows as dicts in (created_at, id) order
+
+    Args:
+        kind: "events" or "messages"
+        company_id: Tenant to export
+        watermark: Resume strictly after this position
+        until: Upper bound on created_at (exclusive); see export_upper_bound()
+        types: Optional event type filter
+        page_size: Rows per keyset page
+    """
+    after_ts, after_id = parse_watermark(watermark)
+    # A replica is safe once it has replayed past the upper bound
+    db = ReadSessionLocal(max_lag=(datetime.utcnow() - until).total_seconds() if until else 0)
+    try:
+        model, columns, base = _base_query(db, kind, company_id, types)
+        while True:
+            query = base
+            if after_ts is not None:
+                query = query.filter(tuple_(model.created_at, model.id) > tuple_(after_ts, after_id))
+            if until is not None:
+                query = query.filter(model.created_at < until)
+            query = query.order_by(model.created_at, model.id).limit(page_size)
+
+            count = 0
+            for row in query.execution_options(stream_results=True, yield_per=FETCH_SIZE):
+                count += 1
+                record = dict(zip(columns, row))
+                after_ts, after_id = record["created_at"], record["id"]
+                yield record
+            db.commit()  # End the page's transaction; the next page is a fresh snapshot
+
+            if count < page_size:
+                return
+    finally:
+        db.close()
+
+
+def _jsonable(record: dict) -> dict:
+    return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in record.items()}
+
+
+def stream_ndjson(kind: str, company_id: str, watermark: str = None, until: datetime = None,
+                  types: list = None):
+    """Yield NDJSON lines (bytes)"""
+    for record in iter_rows(kind, company_id, watermark, until, types):
+        yield (json.dumps(_jsonable(record), separators=(",", ":"), default=str) + "\n").encode()
+
+
+# ============================================================================
+# PARQUET (optional: requires pyarrow)
+# ============================================================================
+
+def write_parquet(kind: str, company_id: str, watermark: str = None, until: datetime = None,
+                  types: list = None, batch_rows: int = 50000) -> str:
+    """
+    Write the export to a temporary Parquet file in row-group batches
+
+    Returns:
+        Path of the file (caller deletes it; removed here if the export fails)
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    _, columns = _table_spec(kind)
+    fd, path = tempfile.mkstemp(prefix=f"export_{kind}_", suffix=".parquet")
+    os.close(fd)
+
+    schema = pa.schema([
+        (c, pa.timestamp("us") if c in ("created_at", "sent_at", "delivered_at") else pa.string())
+        for c in columns
+    ])
+    try:
+        writer = pq.ParquetWriter(path, schema)
+        try:
+            batch = {c: [] for c in columns}
+            size = 0
+            for record in iter_rows(kind, company_id, watermark, until, types):
+                for c in columns:
+                    value = record[c]
+                    if c == "payload" and value is not None and not isinstance(value, str):
+                        value = json.dumps(value, separators=(",", ":"), default=str)
+                    batch[c].append(value)
+                size += 1
+                if size >= batch_rows:
+                    writer.write_table(pa.table(batch, schema=schema))
+                    batch = {c: [] for c in columns}
+                    size = 0
+            if size:
+                writer.write_table(pa.table(batch, schema=schema))
+        finally:
+            writer.close()
+    except BaseException:
+        # The caller never gets the path of a failed export: remove it here
+        os.remove(path)
+        raise
+
+    return path
@@ -0,0 +1,310 @@
+"""
+Tenant-Fair Dispatcher
+Releases pending jobs to the broker fairly across companies
+
+Job priorities still decide *which class* runs first (strict priority: a
+pending ai.engage always goes before any sequence.step). Inside a priority
+class, companies are served by deficit round-robin: every round each
+company with backlog earns QUANTUM × weight credits and may release that
+many of its oldest jobs. A tenant blasting a 50k-lead campaign therefore
+gets its weighted share of the window, not the whole broker queue.
+
+Only a bounded window of jobs (FAIR_MAX_IN_FLIGHT) sits in the broker or on
+workers at any time; everything else waits as "pending" in the jobs table,
+where the order is still ours to decide. Per-company quotas
+(Company.max_in_flight) cap how much of the window one tenant may hold.
+FAIR_P1_RESERVED slots of the window are kept for P1 (conversational) jobs:
+P2 jobs, which can run for minutes, never hold more than the rest, so an
+ai.engage is not left waiting for a slow sequence step to finish.
+
+dispatch() runs on every enqueue (queue_manager.release_jobs) and on a
+1-second beat tick that refills the window as jobs finish.
+"""
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text, update
+
+from database import SessionLocal, ReadSessionLocal
+from models import Job, Company
+from queue_manager import publish_jobs
+
+MAX_IN_FLIGHT = int(os.getenv("FAIR_MAX_IN_FLIGHT", "200"))
+QUANTUM = int(os.getenv("FAIR_QUANTUM", "10"))  # Jobs per round at weight 1
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("FAIR_TENANT_MAX_IN_FLIGHT", "0"))  # 0 = no quota
+P1_RESERVED = int(os.getenv("FAIR_P1_RESERVED", "40"))  # Window slots P2 jobs may not take
+P1_MIN_PRIORITY = 90  # ai.engage, followup.bumpup, ai.summary (see queue_manager.PRIORITIES)
+# queued/processing rows older than this are assumed lost and stop holding window slots
+STALE_AFTER = timedelta(seconds=int(os.getenv("FAIR_STALE_SECONDS", "900")))
+
+PLAN_WEIGHTS = {"free": 1.0, "pro": 2.0, "enterprise": 4.0}
+NO_COMPANY = ""  # Jobs without a company share one sub-queue
+
+_ADVISORY_LOCK = 72_035  # pg_try_advisory_xact_lock key: one dispatch round at a time
+
+# DRR state per priority class, kept across rounds in this process:
+# {priority: {"deficits": {company: credits}, "order": deque([company, ...])}}
+_state = {}
+
+
+# ============================================================================
+# DEFICIT ROUND-ROBIN
+# ============================================================================
+
+def _weights(db, companies) -> tuple:
+    """(weight, quota) per company from Company.scheduling_weight/plan/max_in_flight"""
+    ids = [c for c in companies if c != NO_COMPANY]
+    rows = db.query(Company.id, Company.plan, Company.scheduling_weight, Company.max_in_flight).filter(
+        Company.id.in_(ids)
+    ).all() if ids else []
+    weights = {c: 1.0 for c in companies}
+    quotas = {c: DEFAULT_MAX_IN_FLIGHT or None for c in companies}
+    for company_id, plan, weight, quota in rows:
+        weights[company_id] = weight if weight and weight > 0 else PLAN_WEIGHTS.get(plan, 1.0)
+        if quota:
+            quotas[company_id] = quota
+    return weights, quotas
+
+
+def allocate(priority: int, backlog: dict, window: int, weights: dict, quota_left: dict) -> dict:
+    """
+    Split `window` slots between companies by deficit round-robin
+
+    Args:
+        priority: Priority class (DRR state is kept per class)
+        backlog: company → pending jobs in this class
+        window: Slots available
+        weights: company → weight
+        quota_left: company → remaining quota (None = unlimited); updated in place
+
+    Returns:
+        company → jobs to release
+    """
+    state = _state.setdefault(priority, {"deficits": {}, "order": deque()})
+    deficits, order = state["deficits"], state["order"]
+
+    backlog = {c: n for c, n in backlog.items() if n > 0}
+    for company in backlog:
+        if company not in deficits:
+            deficits[company] = 0.0
+            order.append(company)
+    # Companies whose backlog drained forfeit their credit (standard DRR)
+    for company in [c for c in order if c not in backlog]:
+        order.remove(company)
+        deficits.pop(company, None)
+
+    grants = {}
+    active = [c for c in order if quota_left.get(c) is None or quota_left[c] > 0]
+    while window > 0 and active:
+        still_active = []
+        for company in active:
+            if window <= 0:
+                break
+            deficits[company] += QUANTUM * weights.get(company, 1.0)
+            take = min(int(deficits[company]), backlog[company], window)
+            if quota_left.get(company) is not None:
+                take = min(take, quota_left[company])
+                quota_left[company] -= take
+            if take:
+                grants[company] = grants.get(company, 0) + take
+                deficits[company] -= take
+                backlog[company] -= take
+                window -= take
+            if backlog[company] == 0:
+                deficits[company] = 0.0
+            elif quota_left.get(company) is None or quota_left[company] > 0:
+                still_active.append(company)
+            else:
+                deficits[company] = 0.0  # Capped by quota: don't bank credit while blocked
+        active = still_active
+
+    # Next round starts after the last company served, so nobody is always first
+    if order and grants:
+        order.rotate(-1)
+    return grants
+
+
+# ============================================================================
+# DISPATCH
+# ============================================================================
+
+def _in_flight(db, now: datetime, p1: bool = None) -> dict:
+    """company → jobs currently in the broker or on a worker (p1=False: P2 jobs only)"""
+    recent = now - STALE_AFTER
+    query = db.query(Job.company_id, func.count(Job.id)).filter(
+        ((Job.status == "queued") & (Job.dispatched_at >= recent))
+        | ((Job.status == "processing") & (Job.started_at >= recent))
+    )
+    if p1 is not None:
+        query = query.filter(Job.priority >= P1_MIN_PRIORITY if p1 else Job.priority < P1_MIN_PRIORITY)
+    rows = query.group_by(Job.company_id).all()
+    return {company or NO_COMPANY: count for company, count in rows}
+
+
+def _claim(db, ids: list, now: datetime) -> set:
+    """
+    Flip the selected jobs pending → queued
+
+    Returns the ids this round actually changed. Without the Postgres
+    advisory lock two rounds can select the same rows; only the one whose
+    UPDATE hit a row may publish it.
+    """
+    stmt = update(Job).where(Job.status == "pending").values(
+        status="queued", dispatched_at=now
+    ).execution_options(synchronize_session=False)
+    claimed = set()
+    if db.bind.dialect.update_returning:
+        for start in range(0, len(ids), 500):
+            claimed.update(db.execute(stmt.where(Job.id.in_(ids[start:start + 500])).returning(Job.id)).scalars())
+    else:
+        for job_id in ids:
+            if db.execute(stmt.where(Job.id == job_id)).rowcount:
+                claimed.add(job_id)
+    return claimed
+
+
+def dispatch(max_in_flight: int = MAX_IN_FLIGHT, now: datetime = None) -> dict:
+    """
+    Run one dispatch round
+
+    Returns:
+        {"released": n, "by_company": {company: n}, "window": slots that were free}
+    """
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        if db.bind.dialect.name == "postgresql":
+            if not db.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _ADVISORY_LOCK}).scalar():
+                return {"released": 0, "by_company": {}, "window": 0, "skipped": "locked"}
+
+        in_flight = _in_flight(db, now)
+        window = max_in_flight - sum(in_flight.values())
+        result = {"released": 0, "by_company": {}, "window": max(window, 0)}
+        if window <= 0:
+            return result
+        # P2 may fill the window except for the P1 reserve
+        p2_window = max_in_flight - min(P1_RESERVED, max_in_flight) - sum(_in_flight(db, now, p1=False).values())
+
+        pending = db.query(Job.priority, Job.company_id, func.count(Job.id)).filter(
+            Job.status == "pending"
+        ).group_by(Job.priority, Job.company_id).all()
+        if not pending:
+            return result
+
+        classes = {}
+        for priority, company, count in pending:
+            classes.setdefault(priority or 0, {})[company or NO_COMPANY] = count
+        weights, quotas = _weights(db, {c for backlog in classes.values() for c in backlog})
+        quota_left = {
+            c: (None if quota is None else max(0, quota - in_flight.get(c, 0)))
+            for c, quota in quotas.items()
+        }
+
+        released = []
+        for priority in sorted(classes, reverse=True):
+            slots = window if priority >= P1_MIN_PRIORITY else min(window, p2_window)
+            if slots <= 0:
+                continue
+            grants = allocate(priority, classes[priority], slots, weights, quota_left)
+            for company, count in grants.items():
+                query = db.query(Job.id, Job.job_type, Job.priority).filter(
+                    Job.status == "pending",
+                    Job.priority == priority,
+                    Job.company_id.is_(None) if company == NO_COMPANY else Job.company_id == company,
+                ).order_by(Job.created_at, Job.id).limit(count)
+                rows = query.all()
+                released.extend((row.id, row.job_type, row.priority, company) for row in rows)
+                window -= len(rows)
+                if priority < P1_MIN_PRIORITY:
+                    p2_window -= len(rows)
+
+        if not released:
+            return result
+
+        claimed = _claim(db, [job_id for job_id, _, _, _ in released], now)
+        db.commit()
+        released = [job for job in released if job[0] in claimed]
+        if not released:
+            return result
+        ids = [job_id for job_id, _, _, _ in released]
+        for _, _, _, company in released:
+            result["by_company"][company] = result["by_company"].get(company, 0) + 1
+
+        try:
+            publish_jobs([(job_id, job_type, priority) for job_id, job_type, priority, _ in released])
+        except Exception:
+            # Broker down: hand the jobs back to the next round
+            db.query(Job).filter(Job.id.in_(ids)).update(
+                {"status": "pending", "dispatched_at": None}, synchronize_session=False
+            )
+            db.commit()
+            raise
+
+        result["released"] = len(released)
+        return result
+    finally:
+        db.close()
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))], 3)
+
+
+def get_tenant_stats(window_minutes: int = 15, now: datetime = None) -> dict:
+    """
+    Per-company queue state and wait times
+
+    dispatch_wait: created → released to the broker (time spent behind
+    other tenants); queue_wait: created → picked up by a worker.
+    Waits are over jobs started in the last `window_minutes`.
+    """
+    now = now or datetime.utcnow()
+    db = ReadSessionLocal()
+    try:
+        stats = {}
+
+        def entry(company):
+            return stats.setdefault(company or NO_COMPANY, {
+                "pending": 0, "in_flight": 0, "started": 0,
+                "dispatch_wait_avg": None, "dispatch_wait_p95": None,
+                "queue_wait_avg": None, "queue_wait_p95": None,
+            })
+
+        for company, count in db.query(Job.company_id, func.count(Job.id)).filter(
+            Job.status == "pending"
+        ).group_by(Job.company_id):
+            entry(company)["pending"] = count
+        for company, count in _in_flight(db, now).items():
+            entry(company)["in_flight"] = count
+
+        waits = {}
+        rows = db.query(Job.company_id, Job.created_at, Job.dispatched_at, Job.started_at).filter(
+            Job.started_at >= now - timedelta(minutes=window_minutes)
+        ).yield_per(5000)
+        for company, created_at, dispatched_at, started_at in rows:
+            bucket = waits.setdefault(company or NO_COMPANY, ([], []))
+            created_at = created_at.replace(tzinfo=None)
+            if dispatched_at:
+                bucket[0].append((dispatched_at.replace(tzinfo=None) - created_at).total_seconds())
+            bucket[1].append((started_at.replace(tzinfo=None) - created_at).total_seconds())
+
+        for company, (dispatch_waits, queue_waits) in waits.items():
+            item = entry(company)
+            item["started"] = len(queue_waits)
+            if dispatch_waits:
+                item["dispatch_wait_avg"] = round(sum(dispatch_waits) / len(dispatch_waits), 3)
+                item["dispatch_wait_p95"] = _percentile(dispatch_waits, 0.95)
+            item["queue_wait_avg"] = round(sum(queue_waits) / len(queue_waits), 3)
+            item["queue_wait_p95"] = _percentile(queue_waits, 0.95)
+
+        return {"window_minutes": window_minutes, "companies": stats}
+    finally:
+        db.close()
@@ -0,0 +1,137 @@
+"""
+Idempotency Key Store
+Compact, time-bounded record of every idempotency key handed to the queue
+
+Dedup used to rely on the unique index on jobs.idempotency_key, which only
+holds while the job row exists. Keys now live in their own narrow table
+(key → job_id, expires_at) for IDEMPOTENCY_TTL_DAYS, so finished jobs can be
+archived out of the live table without reopening the door to duplicates.
+Expired keys are purged in small batches by job_retention.
+
+Redis front filter: enqueue_job() first reserves the key in Redis
+(SET NX, IDEMPOTENCY_REDIS_TTL_SECONDS) and returns the job id recorded
+there for repeats, without a database round trip. Redis is only a filter:
+a key that is reserved but not yet committed (or Redis being unavailable)
+falls through to claim_keys(), which stays the source of truth.
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import IdempotencyKey
+import redis_cache
+
+TTL = timedelta(days=int(os.getenv("IDEMPOTENCY_TTL_DAYS", "30")))
+# Never longer than TTL: Redis must not report keys the database has expired
+REDIS_TTL = min(int(os.getenv("IDEMPOTENCY_REDIS_TTL_SECONDS", str(24 * 3600))), int(TTL.total_seconds()))
+PENDING_SECONDS = 60  # Reservation of an enqueue that has not committed yet
+PENDING = "~"  # Prefix of a reservation's value
+
+
+# ============================================================================
+# KEY STORE
+# ============================================================================
+
+def expiry(now: datetime = None) -> datetime:
+    return (now or datetime.utcnow()) + TTL
+
+
+def claim_keys(db, pairs: list, now: datetime = None) -> dict:
+    """
+    Claim (key, job_id) pairs in the caller's transaction, in one statement
+
+    INSERT ... ON CONFLICT (key) DO UPDATE ... RETURNING: a free or expired
+    key takes the new job id, a live key keeps its own - either way the
+    row's job id comes back, so duplicates resolve without a prior SELECT.
+    A concurrent claim of the same key waits for the other transaction and
+    then sees its job id (no IntegrityError).
+
+    Returns:
+        {key: job_id owning the key}; a pair was claimed when it maps to its own job id
+    """
+    if not pairs:
+        return {}
+    now = now or datetime.utcnow()
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    table = IdempotencyKey.__table__
+    stmt = dialect.insert(table)
+    expired = table.c.expires_at <= now
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={
+            "job_id": case((expired, stmt.excluded.job_id), else_=table.c.job_id),
+            "expires_at": case((expired, stmt.excluded.expires_at), else_=table.c.expires_at),
+        },
+    ).returning(table.c.key, table.c.job_id)
+    expires_at = expiry(now)
+    rows = [{"key": key, "job_id": job_id, "expires_at": expires_at} for key, job_id in pairs]
+    return {key: job_id for key, job_id in db.execute(stmt, rows)}
+
+
+# ============================================================================
+# REDIS FRONT FILTER
+# ============================================================================
+
+def _redis_key(key: str) -> str:
+    return f"idem:{key}"
+
+
+def reserve(key: str, job_id: str):
+    """
+    Reserve `key` for a new job in Redis (one pipelined SET NX + GET)
+
+    Returns:
+        Job id of an earlier, committed enqueue with this key, or None:
+        proceed with claim_keys() (reserved now, reserved by an enqueue
+        still in flight, or Redis unavailable)
+    """
+    client = redis_cache.get_client()
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.set(_redis_key(key), PENDING + job_id, nx=True, ex=PENDING_SECONDS)
+        pipe.get(_redis_key(key))
+        created, value = pipe.execute()
+    except Exception as e:
+        redis_cache.mark_down(e)
+        return None
+    if created or not value or value.startswith(PENDING):
+        return None
+    return value
+
+
+def confirm(key: str, job_id: str):
+    """Record the job that owns `key` (after commit)"""
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            client.set(_redis_key(key), job_id, ex=REDIS_TTL)
+        except Exception as e:
+            redis_cache.mark_down(e)
+
+
+def release(key: str):
+    """Drop a reservation whose enqueue failed"""
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            client.delete(_redis_key(key))
+        except Exception as e:
+            redis_cache.mark_down(e)
+
+
+# ============================================================================
+# MAINTENANCE
+# ============================================================================
+
+def purge_expired(db, batch_size: int = 5000, now: datetime = None) -> int:
+    """Delete one batch of expired keys (caller commits); returns rows deleted"""
+    keys = [key for (key,) in db.query(IdempotencyKey.key).filter(
+        IdempotencyKey.expires_at <= (now or datetime.utcnow())
+    ).limit(batch_size)]
+    if keys:
+        db.query(IdempotencyKey).filter(IdempotencyKey.key.in_(keys)).delete(synchronize_session=False)
+    return len(keys)
@@ -0,0 +1,101 @@
+"""
+Inbound Deduplication
+Drops provider webhook redeliveries at the API edge
+
+Meta and the WhatsApp Web bridge redeliver an inbound webhook when our
+answer is slow or lost. Payloads carry the provider's message id
+(InboundMessage.provider_message_id), stored as Message.external_id:
+
+    1. Redis window - SET NX inbound:<channel>:<id> before any database
+       work. A replay of a message already stored is answered from Redis
+       ({"status": "duplicate", ...}) without touching the database.
+    2. Unique index - a replay that arrives while the first delivery is
+       still in flight, after the window (INBOUND_DEDUP_WINDOW_SECONDS), or
+       while Redis is unavailable is stopped by the unique index on
+       messages (channel, external_id); the transaction rolls back before
+       any event or job is created.
+
+Provider ids are only unique within a provider, so both layers are keyed
+by channel. A delivery that fails before its message is committed releases
+its reservation, so the provider's retry is processed normally.
+"""
+import os
+import threading
+
+import redis_cache
+import telemetry
+
+WINDOW = int(os.getenv("INBOUND_DEDUP_WINDOW_SECONDS", str(7 * 86400)))  # Meta retries for up to 7 days
+PENDING_SECONDS = 60  # Reservation of a delivery that has not committed yet
+PENDING = "~"
+
+RESULTS = ("new", "replay_redis", "replay_db", "no_id")
+_counts = {}
+_lock = threading.Lock()
+
+
+def _key(channel: str, provider_message_id: str) -> str:
+    return f"inbound:{channel}:{provider_message_id}"
+
+
+def record(channel: str, result: str):
+    """Count one inbound delivery by outcome (RESULTS)"""
+    with _lock:
+        _counts[result] = _counts.get(result, 0) + 1
+    telemetry.INBOUND_DELIVERIES.inc(channel=channel, result=result)
+
+
+def get_stats() -> dict:
+    """Inbound deliveries by outcome in this process, plus the replay rate"""
+    with _lock:
+        counts = {result: _counts.get(result, 0) for result in RESULTS}
+    tracked = counts["new"] + counts["replay_redis"] + counts["replay_db"]
+    replays = counts["replay_redis"] + counts["replay_db"]
+    return {**counts, "replay_rate": round(replays / tracked, 4) if tracked else 0.0}
+
+
+def reserve(channel: str, provider_message_id: str):
+    """
+    Reserve a provider message id (one pipelined SET NX + GET)
+
+    Returns:
+        {"lead_id", "message_id"} of the stored original when this is a
+        replay, else None: process the message (reserved now, original
+        still in flight, or Redis unavailable - the unique index decides)
+    """
+    client = redis_cache.get_client()
+    if client is None:
+        return None
+    key = _key(channel, provider_message_id)
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.set(key, PENDING, nx=True, ex=PENDING_SECONDS)
+        pipe.get(key)
+        created, value = pipe.execute()
+    except Exception as e:
+        redis_cache.mark_down(e)
+        return None
+    if created or not value or value.startswith(PENDING):
+        return None
+    lead_id, _, message_id = value.partition(":")
+    return {"lead_id": lead_id, "message_id": message_id}
+
+
+def confirm(channel: str, provider_message_id: str, lead_id: str, message_id: str):
+    """Remember the stored message for the rest of the window (after commit)"""
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            client.set(_key(channel, provider_message_id), f"{lead_id}:{message_id}", ex=WINDOW)
+        except Exception as e:
+            redis_cache.mark_down(e)
+
+
+def release(channel: str, provider_message_id: str):
+    """Drop the reservation of a delivery that failed (the retry is processed)"""
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            client.delete(_key(channel, provider_message_id))
+        except Exception as e:
+            redis_cache.mark_down(e)
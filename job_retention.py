@@ -0,0 +1,147 @@
+"""
+Jobs Retention
+Keeps the live jobs table down to the working set
+
+Finished jobs older than the retention window are moved to jobs_archive in
+small batches: each batch is one short transaction (copy rows, delete them,
+commit) followed by a pause, and a run stops at a time budget. Enqueue and
+stats queries never wait behind a long delete, and the jobs indexes
+(idx_status_priority, idempotency_key) stay small enough to live in memory.
+
+Idempotency keys are preserved in the idempotency_keys store before a job
+leaves the live table, so a key stays reserved for its full TTL.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, literal, DateTime
+
+from database import SessionLocal
+from models import Job, JobArchive, IdempotencyKey
+import idempotency
+
+# Age before a finished job is archived, per final status
+RETENTION = {
+    "completed": timedelta(days=int(os.getenv("JOB_RETENTION_DAYS", "7"))),
+    "dlq": timedelta(days=int(os.getenv("JOB_DLQ_RETENTION_DAYS", "30"))),
+}
+BATCH_SIZE = int(os.getenv("JOB_RETENTION_BATCH_SIZE", "1000"))
+PAUSE = float(os.getenv("JOB_RETENTION_PAUSE_MS", "100")) / 1000
+TIME_BUDGET = float(os.getenv("JOB_RETENTION_MAX_SECONDS", "300"))
+
+ARCHIVE_COLUMNS = (
+    "id", "job_type", "company_id", "priority", "payload", "status", "attempts", "error",
+    "idempotency_key", "created_at", "dispatched_at", "started_at", "completed_at",
+)
+
+
+def _naive(value: datetime) -> datetime:
+    return value.replace(tzinfo=None) if value else value
+
+
+def _preserve_keys(db, ids: list, now: datetime):
+    """Copy still-live keys of jobs about to be archived into the key store"""
+    keyed = db.query(Job.id, Job.idempotency_key, Job.created_at).filter(
+        Job.id.in_(ids), Job.idempotency_key.isnot(None)
+    ).all()
+    if not keyed:
+        return
+    stored = {key for (key,) in db.query(IdempotencyKey.key).filter(
+        IdempotencyKey.key.in_([row.idempotency_key for row in keyed])
+    )}
+    # Jobs enqueued before the key store existed have no entry yet
+    missing = [
+        {"key": row.idempotency_key, "job_id": row.id,
+         "expires_at": _naive(row.created_at) + idempotency.TTL}
+        for row in keyed
+        if row.idempotency_key not in stored and _naive(row.created_at) + idempotency.TTL > now
+    ]
+    if missing:
+        db.execute(insert(IdempotencyKey), missing)
+
+
+def _archive_batch(db, status: str, cutoff: datetime, batch_size: int, now: datetime) -> int:
+    """Move one batch of expired jobs to jobs_archive; returns rows moved"""
+    # DLQ jobs never complete; age them by creation time
+    age_column = Job.completed_at if status == "completed" else Job.created_at
+    query = db.query(Job.id).filter(Job.status == status, age_column < cutoff).limit(batch_size)
+    if db.bind.dialect.name == "postgresql":
+        # Skip rows a worker or a concurrent run is touching instead of waiting
+        query = query.with_for_update(skip_locked=True)
+    ids = [job_id for (job_id,) in query]
+    if not ids:
+        return 0
+
+    _preserve_keys(db, ids, now)
+    db.execute(insert(JobArchive).from_select(
+        list(ARCHIVE_COLUMNS) + ["archived_at"],
+        select(*[getattr(Job, c) for c in ARCHIVE_COLUMNS], literal(now, DateTime()))
+        .where(Job.id.in_(ids)),
+    ))
+    db.query(Job).filter(Job.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    return len(ids)
+
+
+def apply_job_retention(batch_size: int = BATCH_SIZE, pause: float = PAUSE,
+                        time_budget: float = TIME_BUDGET, now: datetime = None) -> dict:
+    """
+    Archive expired jobs and purge expired idempotency keys, throttled
+
+    Args:
+        batch_size: Rows per transaction
+        pause: Sleep between batches (seconds) so the hot path gets the table
+        time_budget: Stop after this many seconds; the next run continues
+        now: Override the clock (tests/backfills)
+
+    Returns:
+        {"archived": {status: rows}, "keys_purged": rows, "batches": n, "complete": bool}
+    """
+    now = now or datetime.utcnow()
+    started = time.monotonic()
+    result = {"archived": {status: 0 for status in RETENTION}, "keys_purged": 0,
+              "batches": 0, "complete": False}
+
+    def out_of_time():
+        return time.monotonic() - started >= time_budget
+
+    db = SessionLocal()
+    try:
+        for status, age in RETENTION.items():
+            cutoff = now - age
+            while not out_of_time():
+                moved = _archive_batch(db, status, cutoff, batch_size, now)
+                result["archived"][status] += moved
+                result["batches"] += 1 if moved else 0
+                if moved < batch_size:
+                    break
+                time.sleep(pause)
+
+        while not out_of_time():
+            purged = idempotency.purge_expired(db, batch_size, now)
+            db.commit()
+            result["keys_purged"] += purged
+            if purged < batch_size:
+                break
+            time.sleep(pause)
+
+        result["complete"] = not out_of_time()
+        result["elapsed_seconds"] = round(time.monotonic() - started, 2)
+        return result
+    finally:
+        db.close()
+
+
+def get_retention_stats() -> dict:
+    """Live vs archived job counts and key store size"""
+    db = SessionLocal()
+    try:
+        return {
+            "live_jobs": db.query(Job).count(),
+            "archived_jobs": db.query(JobArchive).count(),
+            "idempotency_keys": db.query(IdempotencyKey).count(),
+            "retention_days": {status: age.days for status, age in RETENTION.items()},
+        }
+    finally:
+        db.close()
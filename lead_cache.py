@@ -0,0 +1,87 @@
+"""
+Lead Lookup Cache
+(company_id, E.164 phone) → lead_id for the inbound hot path
+
+Most inbound messages come from leads that already exist. Their ids are
+cached write-through in a per-process LRU and, when Redis is reachable, in
+Redis (shared by every API process), so "an existing lead replies" reaches
+the database only to insert the message.
+
+A phone's lead id never changes, so entries only expire to bound memory
+(LEAD_CACHE_SIZE per process, LEAD_CACHE_TTL_SECONDS in Redis). Callers that
+find a cached lead gone call invalidate().
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import redis_cache
+import telemetry
+
+CACHE_SIZE = int(os.getenv("LEAD_CACHE_SIZE", "50000"))
+REDIS_TTL = int(os.getenv("LEAD_CACHE_TTL_SECONDS", str(7 * 86400)))
+
+_local = OrderedDict()
+_lock = threading.Lock()
+
+
+def _key(company_id: str, phone: str) -> str:
+    return f"lead:{company_id}:{phone}"
+
+
+def _remember(key: str, lead_id: str):
+    with _lock:
+        _local[key] = lead_id
+        _local.move_to_end(key)
+        while len(_local) > CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def get(company_id: str, phone: str):
+    """Cached lead id for a normalized phone, or None"""
+    key = _key(company_id, phone)
+    with _lock:
+        lead_id = _local.get(key)
+        if lead_id is not None:
+            _local.move_to_end(key)
+    if lead_id is not None:
+        telemetry.CACHE_LOOKUPS.inc(cache="lead", result="local_hit")
+        return lead_id
+
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            lead_id = client.get(key)
+        except Exception as e:
+            redis_cache.mark_down(e)
+        if lead_id is not None:
+            _remember(key, lead_id)
+            telemetry.CACHE_LOOKUPS.inc(cache="lead", result="redis_hit")
+            return lead_id
+
+    telemetry.CACHE_LOOKUPS.inc(cache="lead", result="miss")
+    return None
+
+
+def put(company_id: str, phone: str, lead_id: str):
+    """Record a lead id (call after the lead row is committed)"""
+    key = _key(company_id, phone)
+    _remember(key, lead_id)
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            client.set(key, lead_id, ex=REDIS_TTL)
+        except Exception as e:
+            redis_cache.mark_down(e)
+
+
+def invalidate(company_id: str, phone: str):
+    key = _key(company_id, phone)
+    with _lock:
+        _local.pop(key, None)
+    client = redis_cache.get_client()
+    if client is not None:
+        try:
+            client.delete(key)
+        except Exception as e:
+            redis_cache.mark_down(e)
@@ -0,0 +1,479 @@
+"""
+Bulk Lead Import
+Streaming CSV/NDJSON uploads → leads + lead_contacts, loaded in chunks
+
+The upload is parsed as it arrives (memory stays flat for any file size):
+every CHUNK_ROWS rows are normalized (E.164 phones, lower-cased emails),
+deduplicated and loaded with one statement per table, then the LeadImport
+row is updated, so GET /imports/{id} shows progress and rows/second while
+the upload is still running.
+
+Loading is an upsert keyed by (company_id, normalized_phone):
+    - PostgreSQL: COPY into a temp staging table, then
+      INSERT ... SELECT ... ON CONFLICT DO UPDATE
+    - elsewhere: batched multi-row INSERT ... ON CONFLICT DO UPDATE
+Existing leads keep their pipeline, stage and source; imported name/email
+fill in or overwrite, attributes are merged. Rows with only an email match
+existing leads by email. New leads get the import's pipeline/stage, or the
+row's `stage` column (by stage name).
+
+Columns (CSV header / NDJSON keys): phone (phone_number, mobile), email,
+name (full_name, contact_name), source, stage; any other column is kept in
+Lead.attributes.
+"""
+import codecs
+import csv
+import io
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import func, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import SessionLocal, ReadSessionLocal
+from models import Company, Lead, LeadContact, LeadImport, Pipeline, Stage
+from event_log import log_event
+from phones import try_normalize_phone
+import conversation_cache
+
+CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "2000"))
+FORMATS = ("csv", "ndjson")
+
+FIELD_ALIASES = {
+    "phone": "phone", "phone_number": "phone", "mobile": "phone",
+    "email": "email",
+    "name": "name", "full_name": "name", "contact_name": "name",
+    "source": "source",
+    "stage": "stage",
+}
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+LEAD_COLUMNS = (
+    "id", "company_id", "pipeline_id", "stage_id", "source", "name",
+    "phone", "normalized_phone", "email", "attributes", "status", "priority",
+)
+
+
+class LeadImportError(ValueError):
+    """Invalid import request (format, company, pipeline or stage)"""
+
+
+def normalize_email(raw) -> str:
+    """Lower-cased address, or None if it does not look like one"""
+    email = str(raw or "").strip().lower()
+    return email if _EMAIL.match(email) else None
+
+
+def format_from_content_type(content_type: str) -> str:
+    content_type = (content_type or "").lower()
+    if "json" in content_type:
+        return "ndjson"
+    return "csv"
+
+
+# ============================================================================
+# STREAM PARSING
+# ============================================================================
+
+class RecordSplitter:
+    """
+    Byte chunks → complete text records
+
+    CSV records may span lines inside quoted fields: lines are joined until
+    the record has an even number of quote characters.
+    """
+
+    def __init__(self, quoted: bool):
+        self.quoted = quoted
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self._tail = ""
+        self._partial = []
+        self._quotes = 0
+
+    def feed(self, data: bytes, final: bool = False) -> list:
+        lines = (self._tail + self._decoder.decode(data, final)).split("\n")
+        self._tail = "" if final else lines.pop()
+        records = []
+        for line in lines:
+            line = line.rstrip("\r")
+            self._partial.append(line)
+            if self.quoted:
+                self._quotes += line.count('"')
+            if self._quotes % 2 == 0:
+                records.append("\n".join(self._partial))
+                self._partial, self._quotes = [], 0
+        if final and self._partial:
+            records.append("\n".join(self._partial))  # Unbalanced quote: let csv decide
+            self._partial, self._quotes = [], 0
+        return [record for record in records if record.strip()]
+
+
+# ============================================================================
+# IMPORTER
+# ============================================================================
+
+class LeadImporter:
+    """
+    One import: begin(), feed(bytes) for each uploaded chunk, finish()
+
+    Args:
+        company_id: Company that owns the leads
+        format: csv or ndjson
+        pipeline_id / stage_id: For new leads (default: the company's default
+            pipeline and its "New" stage)
+        phone_channel: LeadContact channel recorded for phone numbers
+    """
+
+    def __init__(self, company_id: str, format: str, pipeline_id: str = None, stage_id: str = None,
+                 phone_channel: str = "wa_web"):
+        if format not in FORMATS:
+            raise LeadImportError(f"Unsupported format: {format} (use {' or '.join(FORMATS)})")
+        self.company_id = company_id
+        self.format = format
+        self.pipeline_id = pipeline_id
+        self.stage_id = stage_id
+        self.phone_channel = phone_channel
+        self.import_id = None
+        self.counts = {"rows_read": 0, "inserted": 0, "updated": 0, "duplicates": 0, "invalid": 0}
+        self._splitter = RecordSplitter(quoted=format == "csv")
+        self._header = None
+        self._rows = []
+        self._stages = {}
+        self._started = None
+
+    def begin(self) -> str:
+        """Resolve pipeline/stage and record the import; returns its id"""
+        db = SessionLocal()
+        try:
+            if db.get(Company, self.company_id) is None:
+                raise LeadImportError(f"Unknown company {self.company_id}")
+            pipelines = db.query(Pipeline).filter(Pipeline.company_id == self.company_id)
+            if self.pipeline_id:
+                pipelines = pipelines.filter(Pipeline.id == self.pipeline_id)
+            pipeline = pipelines.order_by(Pipeline.is_default.desc()).first()
+            if pipeline is None:
+                raise LeadImportError(f"No pipeline {self.pipeline_id or ''} for company {self.company_id}")
+            self.pipeline_id = pipeline.id
+
+            self._stages = {
+                name.strip().lower(): stage_id
+                for stage_id, name in db.query(Stage.id, Stage.name).filter(Stage.pipeline_id == pipeline.id)
+            }
+            if self.stage_id is None:
+                self.stage_id = self._stages.get("new")
+            elif self.stage_id not in self._stages.values():
+                raise LeadImportError(f"Stage {self.stage_id} is not in pipeline {pipeline.id}")
+
+            record = LeadImport(
+                company_id=self.company_id, pipeline_id=self.pipeline_id, stage_id=self.stage_id,
+                format=self.format, status="running", started_at=datetime.utcnow()
+            )
+            db.add(record)
+            db.commit()
+            self.import_id = record.id
+        finally:
+            db.close()
+        self._started = time.perf_counter()
+        print(f"📥 Lead import {self.import_id} started ({self.format}, company {self.company_id})")
+        return self.import_id
+
+    def feed(self, data: bytes):
+        """Parse an uploaded chunk; loads every full CHUNK_ROWS rows"""
+        self._parse(self._splitter.feed(data))
+        while len(self._rows) >= CHUNK_ROWS:
+            chunk, self._rows = self._rows[:CHUNK_ROWS], self._rows[CHUNK_ROWS:]
+            self._load(chunk)
+
+    def finish(self) -> dict:
+        """Load the remainder and mark the import completed; returns its status"""
+        self._parse(self._splitter.feed(b"", final=True))
+        if self._rows:
+            self._load(self._rows)
+            self._rows = []
+        self._save_progress(status="completed")
+        log_event(
+            "LeadsImported", "lead_import", self.import_id,
+            {**self.counts, "pipeline_id": self.pipeline_id, "stage_id": self.stage_id},
+            company_id=self.company_id
+        )
+        print(f"✅ Lead import {self.import_id}: {self.counts['inserted']} new, "
+              f"{self.counts['updated']} updated, {self.counts['invalid']} invalid "
+              f"({self._rate():.0f} rows/s)")
+        return get_import(self.import_id)
+
+    def fail(self, error):
+        if self.import_id:
+            self._save_progress(status="failed", error=str(error))
+            print(f"❌ Lead import {self.import_id} failed after {self.counts['rows_read']} rows: {error}")
+
+    # ------------------------------------------------------------------------
+
+    def _rate(self) -> float:
+        elapsed = time.perf_counter() - self._started if self._started else 0
+        return self.counts["rows_read"] / elapsed if elapsed > 0 else 0.0
+
+    def _parse(self, records: list):
+        if self.format == "csv":
+            for values in csv.reader(records):
+                if self._header is None:
+                    self._header = [name.strip() for name in values]
+                    continue
+                self._add(dict(zip(self._header, values)))
+        else:
+            for record in records:
+                try:
+                    row = json.loads(record)
+                except ValueError:
+                    row = None
+                self._add(row if isinstance(row, dict) else {})
+
+    def _add(self, row: dict):
+        self.counts["rows_read"] += 1
+        fields, attributes = {}, {}
+        for key, value in row.items():
+            if isinstance(value, str):
+                value = value.strip()
+            if value is None or value == "":
+                continue
+            field = FIELD_ALIASES.get(str(key).strip().lower())
+            if field:
+                fields.setdefault(field, value)
+            else:
+                attributes[key] = value
+
+        phone = try_normalize_phone(str(fields["phone"])) if "phone" in fields else None
+        email = normalize_email(fields.get("email"))
+        if not phone and not email:
+            self.counts["invalid"] += 1
+            return
+        stage_name = str(fields.get("stage", "")).strip().lower()
+        self._rows.append({
+            "phone": str(fields["phone"]) if phone else None,
+            "normalized_phone": phone,
+            "email": email,
+            "name": str(fields["name"]) if "name" in fields else None,
+            "source": str(fields["source"]) if "source" in fields else None,
+            "stage_id": self._stages.get(stage_name, self.stage_id),
+            "attributes": attributes or None,
+        })
+
+    def _dedupe(self, rows: list) -> list:
+        """One row per phone (or email when there is no phone); later rows fill gaps"""
+        by_key = {}
+        for row in rows:
+            key = row["normalized_phone"] or ("email", row["email"])
+            first = by_key.get(key)
+            if first is None:
+                by_key[key] = row
+                continue
+            self.counts["duplicates"] += 1
+            for field in ("name", "email", "source"):
+                first[field] = first[field] or row[field]
+            if row["attributes"]:
+                first["attributes"] = {**row["attributes"], **(first["attributes"] or {})}
+        return list(by_key.values())
+
+    def _load(self, rows: list):
+        rows = self._dedupe(rows)
+        db = SessionLocal()
+        try:
+            # Phoneless rows can only be matched by email
+            by_email = {row["email"]: row for row in rows if not row["normalized_phone"]}
+            existing = {}
+            if by_email:
+                existing = {
+                    email: (lead_id, attributes)
+                    for email, lead_id, attributes in db.query(Lead.email, Lead.id, Lead.attributes).filter(
+                        Lead.company_id == self.company_id, Lead.email.in_(list(by_email))
+                    )
+                }
+            updates = []
+            updated_ids = []
+            for email, (lead_id, attributes) in existing.items():
+                row = by_email[email]
+                row["lead_id"] = lead_id
+                changes = {"id": lead_id}
+                if row["name"]:
+                    changes["name"] = row["name"]
+                if row["attributes"]:
+                    changes["attributes"] = {**(attributes or {}), **row["attributes"]}
+                updates.append(changes)
+                updated_ids.append(lead_id)
+            if updates:
+                db.execute(update(Lead), updates)
+
+            new_rows = []
+            for row in rows:
+                if "lead_id" in row:
+                    continue
+                row["lead_id"] = str(uuid.uuid4())
+                new_rows.append({
+                    "id": row["lead_id"], "company_id": self.company_id, "pipeline_id": self.pipeline_id,
+                    "stage_id": row["stage_id"], "source": row["source"] or "import", "name": row["name"],
+                    "phone": row["phone"], "normalized_phone": row["normalized_phone"], "email": row["email"],
+                    "attributes": row["attributes"], "status": "active", "priority": 0,
+                })
+            inserted = 0
+            if new_rows:
+                upsert = _pg_upsert_leads if db.bind.dialect.name == "postgresql" else _upsert_leads
+                lead_ids = upsert(db, new_rows)
+                for row in rows:
+                    if row["normalized_phone"] in lead_ids:
+                        actual = lead_ids[row["normalized_phone"]]
+                        if actual == row["lead_id"]:
+                            inserted += 1
+                        else:
+                            updated_ids.append(actual)
+                        row["lead_id"] = actual
+                inserted += sum(1 for row in new_rows if row["normalized_phone"] is None)
+
+            _insert_contacts(db, [
+                {"id": str(uuid.uuid4()), "lead_id": row["lead_id"], "channel": channel,
+                 "handle": handle, "verified": False}
+                for row in rows
+                for channel, handle in ((self.phone_channel, row["normalized_phone"]), ("email", row["email"]))
+                if handle
+            ])
+
+            self.counts["inserted"] += inserted
+            self.counts["updated"] += len(rows) - inserted
+            self._save_progress(db=db)
+            # Leads are written without LeadCreated events: recount the funnel
+            import reports
+            reports.invalidate(db, {self.company_id}, reports.INVALIDATES["lead"])
+            db.commit()
+            conversation_cache.invalidate(updated_ids)  # Names may have changed
+        finally:
+            db.close()
+
+    def _save_progress(self, db=None, status: str = None, error: str = None):
+        values = {**self.counts, "rows_per_second": round(self._rate(), 1)}
+        if status:
+            values["status"] = status
+            values["finished_at"] = datetime.utcnow()
+        if error:
+            values["error"] = error
+        own = db is None
+        db = db or SessionLocal()
+        try:
+            db.query(LeadImport).filter(LeadImport.id == self.import_id).update(values, synchronize_session=False)
+            if own:
+                db.commit()
+        finally:
+            if own:
+                db.close()
+
+
+# ============================================================================
+# BULK WRITERS
+# ============================================================================
+
+def _upsert_leads(db, rows: list) -> dict:
+    """Batched INSERT ... ON CONFLICT DO UPDATE (insertmanyvalues); returns {normalized_phone: lead id}"""
+    table = Lead.__table__
+    stmt = sqlite.insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.company_id, table.c.normalized_phone],
+        set_={
+            "name": func.coalesce(stmt.excluded.name, table.c.name),
+            "email": func.coalesce(stmt.excluded.email, table.c.email),
+            # Rows without attributes bind JSON 'null'
+            "attributes": func.json_patch(
+                func.coalesce(table.c.attributes, "{}"),
+                func.coalesce(func.nullif(stmt.excluded.attributes, "null"), "{}"),
+            ),
+            "updated_at": func.now(),
+        },
+    ).returning(table.c.id, table.c.normalized_phone)
+    return {phone: lead_id for lead_id, phone in db.execute(stmt, rows) if phone is not None}
+
+
+def _pg_upsert_leads(db, rows: list) -> dict:
+    """COPY into a staging table, then INSERT ... SELECT ... ON CONFLICT DO UPDATE"""
+    db.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS lead_import_staging "
+        "(LIKE leads INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    ))
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([
+            "\\N" if row[c] is None else json.dumps(row[c]) if c == "attributes" else row[c]
+            for c in LEAD_COLUMNS
+        ])
+    buf.seek(0)
+    columns = ", ".join(LEAD_COLUMNS)
+    with db.connection().connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY lead_import_staging ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf
+        )
+    result = db.execute(text(
+        f"INSERT INTO leads ({columns}) SELECT {columns} FROM lead_import_staging "
+        "ON CONFLICT (company_id, normalized_phone) DO UPDATE SET "
+        "name = COALESCE(EXCLUDED.name, leads.name), "
+        "email = COALESCE(EXCLUDED.email, leads.email), "
+        "attributes = (COALESCE(leads.attributes::jsonb, '{}'::jsonb) "
+        "|| COALESCE(EXCLUDED.attributes::jsonb, '{}'::jsonb))::json, "
+        "updated_at = now() "
+        "RETURNING id, normalized_phone"
+    ))
+    return {phone: lead_id for lead_id, phone in result if phone is not None}
+
+
+def _insert_contacts(db, rows: list):
+    if not rows:
+        return
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    db.execute(dialect.insert(LeadContact.__table__).on_conflict_do_nothing(
+        index_elements=["lead_id", "channel", "handle"]
+    ), rows)
+
+
+# ============================================================================
+# STATUS
+# ============================================================================
+
+def _as_dict(record: LeadImport) -> dict:
+    return {
+        "id": record.id,
+        "company_id": record.company_id,
+        "pipeline_id": record.pipeline_id,
+        "stage_id": record.stage_id,
+        "format": record.format,
+        "status": record.status,
+        "rows_read": record.rows_read,
+        "inserted": record.inserted,
+        "updated": record.updated,
+        "duplicates": record.duplicates,
+        "invalid": record.invalid,
+        "rows_per_second": record.rows_per_second,
+        "error": record.error,
+        "started_at": record.started_at.isoformat() if record.started_at else None,
+        "finished_at": record.finished_at.isoformat() if record.finished_at else None,
+    }
+
+
+def get_import(import_id: str):
+    """Import status, or None"""
+    db = SessionLocal()
+    try:
+        record = db.get(LeadImport, import_id)
+        return _as_dict(record) if record else None
+    finally:
+        db.close()
+
+
+def list_imports(company_id: str = None, limit: int = 50) -> list:
+    """Most recent imports first"""
+    db = ReadSessionLocal()
+    try:
+        query = db.query(LeadImport)
+        if company_id:
+            query = query.filter(LeadImport.company_id == company_id)
+        return [_as_dict(r) for r in query.order_by(LeadImport.started_at.desc()).limit(limit)]
+    finally:
+        db.close()
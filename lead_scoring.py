@@ -0,0 +1,253 @@
+"""
+Lead Scoring
+Batch scores (Lead.priority, 0-100) so hot leads are answered first under load
+
+A beat task scores every active lead of a company in one pass. Features are
+pulled column-wise with a few grouped queries (no per-lead queries, no ORM
+objects) and scored with vectorized NumPy over the whole tenant:
+
+    recency         last inbound message, halved every SCORE_RECENCY_HALF_LIFE_HOURS
+    responsiveness  mean gap between our message and the lead's reply
+                    (log-scale; under a minute ≈ 1, a day ≈ 0)
+    intent          inbound messages with high-intent keywords (price, demo, ...)
+    engagement      inbound message count (saturating)
+    stage           position of the lead's stage in its pipeline
+    source          SOURCE_WEIGHTS (paid search > social > unknown)
+
+Leads in a closed stage (Converted, Lost) score 0. Only changed scores are
+written, in bulk. queue_manager.job_priority() blends the score into the
+priority of the lead's conversational jobs (within the P1 band).
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import aliased
+
+from database import SessionLocal
+from models import Company, Lead, Message, Stage
+
+WINDOW = timedelta(days=int(os.getenv("SCORE_WINDOW_DAYS", "30")))  # Message history considered
+RECENCY_HALF_LIFE_HOURS = float(os.getenv("SCORE_RECENCY_HALF_LIFE_HOURS", "24"))
+WRITE_BATCH = 1000
+
+WEIGHTS = {
+    "recency": 0.30,
+    "responsiveness": 0.20,
+    "intent": 0.20,
+    "engagement": 0.10,
+    "stage": 0.10,
+    "source": 0.10,
+}
+
+SOURCE_WEIGHTS = {
+    "google_ads": 1.0,
+    "website": 0.9,
+    "referral": 0.9,
+    "facebook": 0.7,
+    "instagram": 0.7,
+    "whatsapp": 0.6,
+    "import": 0.3,
+}
+DEFAULT_SOURCE_WEIGHT = 0.4
+
+INTENT_KEYWORDS = [
+    k.strip() for k in os.getenv(
+        "SCORE_INTENT_KEYWORDS",
+        "price,pricing,cost,quote,buy,purchase,book,demo,visit,interested,available,payment"
+    ).split(",") if k.strip()
+]
+
+CLOSED_STAGES = {"converted", "lost"}
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch_seconds(values: list):
+    import numpy as np  # Heavy import, deferred to first use
+
+    return np.array(
+        [(v.replace(tzinfo=None) - _EPOCH).total_seconds() if v else np.nan for v in values], dtype=np.float64
+    )
+
+
+# ============================================================================
+# FEATURES
+# ============================================================================
+
+def load_features(db, company_id: str, now: datetime) -> dict:
+    """
+    Per-lead feature columns for a company's active leads
+
+    Returns:
+        {"lead_ids": [...], "priority": array, ...} - every array is aligned
+        with lead_ids; empty lead_ids when the company has no active leads
+    """
+    import numpy as np  # Heavy import, deferred to first use
+
+    since = now - WINDOW
+    pipeline_stage = aliased(Stage)
+    max_order = db.query(
+        pipeline_stage.pipeline_id, func.max(pipeline_stage.order).label("max_order")
+    ).group_by(pipeline_stage.pipeline_id).subquery()
+
+    leads = db.query(
+        Lead.id, Lead.priority, Lead.source, Stage.order, Stage.name, max_order.c.max_order
+    ).outerjoin(Stage, Stage.id == Lead.stage_id).outerjoin(
+        max_order, max_order.c.pipeline_id == Stage.pipeline_id
+    ).filter(Lead.company_id == company_id, Lead.status == "active").all()
+    if not leads:
+        return {"lead_ids": []}
+
+    lead_ids, priority, sources, orders, stage_names, max_orders = zip(*leads)
+    index = {lead_id: i for i, lead_id in enumerate(lead_ids)}
+    n = len(lead_ids)
+
+    # Messages in the window, ordered per lead: counts, last inbound, reply gaps
+    messages = db.query(Message.lead_id, Message.direction, Message.created_at).join(
+        Lead, Lead.id == Message.lead_id
+    ).filter(
+        Lead.company_id == company_id, Lead.status == "active", Message.created_at >= since
+    ).order_by(Message.lead_id, Message.created_at).all()
+
+    inbound_count = np.zeros(n)
+    last_inbound = np.full(n, np.nan)
+    gap_sum = np.zeros(n)
+    gap_count = np.zeros(n)
+    if messages:
+        m_lead, m_direction, m_created = zip(*messages)
+        lead_idx = np.fromiter((index[l] for l in m_lead), dtype=np.int64, count=len(m_lead))
+        inbound = np.array([d == "inbound" for d in m_direction])
+        created = _epoch_seconds(m_created)
+
+        inbound_count = np.bincount(lead_idx, weights=inbound, minlength=n).astype(np.float64)
+        np.fmax.at(last_inbound, lead_idx[inbound], created[inbound])
+
+        # A reply: inbound right after an outbound message of the same lead
+        reply = (lead_idx[1:] == lead_idx[:-1]) & inbound[1:] & ~inbound[:-1]
+        gaps = np.maximum(created[1:] - created[:-1], 1.0)[reply]
+        reply_lead = lead_idx[1:][reply]
+        gap_sum = np.bincount(reply_lead, weights=np.log10(gaps), minlength=n)
+        gap_count = np.bincount(reply_lead, minlength=n).astype(np.float64)
+
+    # High-intent inbound messages, counted by the database
+    intent = np.zeros(n)
+    if INTENT_KEYWORDS:
+        body = func.lower(Message.body)
+        hits = db.query(Message.lead_id, func.count(Message.id)).join(
+            Lead, Lead.id == Message.lead_id
+        ).filter(
+            Lead.company_id == company_id, Lead.status == "active",
+            Message.direction == "inbound", Message.created_at >= since,
+            or_(*[body.like(f"%{keyword}%") for keyword in INTENT_KEYWORDS])
+        ).group_by(Message.lead_id).all()
+        for lead_id, count in hits:
+            intent[index[lead_id]] = count
+
+    return {
+        "lead_ids": list(lead_ids),
+        "priority": np.array([p or 0 for p in priority], dtype=np.int64),
+        "source_weight": np.array(
+            [SOURCE_WEIGHTS.get((s or "").lower(), DEFAULT_SOURCE_WEIGHT) for s in sources]
+        ),
+        "stage_order": np.array([o if o is not None else np.nan for o in orders], dtype=np.float64),
+        "stage_max_order": np.array([o if o is not None else np.nan for o in max_orders], dtype=np.float64),
+        "closed": np.array([(name or "").lower() in CLOSED_STAGES for name in stage_names]),
+        "inbound_count": inbound_count,
+        "last_inbound": last_inbound,
+        "reply_gap_log10_sum": gap_sum,
+        "reply_count": gap_count,
+        "intent_count": intent,
+        "now": (now - _EPOCH).total_seconds(),
+    }
+
+
+# ============================================================================
+# SCORING
+# ============================================================================
+
+def score(features: dict):
+    """
+    Vectorized 0-100 scores for load_features() columns
+
+    Returns:
+        int64 array aligned with features["lead_ids"]
+    """
+    import numpy as np  # Heavy import, deferred to first use
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hours_since = (features["now"] - features["last_inbound"]) / 3600.0
+        recency = np.nan_to_num(np.exp2(-np.maximum(hours_since, 0.0) / RECENCY_HALF_LIFE_HOURS))
+
+        # Mean log10(gap seconds): 1.8 (one minute) → 1.0, 4.9 (a day) → 0.0
+        mean_gap = features["reply_gap_log10_sum"] / features["reply_count"]
+        responsiveness = np.nan_to_num(np.clip((4.9 - mean_gap) / 3.1, 0.0, 1.0))
+
+        stage = np.nan_to_num(np.clip(features["stage_order"] / features["stage_max_order"], 0.0, 1.0))
+
+    intent = 1.0 - np.exp(-features["intent_count"] / 2.0)
+    engagement = 1.0 - np.exp(-features["inbound_count"] / 5.0)
+
+    total = (
+        WEIGHTS["recency"] * recency
+        + WEIGHTS["responsiveness"] * responsiveness
+        + WEIGHTS["intent"] * intent
+        + WEIGHTS["engagement"] * engagement
+        + WEIGHTS["stage"] * stage
+        + WEIGHTS["source"] * features["source_weight"]
+    ) / sum(WEIGHTS.values())
+    scores = np.rint(np.clip(total, 0.0, 1.0) * 100).astype(np.int64)
+    scores[features["closed"]] = 0
+    return scores
+
+
+def score_company(db, company_id: str, now: datetime = None) -> dict:
+    """
+    Score a company's active leads and write changed Lead.priority values
+
+    Args:
+        db: Open session; committed here
+        company_id: Tenant to score
+        now: Reference time (default: utcnow)
+
+    Returns:
+        {"scored": leads scored, "updated": priorities changed}
+    """
+    now = now or datetime.utcnow()
+    features = load_features(db, company_id, now)
+    if not features["lead_ids"]:
+        return {"scored": 0, "updated": 0}
+
+    scores = score(features)
+    changed = (scores != features["priority"]).nonzero()[0]
+    rows = [{"id": features["lead_ids"][i], "priority": int(scores[i])} for i in changed]
+    for start in range(0, len(rows), WRITE_BATCH):
+        db.execute(update(Lead), rows[start:start + WRITE_BATCH])
+    db.commit()
+    return {"scored": len(scores), "updated": len(rows)}
+
+
+def score_all(company_id: str = None, now: datetime = None) -> dict:
+    """
+    Score every company (or one), one transaction per company
+
+    Returns:
+        {"companies": n, "scored": leads scored, "updated": priorities changed}
+    """
+    db = SessionLocal()
+    result = {"companies": 0, "scored": 0, "updated": 0}
+    try:
+        company_ids = [company_id] if company_id else [c for (c,) in db.query(Company.id)]
+        for cid in company_ids:
+            counts = score_company(db, cid, now)
+            result["companies"] += 1
+            result["scored"] += counts["scored"]
+            result["updated"] += counts["updated"]
+        if result["updated"]:
+            print(f"🔥 Lead scores: {result['updated']} of {result['scored']} leads re-prioritized")
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
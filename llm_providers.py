@@ -0,0 +1,410 @@
+"""
+LLM Providers
+Per-company model configuration, pluggable backends, hedging and fallback
+
+Each company's AIModel row (provider, model_name, temperature, top_p,
+max_tokens, system_prompt) is resolved through a small TTL cache, so the hot
+path costs one dict lookup instead of a query per reply. Companies without a
+row use LLM_PROVIDER / LLM_MODEL.
+
+Backends:
+    openai    - Chat Completions (honours OPENAI_BASE_URL; client built on first use)
+    anthropic - Messages API (optional: requires the anthropic package)
+    mock      - Local canned replies after MOCK_LLM_LATENCY_MS, for development
+
+Reliability:
+    fallback - LLM_FALLBACK ("provider:model,provider:model") is tried in order
+               when the primary fails or its breaker is open
+    hedging  - for latency-sensitive (P1) replies, if the primary has not
+               answered by the HEDGE_PERCENTILE of its recent latencies, a
+               backup request is fired and the first success wins. The loser
+               is not cancelled (HTTP calls cannot be), only ignored.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+
+from circuit_breaker import CircuitOpenError
+from retry_policy import guarded, get_breaker, PermanentError
+import telemetry
+
+DEFAULT_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+DEFAULT_TEMPERATURE = 0.4
+FALLBACK = os.getenv("LLM_FALLBACK", "")
+
+CONFIG_TTL = float(os.getenv("AI_CONFIG_TTL_SECONDS", "60"))
+CONFIG_CACHE_SIZE = 1024
+
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY_MS", "1500")) / 1000
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY_MS", "100")) / 1000
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", "32"))
+LATENCY_WINDOW = 200
+
+MOCK_LATENCY = float(os.getenv("MOCK_LLM_LATENCY_MS", "50")) / 1000
+
+
+class LLMConfig:
+    """Resolved model settings for one company"""
+
+    def __init__(self, provider: str = DEFAULT_PROVIDER, model_name: str = DEFAULT_MODEL,
+                 temperature: float = DEFAULT_TEMPERATURE, top_p: float = None,
+                 max_tokens: int = None, system_prompt: str = None):
+        self.provider = provider or DEFAULT_PROVIDER
+        self.model_name = model_name or DEFAULT_MODEL
+        self.temperature = DEFAULT_TEMPERATURE if temperature is None else temperature
+        self.top_p = top_p
+        self.max_tokens = max_tokens
+        self.system_prompt = system_prompt
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider}:{self.model_name}"
+
+    def with_model(self, provider: str, model_name: str) -> "LLMConfig":
+        """Same sampling settings on another provider/model (for fallback)"""
+        return LLMConfig(provider, model_name, self.temperature, self.top_p,
+                         self.max_tokens, self.system_prompt)
+
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                api_key = os.getenv("OPENAI_API_KEY")
+                if not api_key:
+                    raise PermanentError(
+                        "OPENAI_API_KEY not found. Please set it as an environment variable "
+                        "or create a .env file with OPENAI_API_KEY=your-key-here"
+                    )
+                from openai import OpenAI  # Heavy import, deferred to first use
+                self._client = OpenAI(api_key=api_key)
+            return self._client
+
+    def complete(self, config: LLMConfig, system: str, user: str) -> str:
+        params = {}
+        if config.top_p is not None:
+            params["top_p"] = config.top_p
+        if config.max_tokens:
+            params["max_tokens"] = config.max_tokens
+        response = self.client().chat.completions.create(
+            model=config.model_name,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user}
+            ],
+            temperature=config.temperature,
+            **params
+        )
+        if response.usage is not None:
+            telemetry.record_llm_tokens(self.name, config.model_name,
+                                        response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content
+
+
+class AnthropicProvider:
+    name = "anthropic"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                try:
+                    import anthropic
+                except ImportError:
+                    raise PermanentError("Anthropic provider requires the anthropic package (pip install anthropic)")
+                self._client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+            return self._client
+
+    def complete(self, config: LLMConfig, system: str, user: str) -> str:
+        params = {}
+        if config.top_p is not None:
+            params["top_p"] = config.top_p
+        response = self.client().messages.create(
+            model=config.model_name,
+            system=system,
+            messages=[{"role": "user", "content": user}],
+            temperature=config.temperature,
+            max_tokens=config.max_tokens or 500,
+            **params
+        )
+        telemetry.record_llm_tokens(self.name, config.model_name,
+                                    response.usage.input_tokens, response.usage.output_tokens)
+        return "".join(block.text for block in response.content if getattr(block, "type", "") == "text")
+
+
+class MockProvider:
+    """Canned JSON replies; no network, no key"""
+    name = "mock"
+
+    def complete(self, config: LLMConfig, system: str, user: str) -> str:
+        time.sleep(MOCK_LATENCY)
+        last_line = user.strip().splitlines()[-1] if user.strip() else ""
+        text = json.dumps({
+            "reply": f"Thanks for reaching out! ({config.model_name}) Could you tell me more about: {last_line[:60].rstrip('?')}?",
+            "should_stop": False
+        })
+        telemetry.record_llm_tokens(self.name, config.model_name, (len(system) + len(user)) // 4, len(text) // 4)
+        return text
+
+
+_providers = {}
+
+
+def register_provider(provider):
+    """Add or replace a backend (an object with .name and .complete(config, system, user))"""
+    _providers[provider.name] = provider
+
+
+for _provider in (OpenAIProvider(), AnthropicProvider(), MockProvider()):
+    register_provider(_provider)
+
+
+def get_provider(name: str):
+    provider = _providers.get(name)
+    if provider is None:
+        raise PermanentError(f"Unknown LLM provider: {name}")
+    return provider
+
+
+# ============================================================================
+# PER-COMPANY CONFIG CACHE (LRU with TTL)
+# ============================================================================
+
+_config_cache = OrderedDict()
+_config_lock = threading.Lock()
+
+
+def _load_config(company_id: str) -> LLMConfig:
+    from database import SessionLocal
+    from models import AIModel
+
+    db = SessionLocal()
+    try:
+        row = db.query(AIModel).filter(
+            AIModel.company_id == company_id
+        ).order_by(AIModel.created_at.desc()).first()
+    finally:
+        db.close()
+    if row is None:
+        return LLMConfig()
+    return LLMConfig(row.provider, row.model_name, row.temperature, row.top_p,
+                     row.max_tokens, row.system_prompt)
+
+
+def get_config(company_id: str = None) -> LLMConfig:
+    """
+    Model settings for a company (defaults when it has no AIModel row)
+
+    Cached for AI_CONFIG_TTL_SECONDS; call invalidate_config() after editing
+    a company's AIModel to apply it immediately in this process.
+    """
+    if not company_id:
+        return LLMConfig()
+    now = time.monotonic()
+    with _config_lock:
+        entry = _config_cache.get(company_id)
+        if entry is not None and entry[0] > now:
+            _config_cache.move_to_end(company_id)
+            return entry[1]
+
+    config = _load_config(company_id)
+
+    with _config_lock:
+        _config_cache[company_id] = (now + CONFIG_TTL, config)
+        _config_cache.move_to_end(company_id)
+        while len(_config_cache) > CONFIG_CACHE_SIZE:
+            _config_cache.popitem(last=False)
+    return config
+
+
+def invalidate_config(company_id: str = None):
+    """Drop one company's cached config (or all)"""
+    with _config_lock:
+        if company_id is None:
+            _config_cache.clear()
+        else:
+            _config_cache.pop(company_id, None)
+
+
+def candidates(config: LLMConfig) -> list:
+    """The configured model followed by distinct LLM_FALLBACK entries"""
+    chain = [config]
+    seen = {config.key}
+    for spec in filter(None, (s.strip() for s in FALLBACK.split(","))):
+        provider, _, model_name = spec.partition(":")
+        fallback = config.with_model(provider, model_name or DEFAULT_MODEL)
+        if fallback.key not in seen:
+            seen.add(fallback.key)
+            chain.append(fallback)
+    return chain
+
+
+def ensure_available(company_id: str = None):
+    """
+    Raise CircuitOpenError only if every candidate provider's breaker is open
+
+    With a fallback configured, an outage of the primary does not defer jobs.
+    """
+    error = None
+    for config in candidates(get_config(company_id)):
+        breaker = get_breaker(config.provider)
+        if breaker.state != "open":
+            return
+        error = error or CircuitOpenError(config.provider, breaker.retry_after())
+    raise error
+
+
+# ============================================================================
+# LATENCY TRACKING & METRICS
+# ============================================================================
+
+_latencies = {}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _model_stats(key: str) -> dict:
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = {
+            "requests": 0, "errors": 0, "hedged": 0, "hedge_wins": 0, "fallbacks": 0,
+        }
+        _latencies[key] = deque(maxlen=LATENCY_WINDOW)
+    return stats
+
+
+def _count(key: str, field: str, n: int = 1):
+    with _stats_lock:
+        _model_stats(key)[field] += n
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def hedge_delay(config: LLMConfig) -> float:
+    """Seconds to wait on the primary before firing a backup request"""
+    with _stats_lock:
+        _model_stats(config.key)
+        samples = list(_latencies[config.key])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, _percentile(samples, HEDGE_PERCENTILE))
+
+
+def _call(config: LLMConfig, system: str, user: str) -> str:
+    provider = get_provider(config.provider)
+    _count(config.key, "requests")
+    start = time.monotonic()
+    try:
+        with guarded(config.provider):
+            text = provider.complete(config, system, user)
+    except Exception:
+        _count(config.key, "errors")
+        telemetry.LLM_SECONDS.observe(time.monotonic() - start, provider=config.provider,
+                                      model=config.model_name, outcome="error")
+        raise
+    seconds = time.monotonic() - start
+    with _stats_lock:
+        _latencies[config.key].append(seconds)
+    telemetry.LLM_SECONDS.observe(seconds, provider=config.provider, model=config.model_name, outcome="ok")
+    return text
+
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="llm-hedge")
+
+
+def _hedged_call(config: LLMConfig, system: str, user: str) -> str:
+    primary = _executor.submit(_call, config, system, user)
+    try:
+        return primary.result(timeout=hedge_delay(config))
+    except FutureTimeout:
+        pass
+
+    _count(config.key, "hedged")
+    backup = _executor.submit(_call, config, system, user)
+    pending = {primary: "primary", backup: "backup"}
+    error = None
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            role = pending.pop(future)
+            try:
+                text = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if role == "backup":
+                _count(config.key, "hedge_wins")
+            return text
+    raise error
+
+
+def complete(config: LLMConfig, system: str, user: str, hedge: bool = False) -> str:
+    """
+    Run one completion with fallback (and optional hedging)
+
+    Args:
+        config: Resolved company config (see get_config)
+        system: System prompt
+        user: User message / context
+        hedge: Fire a backup request if the primary is slower than usual
+
+    Returns:
+        Raw completion text
+
+    Raises:
+        The primary's error if every candidate fails
+    """
+    first_error = None
+    with telemetry.span("llm", model=config.key, hedge=int(hedge)):
+        for i, candidate in enumerate(candidates(config)):
+            if i:
+                _count(candidate.key, "fallbacks")
+            try:
+                if hedge:
+                    return _hedged_call(candidate, system, user)
+                return _call(candidate, system, user)
+            except Exception as e:
+                first_error = first_error or e
+                print(f"⚠️ LLM {candidate.key} failed: {e}")
+        raise first_error
+
+
+def get_llm_stats() -> dict:
+    """Requests, errors, hedge rate/wins, fallbacks and latency per provider:model (this process)"""
+    with _stats_lock:
+        snapshot = {key: (dict(stats), list(_latencies[key])) for key, stats in _stats.items()}
+    result = {}
+    for key, (stats, samples) in snapshot.items():
+        primaries = stats["requests"] - stats["hedged"]
+        stats["hedge_rate"] = round(stats["hedged"] / primaries, 4) if primaries else 0.0
+        stats["latency_p50_ms"] = round(_percentile(samples, 50) * 1000, 1) if samples else None
+        stats["latency_p95_ms"] = round(_percentile(samples, 95) * 1000, 1) if samples else None
+        if len(samples) >= HEDGE_MIN_SAMPLES:
+            stats["hedge_delay_ms"] = round(max(HEDGE_MIN_DELAY, _percentile(samples, HEDGE_PERCENTILE)) * 1000, 1)
+        else:
+            stats["hedge_delay_ms"] = round(HEDGE_DEFAULT_DELAY * 1000, 1)
+        result[key] = stats
+    return result
@@ -1,18 +1,63 @@
-from fastapi import FastAPI, HTTPException
-from schemas import InboundMessage
-from database import SessionLocal, engine
-from models import Base, Lead, Message, Event, Company, Pipeline, Stage
-from queue_manager import enqueue_job
+import startup  # First: starts the boot clock
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from starlette.background import BackgroundTask
+from typing import List, Optional
+from datetime import datetime, timezone
+import os
+from sqlalchemy.exc import IntegrityError
+from schemas import InboundMessage, CampaignCreate
+from database import SessionLocal, DATABASE_URL
+from models import Lead, Message, Company, Pipeline, Stage
+from event_log import log_event
+from phones import normalize_phone, InvalidPhoneNumber
+import conversation_cache
+import inbound_dedup
+import lead_cache
+import reports  # Registers report invalidation hooks on SessionLocal
+import telemetry
 import uuid
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+startup.mark("imports")
+
+# Schema changes are a deploy step (python migrate.py); only the SQLite
+# development database is migrated on boot unless AUTO_MIGRATE says otherwise
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1" if DATABASE_URL.startswith("sqlite") else "0") == "1"
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if AUTO_MIGRATE:
+        import migrate
+        migrate.migrate()
+        startup.mark("migrate")
+    if startup.WARMUP:
+        import queue_manager  # noqa: F401 - Celery client for the first enqueue
+        startup.warm_up(llm=False)
+    startup.mark("ready")
+    startup.log_boot("API")
+    yield
+
 
 app = FastAPI(
     title="SHVYA AI Auto API",
     description="AI-powered sales engagement platform with priority-based queue system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+app.add_middleware(telemetry.MetricsMiddleware)
+
+JOBS_BY_STATUS = telemetry.Gauge("shvya_jobs", "Jobs by status", ("status",))
+
+
+def _collect_job_counts():
+    from queue_manager import get_queue_stats
+    for status, count in get_queue_stats().items():
+        JOBS_BY_STATUS.set(count, status=status)
+
+
+telemetry.register_collector(_collect_job_counts)
 
 @app.get("/")
 def root():
@@ -21,141 +66,601 @@ def root():
         "version": "1.0.0",
         "endpoints": {
             "docs": "/docs",
+            "health": "/health",
             "inbound_message": "/inbound-message",
-            "queue_stats": "/queue/stats"
+            "queue_stats": "/queue/stats",
+            "queue_tenants": "/queue/tenants",
+            "inbound_stats": "/inbound/stats",
+            "delivery_status": "/webhooks/delivery-status",
+            "metrics": "/metrics",
+            "db_pools": "/db/pools",
+            "ai_stats": "/ai/stats",
+            "exports": "/exports/{company_id}/{events|messages}",
+            "imports": "/imports/{company_id}/leads",
+            "campaigns": "/campaigns",
+            "reports": "/reports/{company_id}/{funnel_by_stage|response_time|channel_delivery}"
         }
     }
 
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Query parameter → naive UTC (the database's convention); offsets are converted, not dropped"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Inbound messages without company_id belong to the first company
+_default_company_id = None
+
+
+def _default_company(db) -> str:
+    global _default_company_id
+    if _default_company_id is None:
+        company = db.query(Company).order_by(Company.created_at, Company.id).first()
+        if not company:
+            # Create default company
+            company = Company(
+                id=str(uuid.uuid4()),
+                name="Default Company",
+                timezone="UTC"
+            )
+            db.add(company)
+            db.commit()
+        _default_company_id = company.id
+    return _default_company_id
+
+
+def _find_lead_id(db, company_id: str, phone: str, raw_phone: str):
+    """
+    Lead id by normalized phone, falling back to the raw spelling for legacy
+    leads the normalized_phone backfill left NULL (duplicates, unparseable)
+    """
+    lead_id = db.query(Lead.id).filter(
+        Lead.company_id == company_id, Lead.normalized_phone == phone
+    ).scalar()
+    if lead_id is None and raw_phone:
+        lead_id = db.query(Lead.id).filter(
+            Lead.company_id == company_id, Lead.normalized_phone.is_(None), Lead.phone == raw_phone
+        ).order_by(Lead.created_at, Lead.id).limit(1).scalar()
+    return lead_id
+
+
+def _create_lead(db, company_id: str, phone: str, data: InboundMessage):
+    """
+    New lead in the company's default pipeline, "New" stage
+
+    Returns:
+        The Lead, or None if a concurrent request created it first
+    """
+    pipeline = db.query(Pipeline).filter(
+        Pipeline.company_id == company_id
+    ).order_by(Pipeline.is_default.desc()).first()
+    if not pipeline:
+        if db.get(Company, company_id) is None:
+            raise HTTPException(status_code=404, detail=f"Unknown company {company_id}")
+        # Create default pipeline
+        pipeline = Pipeline(
+            id=str(uuid.uuid4()),
+            company_id=company_id,
+            name="Default Pipeline",
+            is_default=True
+        )
+        db.add(pipeline)
+        db.flush()
+
+    # Get "New" stage
+    stage = db.query(Stage).filter(
+        Stage.pipeline_id == pipeline.id,
+        Stage.name == "New"
+    ).first()
+    if not stage:
+        # Create default stages
+        stages = [
+            Stage(id=str(uuid.uuid4()), pipeline_id=pipeline.id, name="New", order=1),
+            Stage(id=str(uuid.uuid4()), pipeline_id=pipeline.id, name="Qualified", order=2),
+            Stage(id=str(uuid.uuid4()), pipeline_id=pipeline.id, name="Converted", order=3),
+        ]
+        db.add_all(stages)
+        db.flush()
+        stage = stages[0]
+
+    lead = Lead(
+        id=str(uuid.uuid4()),
+        company_id=company_id,
+        pipeline_id=pipeline.id,
+        stage_id=stage.id,
+        phone=data.phone_number,
+        normalized_phone=phone,
+        name=data.contact_name,
+        source="api"
+    )
+    try:
+        with db.begin_nested():
+            db.add(lead)
+    except IntegrityError:
+        return None  # Unique (company_id, normalized_phone)
+    return lead
+
+
 @app.post("/inbound-message")
 def inbound_message(data: InboundMessage):
     """
     Handle inbound messages from any channel
     Creates/updates lead, logs message, enqueues AI engagement
+
+    Leads are keyed by (company_id, E.164 phone); the lead id of a known
+    phone usually comes from lead_cache without touching the database.
+
+    Redeliveries of a provider_message_id already received on the channel
+    are answered with {"status": "duplicate"} and the original ids
+    (inbound_dedup). The message and its ai.engage job commit together.
     """
+    try:
+        phone = normalize_phone(data.phone_number)
+    except InvalidPhoneNumber as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    provider_id = data.provider_message_id
+    if provider_id:
+        original = inbound_dedup.reserve(data.channel, provider_id)
+        if original:
+            inbound_dedup.record(data.channel, "replay_redis")
+            return {"status": "duplicate", **original, "job_id": None}
+    else:
+        inbound_dedup.record(data.channel, "no_id")
+
+    timer = telemetry.StageTimer("inbound")
     db = SessionLocal()
+    company_id = None
+    cached = False
+    committed = False
     try:
+        company_id = data.company_id or _default_company(db)
+
         # Find or create lead
-        lead = db.query(Lead).filter(Lead.phone == data.phone_number).first()
-        if not lead:
-            # Get default company and pipeline (for now, use first available)
-            company = db.query(Company).first()
-            if not company:
-                # Create default company
-                company = Company(
-                    id=str(uuid.uuid4()),
-                    name="Default Company",
-                    timezone="UTC"
-                )
-                db.add(company)
-                db.flush()
-            
-            pipeline = db.query(Pipeline).filter(
-                Pipeline.company_id == company.id
-            ).first()
-            if not pipeline:
-                # Create default pipeline
-                pipeline = Pipeline(
-                    id=str(uuid.uuid4()),
-                    company_id=company.id,
-                    name="Default Pipeline",
-                    is_default=True
-                )
-                db.add(pipeline)
-                db.flush()
-            
-            # Get "New" stage
-            stage = db.query(Stage).filter(
-                Stage.pipeline_id == pipeline.id,
-                Stage.name == "New"
-            ).first()
-            if not stage:
-                # Create default stages
-                stages = [
-                    Stage(id=str(uuid.uuid4()), pipeline_id=pipeline.id, name="New", order=1),
-                    Stage(id=str(uuid.uuid4()), pipeline_id=pipeline.id, name="Qualified", order=2),
-                    Stage(id=str(uuid.uuid4()), pipeline_id=pipeline.id, name="Converted", order=3),
-                ]
-                db.add_all(stages)
-                db.flush()
-                stage = stages[0]
-            
-            # Create lead
-            lead = Lead(
-                id=str(uuid.uuid4()),
-                company_id=company.id,
-                pipeline_id=pipeline.id,
-                stage_id=stage.id,
-                phone=data.phone_number,
-                name=data.contact_name,
-                source="api"
-            )
-            db.add(lead)
-            db.flush()
-            
-            # Log LeadCreated event
-            event = Event(
-                type="LeadCreated",
-                entity_type="lead",
-                entity_id=lead.id,
-                payload={"phone": data.phone_number, "contact_name": data.contact_name, "source": "api"}
-            )
-            db.add(event)
+        lead_created = False
+        lead_id = lead_cache.get(company_id, phone)
+        cached = lead_id is not None
+        if lead_id is None:
+            lead_id = _find_lead_id(db, company_id, phone, data.phone_number)
+        if lead_id is None:
+            lead = _create_lead(db, company_id, phone, data)
+            if lead is None:
+                lead_id = _find_lead_id(db, company_id, phone, data.phone_number)
+            else:
+                lead_id, stage_id, lead_created = lead.id, lead.stage_id, True
+        timer.mark("lead")
 
-        # Create inbound message
+        # Create inbound message and its AI engagement (P1 - Priority 96-100 by
+        # lead score) in one transaction: a stored message always has its job
+        from queue_manager import add_job, release_added
         msg = Message(
             id=str(uuid.uuid4()),
-            lead_id=lead.id,
+            lead_id=lead_id,
+            company_id=company_id,
             channel=data.channel,
             direction="inbound",
             body=data.message_text,
-            status="received"
+            status="received",
+            external_id=provider_id
         )
         db.add(msg)
-        
-        # Log InboundMessageReceived event
-        event = Event(
-            type="InboundMessageReceived",
-            entity_type="message",
-            entity_id=msg.id,
-            payload={"lead_id": lead.id, "body": data.message_text, "channel": data.channel}
-        )
-        db.add(event)
-        
-        db.commit()
-        db.refresh(lead)
-        db.refresh(msg)
-
-        # Enqueue AI engagement (P1 - Priority 100)
-        job_id = enqueue_job(
-            job_type="ai.engage",
-            payload={"lead_id": lead.id},
-            idempotency_key=f"ai_engage_{lead.id}_{msg.id}"
+        try:
+            job = add_job(
+                db,
+                job_type="ai.engage",
+                payload={"lead_id": lead_id, "message_id": msg.id},
+                idempotency_key=f"ai_engage_{lead_id}_{msg.id}",
+                company_id=company_id,
+                lead_id=lead_id
+            )
+            job_id = job.id if job else None
+            db.commit()
+        except IntegrityError:
+            if not provider_id:
+                raise
+            # Replay that got past Redis: the unique (channel, external_id) stopped it
+            db.rollback()
+            original = db.query(Message.id, Message.lead_id).filter(
+                Message.channel == data.channel, Message.external_id == provider_id
+            ).first()
+            if original is None:
+                raise
+            inbound_dedup.confirm(data.channel, provider_id, original.lead_id, original.id)
+            inbound_dedup.record(data.channel, "replay_db")
+            # Messages stored before message and job shared a transaction may
+            # have lost their job; the idempotency key makes this a no-op otherwise
+            from queue_manager import enqueue_job
+            job_id = enqueue_job(
+                job_type="ai.engage",
+                payload={"lead_id": original.lead_id, "message_id": original.id},
+                idempotency_key=f"ai_engage_{original.lead_id}_{original.id}",
+                company_id=company_id,
+                lead_id=original.lead_id
+            ) if original.lead_id else None
+            return {"status": "duplicate", "lead_id": original.lead_id, "message_id": original.id, "job_id": job_id}
+        committed = True
+        timer.mark("persist")
+        if provider_id:
+            inbound_dedup.confirm(data.channel, provider_id, lead_id, msg.id)
+            inbound_dedup.record(data.channel, "new")
+        if not cached:
+            lead_cache.put(company_id, phone, lead_id)
+        conversation_cache.record_messages([msg])
+
+        # Log events (buffered, written in bulk off the request path)
+        if lead_created:
+            log_event(
+                "LeadCreated", "lead", lead_id,
+                {"phone": phone, "contact_name": data.contact_name, "source": "api", "stage_id": stage_id},
+                company_id=company_id
+            )
+        log_event(
+            "InboundMessageReceived", "message", msg.id,
+            {"lead_id": lead_id, "body": data.message_text, "channel": data.channel},
+            company_id=company_id
         )
 
+        if job:
+            release_added([job])
+        timer.mark("enqueue")
+
         return {
             "status": "queued",
-            "lead_id": lead.id,
+            "lead_id": lead_id,
             "message_id": msg.id,
             "job_id": job_id
         }
-    
+
+    except HTTPException:
+        db.rollback()
+        if provider_id and not committed:
+            inbound_dedup.release(data.channel, provider_id)
+        raise
     except Exception as e:
         db.rollback()
+        # Once committed, the retry must be answered as a duplicate, not stored twice
+        if provider_id and not committed:
+            inbound_dedup.release(data.channel, provider_id)
+        if cached:
+            # The cached lead may be gone (FK violation); look it up next time
+            lead_cache.invalidate(company_id, phone)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         db.close()
 
 
+@app.get("/health")
+def health():
+    """Liveness: no DB/broker round trip; includes boot phase timings (seconds)"""
+    return {"status": "ok", "boot": startup.report()}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics for this API process (workers export their own)"""
+    return Response(telemetry.render_metrics(), media_type=telemetry.CONTENT_TYPE)
+
+
+@app.get("/db/pools")
+def db_pools():
+    """Connection pool usage/saturation per role, replica lag and read routing (this process)"""
+    from database import get_pool_stats
+    return get_pool_stats()
+
+
 @app.get("/queue/stats")
 def queue_stats():
-    """Get queue statistics"""
-    from queue_manager import get_queue_stats
-    return get_queue_stats()
+    """Get queue statistics (plus enqueue/duplicate counts of this API process)"""
+    from queue_manager import get_queue_stats, get_enqueue_stats
+    return {**get_queue_stats(), "enqueue": get_enqueue_stats()}
+
+
+@app.get("/inbound/stats")
+def inbound_stats():
+    """Inbound deliveries, webhook replays dropped (by Redis / the unique index) and replay rate (this process)"""
+    return inbound_dedup.get_stats()
+
+
+@app.post("/webhooks/delivery-status", status_code=202)
+async def delivery_status_webhook(request: Request):
+    """
+    Batched provider delivery callbacks (sent/delivered/read/failed, bounces, opt-outs)
+    
+    Parsed and buffered only: updates are coalesced per external_id and
+    applied in bulk by a background flusher. Runs on the event loop, so
+    callback storms do not take threadpool slots from /inbound-message.
+    """
+    from delivery_status import ingest
+    
+    try:
+        return {"accepted": ingest(await request.json())}
+    except ValueError as e:  # Malformed JSON or StatusPayloadError
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/webhooks/delivery-status/stats")
+def delivery_status_stats():
+    """Status callbacks received, coalesced, applied, stale and pending (this process)"""
+    from delivery_status import get_status_stats
+    return get_status_stats()
+
+
+@app.get("/queue/tenants")
+def queue_tenants(window_minutes: int = 15):
+    """Per-company pending/in-flight jobs and queue wait (avg/p95 seconds)"""
+    from fair_scheduler import get_tenant_stats
+    return get_tenant_stats(window_minutes)
+
+
+@app.get("/ai/stats")
+def ai_stats():
+    """LLM requests, errors, hedge rate/wins, fallbacks and latency per model, plus breaker states (this process)"""
+    from llm_providers import get_llm_stats
+    from retry_policy import get_breaker_stats
+    return {"models": get_llm_stats(), "breakers": get_breaker_stats()}
+
+
+@app.post("/admin/profiling/rules")
+def add_profiling_rule(
+    job_type: Optional[str] = None,
+    company_id: Optional[str] = None,
+    sample_rate: float = 1.0,
+    minutes: float = 15
+):
+    """
+    Turn on sampling profiles for matching worker tasks
+
+    - job_type / company_id: scope (omit both to profile everything)
+    - sample_rate: fraction of matching tasks profiled
+    - minutes: rule lifetime; workers pick it up within PROFILE_RULES_REFRESH_SECONDS
+    """
+    from task_profiler import add_rule
+    return add_rule(job_type, company_id, sample_rate, minutes)
+
+
+@app.get("/admin/profiling/rules")
+def list_profiling_rules():
+    """Active profiling rules"""
+    from task_profiler import list_rules
+    return list_rules()
+
+
+@app.delete("/admin/profiling/rules/{rule_id}")
+def delete_profiling_rule(rule_id: str):
+    """Stop a profiling rule early"""
+    from task_profiler import delete_rule
+    if not delete_rule(rule_id):
+        raise HTTPException(status_code=404, detail="Rule not found")
+    return {"status": "deleted", "id": rule_id}
+
+
+@app.get("/admin/profiling/tasks")
+def list_task_profiles(company_id: Optional[str] = None, job_type: Optional[str] = None, limit: int = 50):
+    """Recent slow/profiled tasks: duration, query count, DB/LLM/send time"""
+    from task_profiler import list_profiles
+    return list_profiles(company_id, job_type, min(limit, 500))
+
+
+@app.get("/admin/profiling/tasks/{profile_id}/profile")
+def download_task_profile(profile_id: str):
+    """Collapsed stacks for flamegraph.pl / speedscope"""
+    from task_profiler import get_profile_stacks
+    stacks = get_profile_stacks(profile_id)
+    if not stacks:
+        raise HTTPException(status_code=404, detail="No profile captured for this task")
+    return Response(stacks, media_type="text/plain", headers={
+        "Content-Disposition": f'attachment; filename="profile_{profile_id}.folded"'
+    })
 
 
 @app.post("/admin/dlq/replay")
-def replay_dlq(limit: int = 10):
-    """Admin endpoint to replay jobs from Dead Letter Queue"""
+def replay_dlq(
+    limit: int = 10,
+    job_type: Optional[str] = None,
+    error_pattern: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    company_id: Optional[str] = None,
+    rate: Optional[float] = None,
+    dry_run: bool = False,
+    background: bool = False
+):
+    """
+    Admin endpoint to replay jobs from Dead Letter Queue
+    
+    - limit: max jobs to replay (0 = all matching)
+    - Filters: job_type, error_pattern (substring), since/until (created_at), company_id
+    - rate: max jobs released per second
+    - dry_run: only count matching jobs
+    - background: run the replay as a Celery task (large replays)
+    """
     from queue_manager import replay_dlq_jobs
-    replayed = replay_dlq_jobs(limit)
-    return {"replayed": replayed, "message": f"Replayed {replayed} jobs from DLQ"}
+    filters = dict(
+        limit=limit or None, job_type=job_type, error_pattern=error_pattern,
+        since=_utc(since),
+        until=_utc(until),
+        company_id=company_id, rate=rate
+    )
+    
+    if background and not dry_run:
+        from celery_app import celery
+        task = celery.send_task("worker.dlq_replay", kwargs={
+            **filters,
+            "since": filters["since"].isoformat() if filters["since"] else None,
+            "until": filters["until"].isoformat() if filters["until"] else None,
+        })
+        return {"status": "accepted", "task_id": task.id}
+    
+    result = replay_dlq_jobs(dry_run=dry_run, **filters)
+    if dry_run:
+        result["message"] = f"{result['matched']} DLQ jobs match"
+    else:
+        result["message"] = f"Replayed {result['replayed']} jobs from DLQ"
+    return result
+
+
+@app.get("/exports/{company_id}/{kind}")
+def export_history(
+    company_id: str,
+    kind: str,
+    format: str = "ndjson",
+    watermark: Optional[str] = None,
+    until: Optional[datetime] = None,
+    types: Optional[List[str]] = Query(None)
+):
+    """
+    Stream a company's full events/messages history for the warehouse
+    
+    - format: ndjson (streamed) or parquet (requires pyarrow)
+    - watermark: resume strictly after '<created_at>|<id>'
+    - X-Export-Watermark response header: pass it as `watermark` next time
+    """
+    from exports import stream_ndjson, write_parquet, parse_watermark, export_upper_bound, format_watermark, ExportError
+    
+    if kind not in ("events", "messages"):
+        raise HTTPException(status_code=404, detail=f"Unknown export: {kind}")
+    try:
+        parse_watermark(watermark)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    upper = export_upper_bound(_utc(until))
+    headers = {"X-Export-Watermark": format_watermark(upper)}
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_ndjson(kind, company_id, watermark, upper, types),
+            media_type="application/x-ndjson",
+            headers=headers
+        )
+    if format == "parquet":
+        try:
+            path = write_parquet(kind, company_id, watermark, upper, types)
+        except ExportError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        return FileResponse(
+            path,
+            media_type="application/vnd.apache.parquet",
+            filename=f"{kind}_{company_id}.parquet",
+            headers=headers,
+            background=BackgroundTask(os.remove, path)
+        )
+    raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+
+@app.post("/imports/{company_id}/leads")
+async def import_leads(
+    company_id: str,
+    request: Request,
+    format: Optional[str] = None,
+    pipeline_id: Optional[str] = None,
+    stage_id: Optional[str] = None,
+    phone_channel: str = "wa_web"
+):
+    """
+    Bulk-load leads from a CSV or NDJSON request body (streamed, never buffered)
+    
+    - format: csv or ndjson (default: from Content-Type)
+    - pipeline_id / stage_id: for new leads (default pipeline, "New" stage)
+    - Upsert by phone (E.164) or email; progress at GET /imports/{import_id}
+    """
+    from starlette.concurrency import run_in_threadpool
+    from lead_import import LeadImporter, LeadImportError, format_from_content_type
+    
+    try:
+        importer = LeadImporter(
+            company_id, format or format_from_content_type(request.headers.get("content-type")),
+            pipeline_id, stage_id, phone_channel
+        )
+        await run_in_threadpool(importer.begin)
+    except LeadImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(importer.feed, chunk)
+        return await run_in_threadpool(importer.finish)
+    except Exception as e:
+        await run_in_threadpool(importer.fail, e)
+        raise HTTPException(status_code=500, detail=f"Import {importer.import_id} failed: {e}")
+
+
+@app.get("/imports")
+def list_lead_imports(company_id: Optional[str] = None, limit: int = 50):
+    """Recent bulk imports with their progress counters"""
+    from lead_import import list_imports
+    return list_imports(company_id, limit)
+
+
+@app.get("/imports/{import_id}")
+def get_lead_import(import_id: str):
+    """Progress of one import: rows read, inserted/updated, rows per second"""
+    from lead_import import get_import
+    result = get_import(import_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return result
+
+
+@app.post("/campaigns")
+def create_campaign(data: CampaignCreate):
+    """
+    Broadcast a template to a lead segment (stage_ids, sources, attributes)
+    
+    Jobs are fanned out in bulk and paced to the channel's send rate by the
+    campaign scheduler; follow progress at GET /campaigns/{campaign_id}
+    """
+    import campaigns
+    try:
+        return campaigns.create_campaign(
+            data.company_id, data.name, data.channel, data.template_id,
+            data.segment.model_dump(exclude_none=True), data.rate
+        )
+    except campaigns.CampaignError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/campaigns")
+def list_campaigns(company_id: Optional[str] = None, limit: int = 50):
+    """Recent campaigns with their progress counters"""
+    from campaigns import list_campaigns as list_all
+    return list_all(company_id, limit)
+
+
+@app.get("/campaigns/{campaign_id}")
+def get_campaign(campaign_id: str):
+    """Progress: enqueued/sent/failed, send rate and ETA"""
+    from campaigns import get_campaign as get_one
+    result = get_one(campaign_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return result
+
+
+@app.post("/campaigns/{campaign_id}/{action}")
+def change_campaign(campaign_id: str, action: str):
+    """pause, resume or cancel a campaign"""
+    import campaigns
+    statuses = {"pause": "paused", "resume": "running", "cancel": "cancelled"}
+    if action not in statuses:
+        raise HTTPException(status_code=404, detail=f"Unknown action: {action}")
+    try:
+        result = campaigns.set_status(campaign_id, statuses[action])
+    except campaigns.CampaignError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return result
+
+
+@app.get("/reports/{company_id}/{slug}")
+def get_report(company_id: str, slug: str):
+    """
+    Serve a cached dashboard report (funnel_by_stage, response_time, channel_delivery)
+    with staleness metadata; maintained incrementally by the reports refresh task
+    """
+    try:
+        return reports.get_report(company_id, slug)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown report: {slug}")
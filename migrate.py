@@ -0,0 +1,225 @@
+"""
+Schema Migration
+Explicit deploy step: create missing tables/indexes and the events partitions
+
+    python migrate.py                      # Before starting API/workers
+    python migrate.py --partition-events   # One-off: convert a legacy events table
+
+The API no longer touches the schema while booting (except with
+AUTO_MIGRATE=1, the default for the SQLite development database), so cold
+starts and health checks do not wait on DDL and many replicas can start at
+once without racing each other's CREATE TABLE.
+
+Columns and indexes added to existing models are created on tables that
+already exist (create_all only creates missing tables), followed by data
+backfills such as leads.normalized_phone and events/messages.company_id.
+An index whose uniqueness changed in the model is dropped and rebuilt.
+"""
+import argparse
+import time
+
+from sqlalchemy import UniqueConstraint, inspect, select, text, update
+
+from database import engine, SessionLocal
+from models import Base, Event, Lead, Message
+from phones import try_normalize_phone
+import event_log
+
+BACKFILL_BATCH = 1000
+
+
+def add_missing_columns() -> list:
+    """ALTER TABLE ... ADD COLUMN for model columns missing from existing tables"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column.type.compile(dialect=engine.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def drop_changed_indexes() -> list:
+    """DROP INDEX for indexes whose unique flag or columns no longer match the model (rebuilt below)"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    dropped = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {
+                index["name"]: (bool(index["unique"]), list(index["column_names"]))
+                for index in inspector.get_indexes(table.name)
+            }
+            for index in table.indexes:
+                if index.name in present and present[index.name] != (bool(index.unique), [c.name for c in index.columns]):
+                    conn.execute(text(f'DROP INDEX "{index.name}"'))
+                    dropped.append(index.name)
+    return dropped
+
+
+def drop_removed_unique_constraints() -> tuple:
+    """
+    Drop UNIQUE constraints that the model no longer declares
+
+    Returns:
+        (dropped, kept): "table.name" entries; SQLite cannot drop a
+        constraint from its CREATE TABLE, so those are kept (rebuild the
+        development database to lose them)
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    dropped, kept = [], []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            declared = {
+                frozenset(c.name for c in constraint.columns)
+                for constraint in table.constraints if isinstance(constraint, UniqueConstraint)
+            }
+            for constraint in inspector.get_unique_constraints(table.name):
+                if frozenset(constraint["column_names"]) in declared:
+                    continue
+                label = f"{table.name}.{constraint['name'] or '+'.join(constraint['column_names'])}"
+                if engine.dialect.name == "sqlite" or not constraint["name"]:
+                    kept.append(label)
+                    continue
+                conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{constraint["name"]}"'))
+                dropped.append(label)
+    return dropped, kept
+
+
+def backfill_normalized_phones() -> int:
+    """
+    Fill leads.normalized_phone for rows created before it existed
+
+    Oldest lead wins when several raw spellings of one number exist in a
+    company; the others keep NULL (and stay reachable by id) so the unique
+    (company_id, normalized_phone) index can be built.
+    """
+    db = SessionLocal()
+    try:
+        taken = set(db.query(Lead.company_id, Lead.normalized_phone).filter(
+            Lead.normalized_phone.isnot(None)
+        ))
+        rows = db.query(Lead.id, Lead.company_id, Lead.phone).filter(
+            Lead.normalized_phone.is_(None), Lead.phone.isnot(None)
+        ).order_by(Lead.created_at, Lead.id).all()
+        updates = []
+        for lead_id, company_id, phone in rows:
+            normalized = try_normalize_phone(phone)
+            if normalized is None or (company_id, normalized) in taken:
+                continue
+            taken.add((company_id, normalized))
+            updates.append({"id": lead_id, "normalized_phone": normalized})
+        for start in range(0, len(updates), BACKFILL_BATCH):
+            db.execute(update(Lead), updates[start:start + BACKFILL_BATCH])
+            db.commit()
+        return len(updates)
+    finally:
+        db.close()
+
+
+def backfill_event_companies() -> int:
+    """
+    Fill events.company_id for events logged before it existed
+
+    Lead and message events resolve their company through the lead; other
+    legacy events keep NULL (tenant-scoped reports and exports skip them).
+    """
+    lead_company = select(Lead.company_id).where(Lead.id == Event.entity_id).scalar_subquery()
+    message_company = select(Lead.company_id).join(Message, Message.lead_id == Lead.id).where(
+        Message.id == Event.entity_id
+    ).scalar_subquery()
+    filled = 0
+    with engine.begin() as conn:
+        for entity_type, company in (("lead", lead_company), ("message", message_company)):
+            filled += conn.execute(
+                update(Event).where(Event.company_id.is_(None), Event.entity_type == entity_type)
+                .values(company_id=company)
+            ).rowcount
+    return filled
+
+
+def backfill_message_companies() -> int:
+    """Fill messages.company_id (tenant-scoped exports) from the message's lead"""
+    company = select(Lead.company_id).where(Lead.id == Message.lead_id).scalar_subquery()
+    with engine.begin() as conn:
+        return conn.execute(
+            update(Message).where(Message.company_id.is_(None), Message.lead_id.isnot(None))
+            .values(company_id=company)
+        ).rowcount
+
+
+def migrate(partition_events: bool = False) -> dict:
+    """
+    Bring the schema up to date (idempotent)
+
+    Returns:
+        {"seconds": float, "added_columns": [...], "dropped_indexes": [...],
+         "dropped_constraints": [...], "kept_constraints": [...], "backfilled_phones": n,
+         "backfilled_event_companies": n, "backfilled_message_companies": n, "created_partitions": [...], "partitioned": {...}}
+    """
+    start = time.perf_counter()
+    result = {}
+    if partition_events:
+        result["partitioned"] = event_log.migrate_to_partitioned()
+    result["added_columns"] = add_missing_columns()
+    result["dropped_indexes"] = drop_changed_indexes()
+    result["dropped_constraints"], result["kept_constraints"] = drop_removed_unique_constraints()
+    Base.metadata.create_all(bind=engine)
+    result["backfilled_phones"] = backfill_normalized_phones()
+    result["backfilled_event_companies"] = 0
+    if "events.company_id" in result["added_columns"] or result.get("partitioned", {}).get("migrated"):
+        result["backfilled_event_companies"] = backfill_event_companies()
+    result["backfilled_message_companies"] = 0
+    if "messages.company_id" in result["added_columns"]:
+        result["backfilled_message_companies"] = backfill_message_companies()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    result["created_partitions"] = event_log.ensure_partitions()
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create/upgrade the database schema")
+    parser.add_argument("--partition-events", action="store_true",
+                        help="Convert a plain events table to monthly partitions (PostgreSQL)")
+    args = parser.parse_args()
+    result = migrate(args.partition_events)
+    print(f"✅ Schema up to date in {result['seconds']}s ({engine.url.render_as_string(hide_password=True)})")
+    if result["added_columns"]:
+        print(f"   Added columns: {', '.join(result['added_columns'])}")
+    if result["dropped_indexes"]:
+        print(f"   Rebuilt indexes: {', '.join(result['dropped_indexes'])}")
+    if result["dropped_constraints"]:
+        print(f"   Dropped unique constraints: {', '.join(result['dropped_constraints'])}")
+    if result["kept_constraints"]:
+        print(f"⚠️  Unique constraints no longer in the models (SQLite cannot drop them): "
+              f"{', '.join(result['kept_constraints'])}")
+    if result["backfilled_phones"]:
+        print(f"   Normalized phones: {result['backfilled_phones']} leads")
+    if result["backfilled_event_companies"]:
+        print(f"   Event companies: {result['backfilled_event_companies']} events")
+    if result["backfilled_message_companies"]:
+        print(f"   Message companies: {result['backfilled_message_companies']} messages")
+    if result["created_partitions"]:
+        print(f"   Created partitions: {', '.join(result['created_partitions'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, Text, JSON, Index
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, Text, JSON, Index, event, inspect
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
+from datetime import datetime
+import secrets
+import time
 import uuid
 
 # ============================================================================
@@ -14,6 +17,8 @@ class Company(Base):
     name = Column(String, nullable=False)
     timezone = Column(String, default="UTC")
     plan = Column(String, default="free")  # free, pro, enterprise
+    scheduling_weight = Column(Float, nullable=True)  # Fair-share weight; None → plan default
+    max_in_flight = Column(Integer, nullable=True)  # Job quota in the broker/workers; None → default
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Company card for AI context
@@ -60,7 +65,8 @@ class Lead(Base):
     stage_id = Column(String, ForeignKey("stages.id"))
     source = Column(String)  # google_ads, facebook, whatsapp, etc.
     name = Column(String)
-    phone = Column(String)
+    phone = Column(String)  # As received
+    normalized_phone = Column(String)  # E.164 (phones.normalize_phone); lookup key
     email = Column(String)
     attributes = Column(JSON)  # Custom attributes
     status = Column(String, default="active")  # active, inactive, archived
@@ -69,7 +75,10 @@ class Lead(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     __table_args__ = (
-        Index('idx_company_phone', 'company_id', 'phone', unique=True),
+        Index('idx_company_phone', 'company_id', 'phone'),  # Raw spelling; not unique (normalized_phone is the key)
+        Index('idx_company_normalized_phone', 'company_id', 'normalized_phone', unique=True),
+        Index('idx_company_email', 'company_id', 'email'),
+        Index('idx_company_lead_id', 'company_id', 'id'),  # Keyset scans of a company's leads
     )
 
 class LeadContact(Base):
@@ -79,6 +88,33 @@ class LeadContact(Base):
     channel = Column(String)  # wa_web, wa_cloud, email, sms
     handle = Column(String)  # phone number, email address
     verified = Column(Boolean, default=False)
+    
+    __table_args__ = (
+        Index('idx_lead_contact_handle', 'lead_id', 'channel', 'handle', unique=True),
+    )
+
+class LeadImport(Base):
+    """Bulk lead import (lead_import.py); counters are updated after every chunk"""
+    __tablename__ = "lead_imports"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    company_id = Column(String, ForeignKey("companies.id"))
+    pipeline_id = Column(String, ForeignKey("pipelines.id"))
+    stage_id = Column(String, ForeignKey("stages.id"))
+    format = Column(String)  # csv, ndjson
+    status = Column(String, default="running")  # running, completed, failed
+    rows_read = Column(Integer, default=0)
+    inserted = Column(Integer, default=0)
+    updated = Column(Integer, default=0)
+    duplicates = Column(Integer, default=0)  # Repeated phone/email within the upload
+    invalid = Column(Integer, default=0)  # No usable phone or email
+    rows_per_second = Column(Float, default=0.0)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        Index('idx_lead_import_company_started', 'company_id', 'started_at'),
+    )
 
 # ============================================================================
 # MESSAGES & EVENTS
@@ -88,32 +124,68 @@ class Message(Base):
     __tablename__ = "messages"
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     lead_id = Column(String, ForeignKey("leads.id"))
+    company_id = Column(String, nullable=True)  # The lead's company (tenant-scoped exports)
     channel = Column(String)  # wa_web, wa_cloud, email
     direction = Column(String)  # inbound, outbound
     template_id = Column(String, ForeignKey("templates.id"), nullable=True)
     body = Column(Text)
     status = Column(String)  # queued, sent, delivered, read, failed
-    external_id = Column(String, unique=True, nullable=True)  # For idempotency
+    external_id = Column(String, nullable=True)  # Provider message id; unique per channel (idempotency)
     error = Column(Text, nullable=True)
     sent_at = Column(DateTime(timezone=True))
     delivered_at = Column(DateTime(timezone=True))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Python-side default keeps microsecond precision on every backend (keyset exports)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     
     __table_args__ = (
-        Index('idx_external_id', 'external_id', unique=True),
+        Index('idx_channel_external_id', 'channel', 'external_id', unique=True),  # Inbound dedup per provider
+        Index('idx_external_id', 'external_id'),  # Delivery status callbacks
+        Index('idx_message_created', 'created_at', 'id'),  # Keyset export order
+        Index('idx_message_lead_created', 'lead_id', 'created_at'),  # Per-lead history, lead scoring
+        Index('idx_message_company_created', 'company_id', 'created_at', 'id'),  # Per-company export order
     )
 
+def new_event_id() -> str:
+    """UUIDv7-style id: 48-bit millisecond timestamp followed by random bits"""
+    value = (int(time.time() * 1000) << 80) | secrets.randbits(80)
+    value = (value & ~(0xF << 76)) | (0x7 << 76)  # version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # RFC 4122 variant
+    h = f"{value:032x}"
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
 class Event(Base):
     __tablename__ = "events"
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    # Time-ordered id, so inserts append to the end of the primary key index;
+    # created_at is part of the key so PostgreSQL can range-partition the
+    # table by month
+    id = Column(String, primary_key=True, default=new_event_id)
+    created_at = Column(DateTime(timezone=True), primary_key=True, default=datetime.utcnow,
+                        server_default=func.now())
     type = Column(String)  # LeadCreated, StageChanged, MessageSent, AIEngaged
+    company_id = Column(String, nullable=True)
     entity_type = Column(String)  # lead, message, stage
     entity_id = Column(String)
     payload = Column(JSON)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     __table_args__ = (
         Index('idx_entity', 'entity_type', 'entity_id'),
+        Index('idx_event_company_created', 'company_id', 'created_at'),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+class EmailSuppression(Base):
+    """Addresses not to email (delivery_status: bounces, unsubscribes, complaints)"""
+    __tablename__ = "email_suppressions"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    company_id = Column(String, ForeignKey("companies.id"))
+    email = Column(String, nullable=False)  # Lower-cased
+    reason = Column(String)  # bounced (applies to every company), unsubscribed, complained
+    external_id = Column(String, nullable=True)  # Message whose callback caused it
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_suppression_company_email', 'company_id', 'email', unique=True),
+        Index('idx_suppression_email', 'email'),
     )
 
 # ============================================================================
@@ -142,6 +214,52 @@ class SequenceStep(Base):
     ai_flag = Column(Boolean, default=False)
     stop_on_reply = Column(Boolean, default=True)
 
+class SequenceEnrollment(Base):
+    __tablename__ = "sequence_enrollments"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    sequence_id = Column(String, ForeignKey("sequences.id"))
+    lead_id = Column(String, ForeignKey("leads.id"))
+    company_id = Column(String, ForeignKey("companies.id"))
+    stage_id = Column(String, ForeignKey("stages.id"), nullable=True)  # Stage at enrollment (stop on change)
+    next_step_no = Column(Integer, default=1)
+    status = Column(String, default="active")  # active, completed, stopped
+    stop_reason = Column(String, nullable=True)  # replied, stage_changed, lead_inactive, sequence_inactive
+    next_run_at = Column(DateTime(timezone=True), nullable=True)
+    last_step_at = Column(DateTime(timezone=True), nullable=True)
+    enrolled_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_enrollment_due', 'status', 'next_run_at'),
+        Index('idx_enrollment_lead_sequence', 'lead_id', 'sequence_id', unique=True),
+    )
+
+class Campaign(Base):
+    """Broadcast of one template to a lead segment (campaigns.py)"""
+    __tablename__ = "campaigns"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    company_id = Column(String, ForeignKey("companies.id"))
+    name = Column(String)
+    channel = Column(String)  # wa_web, wa_cloud, email
+    template_id = Column(String, ForeignKey("templates.id"))
+    segment = Column(JSON)  # {"stage_ids": [...], "sources": [...], "attributes": {key: value}}
+    rate = Column(Float, nullable=True)  # Max sends/second (never above the channel limit)
+    status = Column(String, default="running")  # running, sending, completed, paused, cancelled
+    total = Column(Integer, default=0)  # Segment size at start
+    enqueued = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)  # Lead already had this campaign's job
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    cursor = Column(String, nullable=True)  # Last lead id fanned out (keyset on leads.id)
+    credit = Column(Float, default=0.0)  # Unspent send allowance (fractional sends)
+    last_tick_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        Index('idx_campaign_status', 'status'),
+        Index('idx_campaign_company_created', 'company_id', 'created_at'),
+    )
+
 class Template(Base):
     __tablename__ = "templates"
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -152,6 +270,29 @@ class Template(Base):
     params = Column(JSON)  # Template variables
     meta = Column(JSON)  # Channel-specific metadata
     status = Column(String, default="pending")  # pending, approved, rejected
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on content edits (render cache)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+TEMPLATE_CONTENT = ("channel", "body", "params", "meta")  # Columns compiled into a render
+
+
+@event.listens_for(Template, "before_update")
+def _bump_template_version(mapper, connection, target):
+    # A plain counter, not optimistic locking: concurrent edits both commit,
+    # each incrementing in SQL, and cached renders see a new version
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in TEMPLATE_CONTENT):
+        target.version = Template.version + 1
+
+class WebhookEndpoint(Base):
+    __tablename__ = "webhook_endpoints"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    company_id = Column(String, ForeignKey("companies.id"))
+    url = Column(String, nullable=False)
+    secret = Column(String)  # HMAC-SHA256 signing key
+    batch_events = Column(Boolean, default=False)  # Deliver several events per request
+    active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 # ============================================================================
@@ -198,19 +339,98 @@ class Job(Base):
     __tablename__ = "jobs"
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     job_type = Column(String)  # ai.engage, followup.bumpup, sequence.step, etc.
+    company_id = Column(String, nullable=True)  # Tenant (DLQ replay filters, fair scheduling)
     priority = Column(Integer)  # P1: 90-100, P2: 50-70
     payload = Column(JSON)
-    status = Column(String, default="queued")  # queued, processing, completed, failed, dlq
+    status = Column(String, default="queued")  # pending, queued, processing, completed, failed, dlq
     attempts = Column(Integer, default=0)
     max_attempts = Column(Integer, default=5)
     error = Column(Text, nullable=True)
+    last_backoff = Column(Float, nullable=True)  # Seconds; seeds the next decorrelated-jitter delay
     idempotency_key = Column(String, unique=True, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)  # Released to the broker
     started_at = Column(DateTime(timezone=True), nullable=True)
     completed_at = Column(DateTime(timezone=True), nullable=True)
     
     __table_args__ = (
         Index('idx_status_priority', 'status', 'priority'),
+        Index('idx_status_priority_company', 'status', 'priority', 'company_id', 'created_at'),  # Fair dispatch
+        Index('idx_status_created', 'status', 'created_at', 'id'),  # DLQ replay keyset order
+        Index('idx_status_completed', 'status', 'completed_at'),  # Retention scan
+    )
+
+
+class JobArchive(Base):
+    """Finished jobs moved out of the live jobs table by job_retention"""
+    __tablename__ = "jobs_archive"
+    id = Column(String, primary_key=True)
+    job_type = Column(String)
+    company_id = Column(String, nullable=True)
+    priority = Column(Integer)
+    payload = Column(JSON)
+    status = Column(String)
+    attempts = Column(Integer)
+    error = Column(Text, nullable=True)
+    idempotency_key = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True))
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_archive_completed', 'completed_at'),
+    )
+
+
+class IdempotencyKey(Base):
+    """Time-bounded dedup keys; outlive the jobs they point at"""
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    job_id = Column(String)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    
+    __table_args__ = (
+        Index('idx_idempotency_expires', 'expires_at'),
+    )
+
+# ============================================================================
+# TASK PROFILING
+# ============================================================================
+
+class ProfilingRule(Base):
+    """Profile matching tasks until expires_at (NULL job_type/company_id = any)"""
+    __tablename__ = "profiling_rules"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    job_type = Column(String, nullable=True)
+    company_id = Column(String, nullable=True)
+    sample_rate = Column(Float, default=1.0)  # Fraction of matching tasks profiled
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+
+
+class TaskProfile(Base):
+    """Slow-task record and (when sampled) its collapsed-stack profile"""
+    __tablename__ = "task_profiles"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    task = Column(String)
+    job_id = Column(String, nullable=True)
+    job_type = Column(String, nullable=True)
+    company_id = Column(String, nullable=True)
+    reason = Column(String)  # slow, profiled
+    duration = Column(Float)  # Seconds
+    query_count = Column(Integer)
+    db_seconds = Column(Float)
+    llm_seconds = Column(Float)
+    send_seconds = Column(Float)
+    samples = Column(Integer, default=0)
+    stacks = Column(Text, nullable=True)  # "frame;frame;frame count" lines (flamegraph/speedscope)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    
+    __table_args__ = (
+        Index('idx_task_profile_company_created', 'company_id', 'created_at'),
+        Index('idx_task_profile_created', 'created_at'),
     )
 
 # ============================================================================
@@ -224,3 +444,9 @@ class ReportCache(Base):
     slug = Column(String)
     json = Column(JSON)
     computed_at = Column(DateTime(timezone=True), server_default=func.now())
+    watermark = Column(String, nullable=True)  # Last event applied: "<created_at>|<id>"
+    invalidated_at = Column(DateTime(timezone=True), nullable=True)  # Set → full recompute on next refresh
+    
+    __table_args__ = (
+        Index('idx_report_company_slug', 'company_id', 'slug', unique=True),
+    )
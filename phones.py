@@ -0,0 +1,79 @@
+"""
+Phone Numbers
+Canonical E.164 form for lead phone numbers
+
+"+91 98765-43210", "0091 9876543210", "919876543210", "09876543210" and
+"919876543210@c.us" all become "+919876543210". Numbers written without a
+country code get PHONE_DEFAULT_COUNTRY_CODE.
+
+Uses the `phonenumbers` package when it is installed (per-country trunk
+prefixes and lengths); otherwise a digit-based fallback that assumes
+national numbers are at most PHONE_NATIONAL_NUMBER_LENGTH digits.
+"""
+import os
+import re
+
+try:
+    import phonenumbers
+except ImportError:  # Optional: pip install phonenumbers
+    phonenumbers = None
+
+DEFAULT_COUNTRY_CODE = os.getenv("PHONE_DEFAULT_COUNTRY_CODE", "91")
+NATIONAL_NUMBER_LENGTH = int(os.getenv("PHONE_NATIONAL_NUMBER_LENGTH", "10"))
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+class InvalidPhoneNumber(ValueError):
+    """Raised when a string cannot be read as a phone number"""
+
+
+def normalize_phone(raw: str, country_code: str = None) -> str:
+    """
+    E.164 form of a phone number
+
+    Args:
+        raw: Phone number as received (any spacing/punctuation, WhatsApp JID)
+        country_code: Calling code for numbers written without one
+            (default: PHONE_DEFAULT_COUNTRY_CODE)
+
+    Returns:
+        "+<country code><national number>"
+
+    Raises:
+        InvalidPhoneNumber: Empty, or not 8-15 digits once normalized
+    """
+    text = (raw or "").strip().split("@", 1)[0]
+    country_code = country_code or DEFAULT_COUNTRY_CODE
+
+    if phonenumbers is not None:
+        region = phonenumbers.region_code_for_country_code(int(country_code))
+        try:
+            number = phonenumbers.parse(text, None if region == "ZZ" else region)
+        except phonenumbers.NumberParseException as e:
+            raise InvalidPhoneNumber(f"Invalid phone number {raw!r}: {e}")
+        if not phonenumbers.is_possible_number(number):
+            raise InvalidPhoneNumber(f"Invalid phone number {raw!r}")
+        return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+    digits = _NON_DIGITS.sub("", text)
+    if text.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]  # International dialling prefix
+    else:
+        national = digits.lstrip("0")  # Trunk prefix
+        if len(national) <= NATIONAL_NUMBER_LENGTH:
+            digits = country_code + national
+
+    if not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        raise InvalidPhoneNumber(f"Invalid phone number {raw!r}")
+    return f"+{digits}"
+
+
+def try_normalize_phone(raw: str, country_code: str = None):
+    """normalize_phone(), or None for missing/invalid numbers"""
+    try:
+        return normalize_phone(raw, country_code)
+    except InvalidPhoneNumber:
+        return None
@@ -1,12 +1,23 @@
 """
 Phase 2: Priority-based Queue Manager
 Handles job priorities, DLQ, idempotency, and retry logic
+(failure classification and backoff live in retry_policy)
 """
 from celery_app import celery
-from database import SessionLocal
-from models import Job
-from datetime import datetime
+from database import SessionLocal, ReadSessionLocal
+from models import Job, Lead
+import idempotency
+import retry_policy
+import task_profiler
+import telemetry
+from sqlalchemy import insert, func, tuple_, select, cast, Integer, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
 import json
+import os
+import threading
+import time
+import uuid
 
 # ============================================================================
 # JOB PRIORITIES (Non-Negotiable from SHVYA Guide)
@@ -20,78 +31,376 @@ PRIORITIES = {
     # P2: Timed/scheduled (lower priority)
     "sequence.step": 70,
     "email.sequence": 60,
+    "campaign.send": 55,
     "webhook.reminder": 50,
 }
 
+# Redis transport: broker priorities are 0-9 with 0 served first (see
+# broker_transport_options in celery_app). Job priorities are 50-100 with
+# 100 most urgent, so they are mapped rather than passed through (kombu
+# would clamp every one of them to 9).
+def broker_priority(priority: int) -> int:
+    """Job priority (50-100, higher first) → broker priority (0-9, lower first)"""
+    return max(0, min(9, (100 - (priority or 0)) // 6))
+
+
+# Lead score (Lead.priority 0-100, see lead_scoring) moves a conversational
+# job within its slice of the P1 band: ai.engage 96-100, followup.bumpup
+# 91-95, so hot leads are answered first and no score crosses job types
+SCORE_SPREAD = {
+    "ai.engage": 4,
+    "followup.bumpup": 4,
+}
+LEAD_SCORE_PRIORITY = os.getenv("LEAD_SCORE_PRIORITY", "1") == "1"
+
+
+def job_priority(job_type: str, lead_score: int = None) -> int:
+    """Job priority for a job type, blended with the lead's score when it has one"""
+    base = PRIORITIES.get(job_type, 50)
+    spread = SCORE_SPREAD.get(job_type) if LEAD_SCORE_PRIORITY else None
+    if not spread or lead_score is None:
+        return base
+    return base - spread + round(spread * min(max(lead_score, 0), 100) / 100)
+
+
+def _scored_priority(job_type: str, lead_id: str):
+    """job_priority() as a scalar subquery on the lead, computed inside the INSERT"""
+    base = PRIORITIES.get(job_type, 50)
+    spread = SCORE_SPREAD[job_type]
+    score = func.coalesce(Lead.priority, 0)
+    return func.coalesce(select(
+        cast(base - spread + func.round(score * spread / 100.0), Integer)
+    ).where(Lead.id == lead_id).scalar_subquery(), base)
+
+
+# Tenant-fair dispatch: new jobs wait as "pending" and fair_scheduler
+# releases them to the broker per company (see fair_scheduler.py)
+FAIR_SCHEDULING = os.getenv("FAIR_SCHEDULING", "1") == "1"
+_last_kick = 0.0
+
+# Enqueue outcomes in this process (get_enqueue_stats, /queue/stats)
+ENQUEUE_RESULTS = ("created", "duplicate_redis", "duplicate_db")
+_enqueue_counts = {}
+_enqueue_lock = threading.Lock()
+
 # ============================================================================
 # QUEUE HELPER FUNCTIONS
 # ============================================================================
 
-def enqueue_job(job_type: str, payload: dict, idempotency_key: str = None):
+def _count_enqueue(job_type: str, result: str, count: int = 1):
+    with _enqueue_lock:
+        _enqueue_counts[result] = _enqueue_counts.get(result, 0) + count
+    telemetry.JOBS_ENQUEUED.inc(count, job_type=job_type, result=result)
+
+
+def get_enqueue_stats() -> dict:
+    """Enqueues and idempotent duplicates (by where they were caught) in this process"""
+    with _enqueue_lock:
+        counts = {result: _enqueue_counts.get(result, 0) for result in ENQUEUE_RESULTS}
+    total = sum(counts.values())
+    duplicates = total - counts["created"]
+    return {**counts, "duplicate_rate": round(duplicates / total, 4) if total else 0.0}
+
+
+def enqueue_job(job_type: str, payload: dict, idempotency_key: str = None, company_id: str = None,
+                lead_id: str = None):
     """
     Central enqueue helper - enforces priorities and idempotency
     
+    A repeated idempotency_key is caught by the Redis front filter or, at
+    the latest, by the key claim in the same transaction as the INSERT -
+    no SELECT before the write, and concurrent callers never fail.
+    
     Args:
         job_type: Type of job (must be in PRIORITIES)
         payload: Job data
         idempotency_key: Optional key for deduplication
+        company_id: Tenant the job belongs to
+        lead_id: Lead the job is about; its score is blended into the
+            priority of conversational jobs (no extra round trip)
     
     Returns:
-        Job ID or None if duplicate
+        Job ID - for a duplicate key, the ID of the job that already has it
     """
+    job_id = str(uuid.uuid4())
+    if idempotency_key:
+        existing = idempotency.reserve(idempotency_key, job_id)
+        if existing:
+            _count_enqueue(job_type, "duplicate_redis")
+            return existing
+    
     db = SessionLocal()
     try:
-        # Check idempotency
+        # Claim the key (returns the owner's job id if it is taken)
         if idempotency_key:
-            existing = db.query(Job).filter(
-                Job.idempotency_key == idempotency_key
-            ).first()
-            if existing:
-                return None  # Job already exists
+            owner = idempotency.claim_keys(db, [(idempotency_key, job_id)])[idempotency_key]
+            if owner != job_id:
+                db.rollback()
+                idempotency.confirm(idempotency_key, owner)
+                _count_enqueue(job_type, "duplicate_db")
+                return owner
         
         # Get priority
-        priority = PRIORITIES.get(job_type, 50)
+        if lead_id and LEAD_SCORE_PRIORITY and job_type in SCORE_SPREAD:
+            priority = _scored_priority(job_type, lead_id)
+        else:
+            priority = PRIORITIES.get(job_type, 50)
         
         # Create job record
         job = Job(
+            id=job_id,
             job_type=job_type,
+            company_id=company_id,
             priority=priority,
-            payload=payload,
+            payload=telemetry.inject(payload),
             idempotency_key=idempotency_key,
-            status="queued"
+            status=initial_status()
         )
         db.add(job)
-        db.commit()
-        db.refresh(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            # Expired key whose old job is still in the live table
+            db.rollback()
+            owner = db.query(Job.id).filter(Job.idempotency_key == idempotency_key).scalar()
+            if owner is None:
+                raise
+            idempotency.confirm(idempotency_key, owner)
+            _count_enqueue(job_type, "duplicate_db")
+            return owner
+        if idempotency_key:
+            idempotency.confirm(idempotency_key, job_id)
+        _count_enqueue(job_type, "created")
         
-        # Enqueue to Celery with priority
-        task_name = f"worker.{job_type.replace('.', '_')}"
-        celery.send_task(
-            task_name,
-            args=[job.id],
-            priority=priority,
-            kwargs={"job_id": job.id}
-        )
+        if not isinstance(priority, int):
+            # Scored priority was computed by the INSERT; only a direct publish reads it back
+            priority = None if FAIR_SCHEDULING else job.priority
+        
+        # Enqueue to Celery with priority (or hand over to the fair dispatcher)
+        release_jobs([(job_id, job_type, priority)])
         
-        return job.id
+        return job_id
     
     except Exception as e:
         db.rollback()
+        if idempotency_key:
+            idempotency.release(idempotency_key)
         raise e
     finally:
         db.close()
 
 
+def add_job(db, job_type: str, payload: dict, idempotency_key: str = None, company_id: str = None,
+            lead_id: str = None):
+    """
+    Add a Job to the caller's transaction (enqueue_job() without its own commit)
+
+    For writes that must commit together with their job - an inbound
+    message and its ai.engage - so that either both exist or neither does.
+    The idempotency key is claimed in the same transaction. After commit,
+    hand the job to release_added().
+
+    Returns:
+        The new Job, or None when the key already belongs to another job
+    """
+    job_id = str(uuid.uuid4())
+    if idempotency_key:
+        owner = idempotency.claim_keys(db, [(idempotency_key, job_id)])[idempotency_key]
+        if owner != job_id:
+            _count_enqueue(job_type, "duplicate_db")
+            return None
+
+    if lead_id and LEAD_SCORE_PRIORITY and job_type in SCORE_SPREAD:
+        priority = _scored_priority(job_type, lead_id)
+    else:
+        priority = PRIORITIES.get(job_type, 50)
+    job = Job(
+        id=job_id,
+        job_type=job_type,
+        company_id=company_id,
+        priority=priority,
+        payload=telemetry.inject(payload),
+        idempotency_key=idempotency_key,
+        status=initial_status()
+    )
+    db.add(job)
+    return job
+
+
+def release_added(jobs: list):
+    """Make committed jobs from add_job() runnable (and remember their keys in Redis)"""
+    released = []
+    for job in jobs:
+        _count_enqueue(job.job_type, "created")  # Counted once committed, not when added
+        if job.idempotency_key:
+            idempotency.confirm(job.idempotency_key, job.id)
+        # A scored priority is read back only for a direct publish
+        released.append((job.id, job.job_type, None if FAIR_SCHEDULING else job.priority))
+    return release_jobs(released)
+
+
+def insert_jobs(db, jobs: list):
+    """
+    Bulk insert Job rows inside the caller's transaction (no commit, no publish)
+
+    Idempotency keys are claimed set-wise in one statement before the jobs
+    are inserted (see idempotency.claim_keys); jobs whose key is already
+    owned are skipped.
+
+    Args:
+        db: Open session; caller commits
+        jobs: List of dicts with job_type, payload and optional idempotency_key/company_id
+
+    Returns:
+        List of (job_id, job_type, priority) tuples for the rows inserted
+    """
+    rows = []
+    seen = set()
+    duplicates = {}
+    for j in jobs:
+        key = j.get("idempotency_key")
+        if key:
+            if key in seen:
+                duplicates[j["job_type"]] = duplicates.get(j["job_type"], 0) + 1
+                continue
+            seen.add(key)
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "job_type": j["job_type"],
+            "company_id": j.get("company_id"),
+            "priority": PRIORITIES.get(j["job_type"], 50),
+            "payload": telemetry.inject(j["payload"]),
+            "idempotency_key": key,
+            "status": initial_status(),
+            "attempts": 0,
+            "max_attempts": 5,
+        })
+
+    owners = idempotency.claim_keys(db, [(r["idempotency_key"], r["id"]) for r in rows if r["idempotency_key"]])
+    claimed = []
+    for r in rows:
+        if r["idempotency_key"] and owners[r["idempotency_key"]] != r["id"]:
+            duplicates[r["job_type"]] = duplicates.get(r["job_type"], 0) + 1
+        else:
+            claimed.append(r)
+    rows = claimed
+
+    if rows:
+        db.execute(insert(Job), rows)
+    created = {}
+    for r in rows:
+        created[r["job_type"]] = created.get(r["job_type"], 0) + 1
+    for job_type, count in created.items():
+        _count_enqueue(job_type, "created", count)
+    for job_type, count in duplicates.items():
+        _count_enqueue(job_type, "duplicate_db", count)
+
+    return [(r["id"], r["job_type"], r["priority"]) for r in rows]
+
+
+def publish_jobs(jobs: list):
+    """
+    Publish already-committed jobs to Celery over a single broker connection
+
+    Args:
+        jobs: List of (job_id, job_type, priority) tuples from insert_jobs()
+
+    Returns:
+        Number of tasks published
+    """
+    if not jobs:
+        return 0
+
+    with celery.producer_or_acquire() as producer:
+        for job_id, job_type, priority in jobs:
+            task_name = f"worker.{job_type.replace('.', '_')}"
+            celery.send_task(
+                task_name,
+                args=[job_id],
+                priority=broker_priority(priority),
+                producer=producer
+            )
+
+    return len(jobs)
+
+
+def initial_status() -> str:
+    """Status for a new job: "pending" while the fair dispatcher owns it"""
+    return "pending" if FAIR_SCHEDULING else "queued"
+
+
+def release_jobs(jobs: list):
+    """
+    Make committed jobs from insert_jobs() runnable
+
+    With fair scheduling the jobs are already "pending" and the dispatcher
+    is nudged to run a round now instead of at its next tick; otherwise
+    they are published straight to Celery. The nudge never fails the
+    caller: the jobs are committed and the beat tick dispatches them anyway.
+    """
+    global _last_kick
+    if not jobs:
+        return 0
+    if not FAIR_SCHEDULING:
+        return publish_jobs(jobs)
+    now = time.monotonic()
+    if now - _last_kick >= 0.1:  # Coalesce bursts of enqueues into one round
+        _last_kick = now
+        try:
+            celery.send_task("worker.fair_dispatch", priority=0)
+        except Exception as e:
+            print(f"⚠️ Fair dispatch nudge failed (next beat tick dispatches): {e}")
+    return 0
+
+
+def enqueue_jobs(jobs: list, publish: bool = True):
+    """
+    Bulk version of enqueue_job() - one INSERT, one commit, pipelined publishes
+
+    Args:
+        jobs: List of dicts with job_type, payload and optional idempotency_key/company_id
+        publish: Release the jobs (Celery or fair dispatcher) after commit
+
+    Returns:
+        List of created job IDs (duplicates skipped)
+    """
+    db = SessionLocal()
+    try:
+        inserted = insert_jobs(db, jobs)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+    if publish:
+        release_jobs(inserted)
+
+    return [job_id for job_id, _, _ in inserted]
+
+
 def mark_job_started(job_id: str):
-    """Mark job as processing"""
+    """Mark job as processing (and continue the trace that enqueued it)"""
     db = SessionLocal()
     try:
         job = db.query(Job).filter(Job.id == job_id).first()
         if job:
+            now = datetime.utcnow()
             job.status = "processing"
-            job.started_at = datetime.utcnow()
+            job.started_at = now
             job.attempts += 1
             db.commit()
+            telemetry.continue_trace((job.payload or {}).get("traceparent"))
+            task_profiler.job_started(job)
+            if job.attempts == 1:  # Retries wait on purpose (backoff)
+                for phase, since in (("total", job.created_at), ("broker", job.dispatched_at)):
+                    if since:
+                        telemetry.JOB_WAIT_SECONDS.observe(
+                            (now - since.replace(tzinfo=None)).total_seconds(),
+                            job_type=job.job_type, phase=phase)
     finally:
         db.close()
 
@@ -109,82 +418,228 @@ def mark_job_completed(job_id: str):
         db.close()
 
 
-def mark_job_failed(job_id: str, error: str):
-    """Mark job as failed or move to DLQ"""
+def mark_jobs_completed(job_ids: list):
+    """Mark many jobs completed in one UPDATE (results of async deliveries)"""
+    if not job_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Job).where(Job.id.in_(job_ids)).values(status="completed", completed_at=datetime.utcnow()),
+            execution_options={"synchronize_session": False}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def recover_stale_jobs(job_type: str, stale_after: timedelta, limit: int = 1000) -> int:
+    """
+    Retry jobs stuck in processing (their worker stopped before recording a result)
+
+    For tasks that hand work off and return before it finishes (webhook
+    deliveries), so the broker message is already acked. Each stale job goes
+    through mark_job_failed(): it is retried with backoff, or moved to the
+    DLQ when out of attempts.
+
+    Returns:
+        Number of jobs recovered
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(Job.id).filter(
+            Job.job_type == job_type, Job.status == "processing",
+            Job.started_at < datetime.utcnow() - stale_after
+        ).limit(limit)
+        if db.bind.dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        job_ids = [job_id for (job_id,) in query]
+    finally:
+        db.close()
+    for job_id in job_ids:
+        mark_job_failed(job_id, f"No result within {stale_after.total_seconds():.0f}s (worker stopped mid-delivery?)")
+    if job_ids:
+        print(f"♻️  Recovered {len(job_ids)} stale {job_type} jobs")
+    return len(job_ids)
+
+
+def mark_job_failed(job_id: str, error, retry_after: float = None):
+    """
+    Mark job as failed: retry it, defer it, or move it to the DLQ
+
+    Args:
+        job_id: Job ID
+        error: Exception or error message (classified by retry_policy)
+        retry_after: Optional server-provided floor on the retry delay (seconds)
+
+    Returns:
+        Decision dict (kind, action, delay) or None if the job does not exist
+    """
+    kind, hinted = retry_policy.classify(error)
+    retry_after = retry_after if retry_after is not None else hinted
+
     db = SessionLocal()
     try:
         job = db.query(Job).filter(Job.id == job_id).first()
-        if job:
-            job.error = error
-            
-            if job.attempts >= job.max_attempts:
-                # Move to Dead Letter Queue
-                job.status = "dlq"
-            else:
-                # Retry with exponential backoff
-                job.status = "queued"
-                backoff_delays = [5, 20, 60, 180, 600]  # seconds
-                delay = backoff_delays[min(job.attempts - 1, len(backoff_delays) - 1)]
-                
-                # Re-enqueue with delay
-                task_name = f"worker.{job.job_type.replace('.', '_')}"
-                celery.send_task(
-                    task_name,
-                    args=[job.id],
-                    priority=job.priority,
-                    countdown=delay
-                )
-            
+        if not job:
+            return None
+        job.error = str(error)
+
+        if kind == retry_policy.CIRCUIT_OPEN:
+            # Nothing was attempted downstream - give the attempt back
+            job.attempts = max(0, (job.attempts or 0) - 1)
+
+        delay = retry_policy.retry_delay(kind, retry_after, job.last_backoff)
+        if delay is None or job.attempts >= job.max_attempts:
+            # Permanent failure or out of attempts → Dead Letter Queue
+            job.status = "dlq"
             db.commit()
+            return {"kind": kind, "action": "dlq", "delay": None}
+
+        job.status = "queued"
+        if kind != retry_policy.CIRCUIT_OPEN:
+            job.last_backoff = delay
+        db.commit()
+
+        # Re-enqueue with delay
+        task_name = f"worker.{job.job_type.replace('.', '_')}"
+        celery.send_task(
+            task_name,
+            args=[job.id],
+            priority=broker_priority(job.priority),
+            countdown=delay
+        )
+        return {"kind": kind, "action": "retry", "delay": round(delay, 1)}
     finally:
         db.close()
 
 
-def replay_dlq_jobs(limit: int = 10):
+def _dlq_query(db, job_type: str = None, error_pattern: str = None, since: datetime = None,
+               until: datetime = None, company_id: str = None):
+    """DLQ jobs matching the replay filters"""
+    query = db.query(Job).filter(Job.status == "dlq")
+    if job_type:
+        query = query.filter(Job.job_type == job_type)
+    if error_pattern:
+        query = query.filter(Job.error.ilike(f"%{error_pattern}%"))
+    if since:
+        query = query.filter(Job.created_at >= since)
+    if until:
+        query = query.filter(Job.created_at < until)
+    if company_id:
+        query = query.filter(Job.company_id == company_id)
+    return query
+
+
+def replay_dlq_jobs(limit: int = 10, job_type: str = None, error_pattern: str = None,
+                    since: datetime = None, until: datetime = None, company_id: str = None,
+                    rate: float = None, batch_size: int = 500, dry_run: bool = False):
     """
     Admin function to replay jobs from DLQ
-    Returns: Number of jobs replayed
+    
+    Jobs are streamed in (created_at, id) keyset order. Each batch is reset
+    and committed on its own, then published over one broker connection, so
+    a replay that dies halfway keeps every batch it already released.
+    
+    Args:
+        limit: Max jobs to replay (None = all matching)
+        job_type: Only this job type
+        error_pattern: Case-insensitive substring of the last error
+        since/until: created_at range [since, until)
+        company_id: Only this tenant's jobs
+        rate: Max jobs released per second (None = unpaced)
+        batch_size: Jobs per commit/publish batch
+        dry_run: Only count what would be replayed
+    
+    Returns:
+        Dict with matched (dry run) or replayed counts
     """
+    filters = dict(job_type=job_type, error_pattern=error_pattern, since=since,
+                   until=until, company_id=company_id)
     db = SessionLocal()
     try:
-        dlq_jobs = db.query(Job).filter(
-            Job.status == "dlq"
-        ).limit(limit).all()
+        if dry_run:
+            counts = dict(
+                _dlq_query(db, **filters).with_entities(Job.job_type, func.count(Job.id))
+                .group_by(Job.job_type).all()
+            )
+            matched = sum(counts.values())
+            return {
+                "dry_run": True,
+                "matched": min(matched, limit) if limit else matched,
+                "total_matching": matched,
+                "by_job_type": counts,
+            }
+        
+        if rate:
+            batch_size = max(1, min(batch_size, int(rate)))
         
         replayed = 0
-        for job in dlq_jobs:
-            # Reset job
-            job.status = "queued"
-            job.attempts = 0
-            job.error = None
+        batches = 0
+        after = None
+        started = time.monotonic()
+        while limit is None or replayed < limit:
+            size = batch_size if limit is None else min(batch_size, limit - replayed)
+            query = _dlq_query(db, **filters).with_entities(
+                Job.id, Job.job_type, Job.priority, Job.created_at
+            )
+            if after:
+                query = query.filter(tuple_(Job.created_at, Job.id) > after)
+            query = query.order_by(Job.created_at, Job.id).limit(size)
+            if db.bind.dialect.name == "postgresql":
+                # Concurrent replays skip each other's batches instead of double-publishing
+                query = query.with_for_update(skip_locked=True)
+            rows = query.all()
+            if not rows:
+                break
+            after = (rows[-1].created_at, rows[-1].id)
             
-            # Re-enqueue
-            task_name = f"worker.{job.job_type.replace('.', '_')}"
-            celery.send_task(
-                task_name,
-                args=[job.id],
-                priority=job.priority
+            # Reset the batch
+            ids = [row.id for row in rows]
+            db.query(Job).filter(Job.id.in_(ids), Job.status == "dlq").update(
+                {"status": "queued", "attempts": 0, "error": None, "last_backoff": None},
+                synchronize_session=False
             )
-            replayed += 1
+            db.commit()
+            
+            batch = [(row.id, row.job_type, row.priority) for row in rows]
+            try:
+                publish_jobs(batch)
+            except Exception as e:
+                # Broker down: put the batch back so nothing is stranded in "queued"
+                db.query(Job).filter(Job.id.in_(ids)).update(
+                    {"status": "dlq", "error": f"Replay publish failed: {e}"},
+                    synchronize_session=False
+                )
+                db.commit()
+                raise
+            
+            replayed += len(batch)
+            batches += 1
+            
+            # Pace releases so a replay cannot re-trigger the outage it follows
+            if rate:
+                ahead = replayed / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
         
-        db.commit()
-        return replayed
+        return {
+            "dry_run": False,
+            "replayed": replayed,
+            "batches": batches,
+            "elapsed_seconds": round(time.monotonic() - started, 2),
+        }
     
     finally:
         db.close()
 
 
 def get_queue_stats():
-    """Get queue statistics"""
-    db = SessionLocal()
+    """Get queue statistics (one grouped count, served from a replica when available)"""
+    db = ReadSessionLocal()
     try:
-        stats = {
-            "queued": db.query(Job).filter(Job.status == "queued").count(),
-            "processing": db.query(Job).filter(Job.status == "processing").count(),
-            "completed": db.query(Job).filter(Job.status == "completed").count(),
-            "failed": db.query(Job).filter(Job.status == "failed").count(),
-            "dlq": db.query(Job).filter(Job.status == "dlq").count(),
-        }
-        return stats
+        counts = dict(db.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+        return {status: counts.get(status, 0)
+                for status in ("pending", "queued", "processing", "completed", "failed", "dlq")}
     finally:
         db.close()
@@ -0,0 +1,47 @@
+"""
+Redis Cache Client
+Shared, fail-soft Redis connection for caches on the hot paths
+
+Caches are an optimization: get_client() returns None when caching is
+disabled (CACHE_REDIS_URL="") or Redis is unreachable, and callers fall back
+to the database. After a connection error the client is skipped for
+CACHE_REDIS_RETRY_SECONDS instead of paying a timeout on every request.
+"""
+import os
+import threading
+import time
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+SOCKET_TIMEOUT = float(os.getenv("CACHE_REDIS_TIMEOUT_SECONDS", "0.1"))
+RETRY_AFTER = float(os.getenv("CACHE_REDIS_RETRY_SECONDS", "30"))
+
+_client = None
+_down_until = 0.0
+_lock = threading.Lock()
+
+
+def get_client():
+    """Redis client, or None while disabled/unavailable"""
+    global _client
+    if not CACHE_REDIS_URL or time.monotonic() < _down_until:
+        return None
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import redis
+
+                _client = redis.Redis.from_url(
+                    CACHE_REDIS_URL,
+                    socket_timeout=SOCKET_TIMEOUT,
+                    socket_connect_timeout=SOCKET_TIMEOUT,
+                    decode_responses=True,
+                )
+    return _client
+
+
+def mark_down(error: Exception):
+    """Report a failed call; the client is skipped for RETRY_AFTER seconds"""
+    global _down_until
+    if time.monotonic() >= _down_until:
+        print(f"⚠️ Redis cache unavailable ({error}); using the database for {RETRY_AFTER:.0f}s")
+    _down_until = time.monotonic() + RETRY_AFTER
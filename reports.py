@@ -0,0 +1,461 @@
+"""
+Reporting Engine
+Incrementally maintained dashboards stored in ReportCache
+
+Each report keeps a small state that is advanced by applying new events
+(delta) from the events log, with a periodic full recompute from the source
+tables to correct any drift. Reads never aggregate over messages/events:
+they serve the cached JSON plus staleness metadata.
+
+Precise invalidation: entity changes that bypass the event stream (a lead's
+stage edited directly, a stage deleted, a message status rewritten) mark
+only the affected (company, report) rows for a full recompute, in the same
+transaction as the change. ORM flushes are caught by a session hook; bulk
+writers (lead import, delivery status) call invalidate() themselves.
+
+Reads come from a read replica. A report requested for the first time is
+computed from the replica too; the primary only stores the result.
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.sql import Select
+
+from database import SessionLocal, ReadSessionLocal
+from models import ReportCache, Lead, Stage, Pipeline, Message, Event
+from exports import iter_rows, export_upper_bound, format_watermark, parse_watermark
+
+FULL_RECOMPUTE_EVERY = timedelta(hours=int(os.getenv("REPORT_FULL_RECOMPUTE_HOURS", "24")))
+PENDING_REPLY_WINDOW = timedelta(days=7)  # Unanswered inbound older than this is dropped
+
+# Response-time histogram bucket upper edges (seconds)
+RESPONSE_BUCKETS = [30, 60, 120, 300, 600, 1800, 3600, 4 * 3600, 24 * 3600]
+
+OUTBOUND_EVENTS = {"AIEngageCompleted", "SequenceStepSent", "MessageSent"}
+
+
+def _event_lead_id(e: dict):
+    if e["entity_type"] == "lead":
+        return e["entity_id"]
+    return (e["payload"] or {}).get("lead_id")
+
+
+def _ts(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+# ============================================================================
+# REPORT DEFINITIONS
+# ============================================================================
+
+class FunnelByStage:
+    """Lead count per pipeline stage"""
+    slug = "funnel_by_stage"
+    event_types = {"LeadCreated", "StageChanged"}
+
+    @staticmethod
+    def initial():
+        return {"stages": {}}
+
+    @staticmethod
+    def apply(state, e):
+        stages = state["stages"]
+        payload = e["payload"] or {}
+        if e["type"] == "LeadCreated" and payload.get("stage_id"):
+            stages[payload["stage_id"]] = stages.get(payload["stage_id"], 0) + 1
+        elif e["type"] == "StageChanged":
+            if payload.get("from_stage_id"):
+                stages[payload["from_stage_id"]] = max(0, stages.get(payload["from_stage_id"], 0) - 1)
+            if payload.get("to_stage_id"):
+                stages[payload["to_stage_id"]] = stages.get(payload["to_stage_id"], 0) + 1
+
+    @staticmethod
+    def recompute(db, company_id):
+        rows = db.query(Lead.stage_id, func.count(Lead.id)).filter(
+            Lead.company_id == company_id, Lead.stage_id.isnot(None)
+        ).group_by(Lead.stage_id)
+        return {"stages": {stage_id: count for stage_id, count in rows}}
+
+    @staticmethod
+    def render(db, company_id, state):
+        # Stage names/order are read at serve time, so renames never invalidate
+        stages = db.query(Stage.id, Stage.name, Stage.order).join(
+            Pipeline, Pipeline.id == Stage.pipeline_id
+        ).filter(Pipeline.company_id == company_id).order_by(Stage.order).all()
+        counts = state["stages"]
+        return {"stages": [
+            {"stage_id": stage_id, "name": name, "order": order, "leads": counts.get(stage_id, 0)}
+            for stage_id, name, order in stages
+        ]}
+
+
+class ResponseTime:
+    """Time from a lead's inbound message to the next outbound reply"""
+    slug = "response_time"
+    event_types = {"InboundMessageReceived"} | OUTBOUND_EVENTS
+
+    @staticmethod
+    def initial():
+        return {"pending": {}, "count": 0, "sum_seconds": 0.0, "buckets": [0] * (len(RESPONSE_BUCKETS) + 1)}
+
+    @staticmethod
+    def _record(state, seconds):
+        state["count"] += 1
+        state["sum_seconds"] += seconds
+        for i, edge in enumerate(RESPONSE_BUCKETS):
+            if seconds <= edge:
+                state["buckets"][i] += 1
+                return
+        state["buckets"][-1] += 1
+
+    @classmethod
+    def apply(cls, state, e):
+        lead_id = _event_lead_id(e)
+        if not lead_id:
+            return
+        at = _ts(e["created_at"])
+        if e["type"] == "InboundMessageReceived":
+            state["pending"].setdefault(lead_id, at.isoformat())
+        elif lead_id in state["pending"]:
+            cls._record(state, max(0.0, (at - _ts(state["pending"].pop(lead_id))).total_seconds()))
+
+        cutoff = (at - PENDING_REPLY_WINDOW).isoformat()
+        if len(state["pending"]) > 10000:
+            state["pending"] = {k: v for k, v in state["pending"].items() if v >= cutoff}
+
+    @classmethod
+    def recompute(cls, db, company_id):
+        state = cls.initial()
+        lead_ids = db.query(Lead.id).filter(Lead.company_id == company_id).scalar_subquery()
+        rows = db.query(Message.lead_id, Message.direction, Message.created_at).filter(
+            Message.lead_id.in_(lead_ids)
+        ).order_by(Message.lead_id, Message.created_at).execution_options(
+            stream_results=True, yield_per=5000
+        )
+        for lead_id, direction, created_at in rows:
+            if created_at is None:
+                continue
+            if direction == "inbound":
+                state["pending"].setdefault(lead_id, created_at.isoformat())
+            elif lead_id in state["pending"]:
+                cls._record(state, max(0.0, (created_at - _ts(state["pending"].pop(lead_id))).total_seconds()))
+        cutoff = (datetime.utcnow() - PENDING_REPLY_WINDOW).isoformat()
+        state["pending"] = {k: v for k, v in state["pending"].items() if v >= cutoff}
+        return state
+
+    @staticmethod
+    def render(db, company_id, state):
+        count = state["count"]
+
+        def percentile(p):
+            if not count:
+                return None
+            target, seen = p * count, 0
+            for i, n in enumerate(state["buckets"]):
+                seen += n
+                if seen >= target:
+                    return RESPONSE_BUCKETS[i] if i < len(RESPONSE_BUCKETS) else None
+            return None
+
+        return {
+            "replies": count,
+            "avg_seconds": round(state["sum_seconds"] / count, 1) if count else None,
+            "p50_seconds_le": percentile(0.5),
+            "p90_seconds_le": percentile(0.9),
+            "awaiting_reply": len(state["pending"]),
+            "histogram": [
+                {"le_seconds": RESPONSE_BUCKETS[i] if i < len(RESPONSE_BUCKETS) else None, "count": n}
+                for i, n in enumerate(state["buckets"])
+            ],
+        }
+
+
+class ChannelDelivery:
+    """Outbound message counts per channel and delivery status"""
+    slug = "channel_delivery"
+    event_types = OUTBOUND_EVENTS | {"MessageStatusChanged"}
+
+    @staticmethod
+    def initial():
+        return {"channels": {}}
+
+    @staticmethod
+    def apply(state, e):
+        payload = e["payload"] or {}
+        channel = payload.get("channel")
+        if not channel:
+            return
+        counts = state["channels"].setdefault(channel, {})
+        if e["type"] == "MessageStatusChanged":
+            previous = payload.get("from_status")
+            if previous and counts.get(previous, 0) > 0:
+                counts[previous] -= 1
+            status = payload.get("to_status")
+        else:
+            status = payload.get("status")
+        if status:
+            counts[status] = counts.get(status, 0) + 1
+
+    @staticmethod
+    def recompute(db, company_id):
+        lead_ids = db.query(Lead.id).filter(Lead.company_id == company_id).scalar_subquery()
+        rows = db.query(Message.channel, Message.status, func.count(Message.id)).filter(
+            Message.lead_id.in_(lead_ids), Message.direction == "outbound"
+        ).group_by(Message.channel, Message.status)
+        channels = {}
+        for channel, status, count in rows:
+            channels.setdefault(channel or "unknown", {})[status or "unknown"] = count
+        return {"channels": channels}
+
+    @staticmethod
+    def render(db, company_id, state):
+        channels = []
+        for channel, counts in sorted(state["channels"].items()):
+            total = sum(counts.values())
+            delivered = counts.get("delivered", 0) + counts.get("read", 0)
+            channels.append({
+                "channel": channel,
+                "total": total,
+                "by_status": counts,
+                "delivery_rate": round(delivered / total, 4) if total else None,
+            })
+        return {"channels": channels}
+
+
+REPORTS = {r.slug: r for r in (FunnelByStage, ResponseTime, ChannelDelivery)}
+
+# Entity changes (outside the event stream) → reports they affect
+INVALIDATES = {
+    "lead": {FunnelByStage.slug},
+    "stage": {FunnelByStage.slug},
+    "message": {ChannelDelivery.slug, ResponseTime.slug},
+}
+
+
+# ============================================================================
+# REFRESH
+# ============================================================================
+
+def _latest_event_watermark(db, company_id):
+    row = db.query(Event.created_at, Event.id).filter(
+        Event.company_id == company_id
+    ).order_by(Event.created_at.desc(), Event.id.desc()).first()
+    return format_watermark(row[0].replace(tzinfo=None), row[1]) if row else None
+
+
+def _get_row(db, company_id, slug):
+    row = db.query(ReportCache).filter(
+        ReportCache.company_id == company_id, ReportCache.slug == slug
+    ).first()
+    if row is None:
+        row = ReportCache(company_id=company_id, slug=slug)
+        db.add(row)
+    return row
+
+
+def recompute_report(db, company_id: str, slug: str, read_db=None):
+    """
+    Full recompute from source tables (caller commits)
+
+    Args:
+        db: Session the ReportCache row is written to
+        read_db: Session the source tables are aggregated from (default: db)
+    """
+    report = REPORTS[slug]
+    read_db = read_db or db
+    now = datetime.utcnow()
+    watermark = _latest_event_watermark(read_db, company_id)
+    state = report.recompute(read_db, company_id)
+    row = _get_row(db, company_id, slug)
+    row.json = {
+        "state": state,
+        "meta": {"mode": "full", "last_full_at": now.isoformat(), "events_applied": 0},
+    }
+    row.watermark = watermark
+    row.invalidated_at = None
+    row.computed_at = now
+    return row
+
+
+def refresh_company(company_id: str) -> dict:
+    """
+    Bring every report of one company up to date
+
+    Invalidated or overdue reports are recomputed in full; the rest apply
+    new events since their watermark in one keyset pass over the log.
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        rows = {
+            row.slug: row for row in db.query(ReportCache).filter(ReportCache.company_id == company_id)
+        }
+        result = {"full": [], "incremental": {}}
+
+        incremental = {}
+        for slug in REPORTS:
+            row = rows.get(slug)
+            last_full = (row.json or {}).get("meta", {}).get("last_full_at") if row else None
+            if (row is None or row.invalidated_at is not None or not last_full
+                    or now - _ts(last_full) >= FULL_RECOMPUTE_EVERY):
+                recompute_report(db, company_id, slug)
+                result["full"].append(slug)
+            else:
+                incremental[slug] = row
+        db.commit()
+
+        if incremental:
+            # One pass over the events after the oldest watermark
+            watermarks = {slug: parse_watermark(row.watermark) for slug, row in incremental.items()}
+            start = min(incremental.values(), key=lambda r: parse_watermark(r.watermark)[0] or datetime.min)
+            types = set().union(*(REPORTS[slug].event_types for slug in incremental))
+            states = {slug: row.json["state"] for slug, row in incremental.items()}
+            applied = {slug: 0 for slug in incremental}
+            last = {}
+
+            for e in iter_rows("events", company_id, start.watermark, export_upper_bound(), sorted(types)):
+                position = (e["created_at"].replace(tzinfo=None), e["id"])
+                for slug, report in ((s, REPORTS[s]) for s in incremental):
+                    wm_ts, wm_id = watermarks[slug]
+                    if wm_ts is not None and position <= (wm_ts, wm_id):
+                        continue
+                    if e["type"] in report.event_types:
+                        report.apply(states[slug], e)
+                        applied[slug] += 1
+                    last[slug] = position
+
+            for slug, row in incremental.items():
+                if slug not in last:
+                    continue
+                meta = dict(row.json.get("meta", {}))
+                meta["mode"] = "incremental"
+                meta["events_applied"] = meta.get("events_applied", 0) + applied[slug]
+                row.json = {"state": states[slug], "meta": meta}
+                row.watermark = format_watermark(last[slug][0], last[slug][1])
+                row.computed_at = now
+                result["incremental"][slug] = applied[slug]
+            db.commit()
+
+        return result
+    finally:
+        db.close()
+
+
+def refresh_all() -> dict:
+    """
+    Periodic entry point: refresh every company with cached reports
+
+    A company's reports are created by its first GET /reports request
+    (get_report); from then on this keeps them current.
+    """
+    db = SessionLocal()
+    try:
+        company_ids = {c for (c,) in db.query(ReportCache.company_id).distinct()}
+    finally:
+        db.close()
+    return {company_id: refresh_company(company_id) for company_id in company_ids if company_id}
+
+
+def get_report(company_id: str, slug: str) -> dict:
+    """
+    Serve a cached report with staleness metadata
+
+    Served from a read replica (the metadata says how stale it is). Only a
+    report never computed before is built on request: aggregated on the
+    replica, stored on the primary.
+    """
+    if slug not in REPORTS:
+        raise KeyError(slug)
+    db = ReadSessionLocal()
+    try:
+        row = db.query(ReportCache).filter(
+            ReportCache.company_id == company_id, ReportCache.slug == slug
+        ).first()
+        if row is None or row.json is None:
+            writer = SessionLocal()
+            try:
+                row = recompute_report(writer, company_id, slug, read_db=db)
+                db.commit()  # End the read snapshot before writing
+                writer.commit()
+                writer.refresh(row)
+                writer.expunge(row)
+            finally:
+                writer.close()
+
+        now = datetime.utcnow()
+        as_of = parse_watermark(row.watermark)[0] if row.watermark else None
+        computed_at = row.computed_at.replace(tzinfo=None) if row.computed_at else None
+        meta = row.json.get("meta", {})
+        return {
+            "company_id": company_id,
+            "report": slug,
+            "data": REPORTS[slug].render(db, company_id, row.json["state"]),
+            "meta": {
+                "mode": meta.get("mode"),
+                "computed_at": computed_at.isoformat() if computed_at else None,
+                "as_of": as_of.isoformat() if as_of else None,
+                "stale_seconds": round((now - computed_at).total_seconds()) if computed_at else None,
+                "last_full_at": meta.get("last_full_at"),
+                "invalidated": row.invalidated_at is not None,
+            },
+        }
+    finally:
+        db.close()
+
+
+# ============================================================================
+# PRECISE INVALIDATION (ORM changes that bypass the event stream)
+# ============================================================================
+
+def invalidate(db, company_ids, slugs):
+    """
+    Mark (company, report) rows for a full recompute on the next refresh
+
+    Args:
+        db: Session of the transaction that made the change
+        company_ids: Company ids, or a SELECT of them
+        slugs: Reports affected (see INVALIDATES)
+    """
+    if company_ids is None or not slugs:
+        return
+    if not isinstance(company_ids, Select):
+        company_ids = list(company_ids)
+        if not company_ids:
+            return
+    db.execute(
+        update(ReportCache).where(
+            ReportCache.company_id.in_(company_ids), ReportCache.slug.in_(list(slugs)),
+            ReportCache.invalidated_at.is_(None)
+        ).values(invalidated_at=datetime.utcnow()),
+        execution_options={"synchronize_session": False}
+    )
+
+
+def _invalidate_flushed(session, flush_context):
+    # after_flush still sees the pre-flush new/dirty/deleted sets and history;
+    # the UPDATE joins the flushing transaction (a rollback undoes both)
+    pending = {}  # (kind, slugs) → keys
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, Lead):
+            if obj in session.deleted or inspect(obj).attrs.stage_id.history.has_changes():
+                pending.setdefault(("company", frozenset(INVALIDATES["lead"])), set()).add(obj.company_id)
+        elif isinstance(obj, Stage) and obj in session.deleted:
+            pending.setdefault(("pipeline", frozenset(INVALIDATES["stage"])), set()).add(obj.pipeline_id)
+        elif isinstance(obj, Message) and inspect(obj).attrs.status.history.has_changes():
+            pending.setdefault(("lead", frozenset(INVALIDATES["message"])), set()).add(obj.lead_id)
+
+    for (kind, slugs), keys in pending.items():
+        keys.discard(None)
+        if not keys:
+            continue
+        if kind == "company":
+            company_ids = keys
+        elif kind == "pipeline":
+            company_ids = select(Pipeline.company_id).where(Pipeline.id.in_(keys))
+        else:
+            company_ids = select(Lead.company_id).where(Lead.id.in_(keys))
+        invalidate(session, company_ids, slugs)
+
+
+event.listen(SessionLocal, "after_flush", _invalidate_flushed)
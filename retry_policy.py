@@ -0,0 +1,281 @@
+"""
+Retry Policy Engine
+Classifies job failures and decides whether, and when, to retry them
+
+- permanent    → straight to the DLQ (missing lead, bad payload, 4xx rejection)
+- throttled    → retry no earlier than the provider's Retry-After
+- transient    → retry with decorrelated-jitter backoff
+- circuit_open → the downstream's breaker is open: defer until it half-opens
+                 without spending an attempt
+
+Per-provider circuit breakers (OpenAI, WA Cloud, WA Web, SMTP) are shared by
+every task in a worker process. Calls go through guarded(), which
+short-circuits while the breaker is open and feeds the outcome back to it.
+"""
+import os
+import random
+import re
+import smtplib
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+PERMANENT = "permanent"
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+CIRCUIT_OPEN = "circuit_open"
+
+BASE_DELAY = float(os.getenv("RETRY_BASE_SECONDS", "5"))
+MAX_DELAY = float(os.getenv("RETRY_MAX_SECONDS", "600"))
+MAX_RETRY_AFTER = float(os.getenv("RETRY_MAX_RETRY_AFTER_SECONDS", "3600"))
+
+# Downstream dependencies and the channel names that map onto them
+PROVIDERS = ("openai", "wa_cloud", "wa_web", "smtp")
+CHANNEL_PROVIDERS = {"wa_cloud": "wa_cloud", "wa_web": "wa_web", "email": "smtp"}
+
+
+class PermanentError(Exception):
+    """Will never succeed on retry"""
+
+
+class TransientError(Exception):
+    """May succeed on retry"""
+
+
+class ThrottledError(Exception):
+    """Downstream asked us to slow down"""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ============================================================================
+# CLASSIFICATION
+# ============================================================================
+
+# Programming/data errors: retrying the same payload gives the same result
+_PERMANENT_TYPES = (ValueError, KeyError, TypeError, AttributeError, LookupError)
+_TRANSIENT_NAMES = {"APIConnectionError", "APITimeoutError", "InternalServerError", "Timeout", "TimeoutError"}
+
+_PERMANENT_MESSAGES = re.compile(
+    r"not found|inactive|template required|suppression|invalid|unsubscribed|HTTP 4(?!29)\d\d",
+    re.IGNORECASE,
+)
+_THROTTLED_MESSAGES = re.compile(r"\b429\b|rate.?limit|too many requests|quota", re.IGNORECASE)
+_CIRCUIT_MESSAGE = re.compile(r"circuit open.*?retry in (\d+(?:\.\d+)?)s", re.IGNORECASE)
+
+
+def parse_retry_after(value) -> float:
+    """Retry-After header (delta-seconds or HTTP-date) → seconds, or None"""
+    if value is None or value == "":
+        return None
+    try:
+        return min(MAX_RETRY_AFTER, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    seconds = (when.replace(tzinfo=None) - datetime.utcnow()).total_seconds()
+    return min(MAX_RETRY_AFTER, max(0.0, seconds))
+
+
+def _http_status(error: Exception):
+    """Status code from OpenAI/requests-style HTTP exceptions"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _header_retry_after(error: Exception):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    return parse_retry_after(headers.get("retry-after") or headers.get("Retry-After"))
+
+
+def classify_message(message: str):
+    """Classify a failure known only by its error string"""
+    message = message or ""
+    circuit = _CIRCUIT_MESSAGE.search(message)
+    if circuit:
+        return CIRCUIT_OPEN, float(circuit.group(1))
+    if _THROTTLED_MESSAGES.search(message):
+        return THROTTLED, None
+    if _PERMANENT_MESSAGES.search(message):
+        return PERMANENT, None
+    return TRANSIENT, None
+
+
+def classify(error):
+    """
+    Classify a failure
+
+    Args:
+        error: Exception or error message
+
+    Returns:
+        (kind, retry_after) - retry_after in seconds when the failure says
+        when to come back (Retry-After, open breaker), else None
+    """
+    if isinstance(error, str):
+        return classify_message(error)
+
+    if isinstance(error, CircuitOpenError):
+        return CIRCUIT_OPEN, error.retry_after
+    if isinstance(error, ThrottledError):
+        return THROTTLED, error.retry_after
+    if isinstance(error, PermanentError):
+        return PERMANENT, None
+    if isinstance(error, TransientError):
+        return TRANSIENT, None
+
+    status = _http_status(error)
+    if status is not None:
+        if status == 429:
+            return THROTTLED, _header_retry_after(error)
+        if status in (408, 409) or status >= 500:
+            return TRANSIENT, _header_retry_after(error) if status == 503 else None
+        if 400 <= status < 500:
+            return PERMANENT, None
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return PERMANENT, None
+    if isinstance(error, smtplib.SMTPResponseException):
+        if error.smtp_code == 421:
+            return THROTTLED, None
+        return (PERMANENT, None) if error.smtp_code >= 500 else (TRANSIENT, None)
+
+    if type(error).__name__ == "RateLimitError":
+        return THROTTLED, _header_retry_after(error)
+    if type(error).__name__ in _TRANSIENT_NAMES or isinstance(error, (OSError, TimeoutError)):
+        return TRANSIENT, None
+    if isinstance(error, _PERMANENT_TYPES):
+        return PERMANENT, None
+
+    return classify_message(str(error))
+
+
+# ============================================================================
+# BACKOFF
+# ============================================================================
+
+def decorrelated_jitter(previous: float = None, base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """
+    Next delay = uniform(base, previous * 3), capped
+
+    Unlike a fixed schedule, jobs that failed together drift apart on every
+    retry, so a provider blip does not come back as synchronized waves.
+    """
+    previous = max(base, previous or base)
+    return min(cap, random.uniform(base, previous * 3))
+
+
+def retry_delay(kind: str, retry_after: float = None, previous: float = None):
+    """
+    Seconds to wait before the next attempt, or None to dead-letter
+
+    Args:
+        kind: Result of classify()
+        retry_after: Server/breaker-provided floor
+        previous: Delay used for the previous retry of this job
+    """
+    if kind == PERMANENT:
+        return None
+    if kind == CIRCUIT_OPEN:
+        # Spread the backlog over a short window instead of releasing it
+        # all on the breaker's half-open instant
+        wait = retry_after or BASE_DELAY
+        return wait + random.uniform(0, max(BASE_DELAY, wait * 0.2))
+    delay = decorrelated_jitter(previous)
+    if retry_after:
+        delay = max(delay, retry_after + random.uniform(0, BASE_DELAY))
+    return delay
+
+
+# ============================================================================
+# PER-PROVIDER CIRCUIT BREAKERS
+# ============================================================================
+
+_breakers = {
+    name: CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("BREAKER_RESET_SECONDS", "30")),
+    )
+    for name in PROVIDERS
+}
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        breaker = _breakers.setdefault(provider, CircuitBreaker(provider))
+    return breaker
+
+
+def provider_for_channel(channel: str) -> str:
+    return CHANNEL_PROVIDERS.get(channel, channel)
+
+
+def ensure_available(*providers: str):
+    """
+    Raise CircuitOpenError if any provider's breaker is open
+
+    Checked before a task starts work, so jobs for a dependency that is down
+    are deferred without generating replies they could not send. A
+    half-open breaker passes here; guarded() admits the single trial call.
+    """
+    for provider in providers:
+        breaker = get_breaker(provider)
+        if breaker.state == "open":
+            raise CircuitOpenError(provider, breaker.retry_after())
+
+
+def record_outcome(provider: str, error=None):
+    """Feed a call result to the provider's breaker"""
+    breaker = get_breaker(provider)
+    if error is None:
+        breaker.record_success()
+        return
+    kind, retry_after = classify(error)
+    if kind == THROTTLED and retry_after:
+        breaker.open(retry_after)
+    elif kind in (THROTTLED, TRANSIENT):
+        breaker.record_failure()
+    else:
+        # The dependency answered; it just rejected this request
+        breaker.record_success()
+
+
+@contextmanager
+def guarded(provider: str):
+    """
+    Wrap one call to a downstream dependency
+
+    Usage:
+        with guarded("openai"):
+            response = client.chat.completions.create(...)
+    """
+    breaker = get_breaker(provider)
+    if not breaker.allow():
+        raise CircuitOpenError(provider, breaker.retry_after())
+    try:
+        yield breaker
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        record_outcome(provider, e)
+        raise
+    else:
+        record_outcome(provider)
+
+
+def get_breaker_stats() -> dict:
+    """Breaker state per provider (this process)"""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 
 class InboundMessage(BaseModel):
     phone_number: str
@@ -7,6 +7,7 @@ class InboundMessage(BaseModel):
     message_text: str
     channel: str = "whatsapp_web"
     company_id: Optional[str] = None
+    provider_message_id: Optional[str] = None  # Provider's id (wamid, bridge id); dedups redeliveries
     
     # For backward compatibility, also accept old field names
     phone: Optional[str] = None
@@ -18,4 +19,21 @@ class InboundMessage(BaseModel):
             data['phone_number'] = data['phone']
         if 'text' in data and 'message_text' not in data:
             data['message_text'] = data['text']
+        if 'message_id' in data and 'provider_message_id' not in data:
+            data['provider_message_id'] = data['message_id']
         super().__init__(**data)
+
+
+class CampaignSegment(BaseModel):
+    stage_ids: Optional[List[str]] = None
+    sources: Optional[List[str]] = None
+    attributes: Optional[Dict[str, str]] = None  # Exact match on Lead.attributes keys
+
+
+class CampaignCreate(BaseModel):
+    company_id: str
+    name: str
+    channel: str = "wa_cloud"
+    template_id: str
+    segment: CampaignSegment = CampaignSegment()
+    rate: Optional[float] = None  # Sends/second; capped by the channel limit
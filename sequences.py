@@ -0,0 +1,373 @@
+"""
+Sequence Engine
+Per-lead enrollment state, batch claiming of due steps, set-wise stop checks
+"""
+from database import SessionLocal
+from models import Sequence, SequenceStep, SequenceEnrollment, Lead, Company, Message
+from queue_manager import insert_jobs, release_jobs
+from sqlalchemy import insert, update, func, bindparam
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# ============================================================================
+# SEND POLICIES
+# ============================================================================
+# - immediate → run as soon as the previous step has run
+# - delay     → previous step + delay_value * delay_unit
+# - time      → next opening of the step's time window in the company timezone
+# ============================================================================
+
+DELAY_UNITS = {
+    "min": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Local-time send windows (start hour, end hour)
+TIME_WINDOWS = {
+    "AM": (9, 12),
+    "PM": (14, 18),
+}
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def compute_next_run(step: SequenceStep, base: datetime, timezone: str = "UTC") -> datetime:
+    """
+    Compute when a step becomes due
+
+    Args:
+        step: Step to schedule
+        base: Time the previous step ran (or enrollment time), naive UTC
+        timezone: Company timezone used for time windows
+
+    Returns:
+        Naive UTC datetime
+    """
+    run_at = base
+    if step.send_policy == "delay" and step.delay_value:
+        run_at = base + DELAY_UNITS.get(step.delay_unit, DELAY_UNITS["min"]) * step.delay_value
+
+    window = TIME_WINDOWS.get(step.time_window) if step.time_window else None
+    if step.send_policy == "time" and window is None:
+        window = TIME_WINDOWS["AM"]
+
+    if window:
+        run_at = _next_window_opening(run_at, window, timezone)
+
+    return run_at
+
+
+def _next_window_opening(at: datetime, window: tuple, timezone: str) -> datetime:
+    """Shift a naive UTC time into the next local [start, end) window"""
+    try:
+        tz = ZoneInfo(timezone or "UTC")
+    except Exception:
+        tz = ZoneInfo("UTC")
+
+    local = at.replace(tzinfo=ZoneInfo("UTC")).astimezone(tz)
+    start, end = window
+    if local.hour < start:
+        local = local.replace(hour=start, minute=0, second=0, microsecond=0)
+    elif local.hour >= end:
+        local = (local + timedelta(days=1)).replace(hour=start, minute=0, second=0, microsecond=0)
+
+    return local.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+
+
+# ============================================================================
+# ENROLLMENT
+# ============================================================================
+
+def enroll_leads(sequence_id: str, lead_ids: list, now: datetime = None):
+    """
+    Bulk-enroll leads into a sequence (already-enrolled leads are skipped)
+
+    Args:
+        sequence_id: Sequence to enroll into
+        lead_ids: Leads to enroll
+        now: Enrollment time (defaults to utcnow)
+
+    Returns:
+        Number of enrollments created
+    """
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        sequence = db.query(Sequence).filter(Sequence.id == sequence_id).first()
+        if not sequence:
+            raise ValueError(f"Unknown sequence: {sequence_id}")
+
+        first_step = db.query(SequenceStep).filter(
+            SequenceStep.sequence_id == sequence_id
+        ).order_by(SequenceStep.step_no).first()
+        if not first_step:
+            return 0
+
+        company = db.query(Company).filter(Company.id == sequence.company_id).first()
+        timezone = company.timezone if company else "UTC"
+        next_run_at = compute_next_run(first_step, now, timezone)
+
+        enrolled = 0
+        for chunk in _chunks(list(dict.fromkeys(lead_ids)), DEFAULT_BATCH_SIZE):
+            already = {
+                lead_id for (lead_id,) in db.query(SequenceEnrollment.lead_id).filter(
+                    SequenceEnrollment.sequence_id == sequence_id,
+                    SequenceEnrollment.lead_id.in_(chunk)
+                )
+            }
+            leads = db.query(Lead.id, Lead.stage_id).filter(
+                Lead.id.in_([lead_id for lead_id in chunk if lead_id not in already])
+            ).all()
+            rows = [{
+                "sequence_id": sequence_id,
+                "lead_id": lead_id,
+                "company_id": sequence.company_id,
+                "stage_id": stage_id,
+                "next_step_no": first_step.step_no,
+                "status": "active",
+                "next_run_at": next_run_at,
+                "enrolled_at": now,
+            } for lead_id, stage_id in leads]
+            if rows:
+                db.execute(insert(SequenceEnrollment), rows)
+                enrolled += len(rows)
+
+        db.commit()
+        return enrolled
+
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+
+# ============================================================================
+# SCHEDULER
+# ============================================================================
+
+def claim_due_enrollments(db, batch_size: int = DEFAULT_BATCH_SIZE, now: datetime = None):
+    """
+    Claim a batch of due enrollments for this transaction
+
+    PostgreSQL: FOR UPDATE SKIP LOCKED, so concurrent schedulers never block
+    on or double-claim the same rows. SQLite has no row locks and serializes
+    writers anyway; there we take the batch with a plain SELECT and rely on
+    the compare-and-set in advance_due_enrollments() to drop rows another
+    process advanced first.
+    """
+    now = now or datetime.utcnow()
+    query = db.query(SequenceEnrollment).filter(
+        SequenceEnrollment.status == "active",
+        SequenceEnrollment.next_run_at <= now
+    ).order_by(SequenceEnrollment.next_run_at).limit(batch_size)
+
+    if db.bind.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+
+    return query.all()
+
+
+def _replied_enrollment_ids(db, enrollments: list) -> set:
+    """Enrollments whose lead sent an inbound message since the last step (one query)"""
+    ids = [e.id for e in enrollments]
+    since = func.coalesce(SequenceEnrollment.last_step_at, SequenceEnrollment.enrolled_at)
+    rows = db.query(SequenceEnrollment.id).join(
+        Message, Message.lead_id == SequenceEnrollment.lead_id
+    ).filter(
+        SequenceEnrollment.id.in_(ids),
+        Message.direction == "inbound",
+        Message.created_at > since
+    ).distinct()
+    return {enrollment_id for (enrollment_id,) in rows}
+
+
+def advance_due_enrollments(batch_size: int = DEFAULT_BATCH_SIZE, now: datetime = None,
+                            publish: bool = True):
+    """
+    Claim one batch of due enrollments, check stop conditions set-wise,
+    bulk-insert one sequence.step job per surviving enrollment and move each
+    enrollment to its next step - all in a single transaction.
+
+    Args:
+        batch_size: Max enrollments to advance
+        now: Scheduler clock (defaults to utcnow)
+        publish: Release the created jobs after commit (queue_manager.release_jobs)
+
+    Returns:
+        Dict with claimed, advanced, stopped and completed counts
+    """
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        enrollments = claim_due_enrollments(db, batch_size, now)
+        result = {"claimed": len(enrollments), "advanced": 0, "stopped": 0, "completed": 0}
+        if not enrollments:
+            db.rollback()
+            return result
+
+        sequence_ids = {e.sequence_id for e in enrollments}
+        lead_ids = {e.lead_id for e in enrollments}
+
+        # Steps for every sequence in the batch, indexed by (sequence_id, step_no)
+        steps = {}
+        for step in db.query(SequenceStep).filter(SequenceStep.sequence_id.in_(sequence_ids)):
+            steps[(step.sequence_id, step.step_no)] = step
+        step_numbers = {}
+        for sequence_id, step_no in steps:
+            step_numbers.setdefault(sequence_id, []).append(step_no)
+        for numbers in step_numbers.values():
+            numbers.sort()
+
+        active_sequences = {
+            sequence_id for (sequence_id,) in db.query(Sequence.id).filter(
+                Sequence.id.in_(sequence_ids), Sequence.active == True
+            )
+        }
+        leads = {
+            lead_id: (stage_id, status) for lead_id, stage_id, status in db.query(
+                Lead.id, Lead.stage_id, Lead.status
+            ).filter(Lead.id.in_(lead_ids))
+        }
+        timezones = dict(db.query(Company.id, Company.timezone).filter(
+            Company.id.in_({e.company_id for e in enrollments})
+        ).all())
+        replied = _replied_enrollment_ids(db, enrollments)
+
+        jobs = []
+        updates = []
+        for e in enrollments:
+            step = steps.get((e.sequence_id, e.next_step_no))
+            stage_id, lead_status = leads.get(e.lead_id, (None, None))
+
+            stop_reason = None
+            if e.sequence_id not in active_sequences:
+                stop_reason = "sequence_inactive"
+            elif lead_status != "active":
+                stop_reason = "lead_inactive"
+            elif e.stage_id and stage_id != e.stage_id:
+                stop_reason = "stage_changed"
+            elif step is not None and step.stop_on_reply and e.id in replied:
+                stop_reason = "replied"
+
+            row = {
+                "_id": e.id,
+                "_claimed_step_no": e.next_step_no,
+                "_next_step_no": e.next_step_no,
+                "_status": "active",
+                "_stop_reason": None,
+                "_last_step_at": e.last_step_at,
+                "_next_run_at": None,
+            }
+            updates.append(row)
+
+            if stop_reason or step is None:
+                row["_status"] = "stopped" if stop_reason else "completed"
+                row["_stop_reason"] = stop_reason
+                result["stopped" if stop_reason else "completed"] += 1
+                continue
+
+            jobs.append({
+                "job_type": "sequence.step",
+                "payload": {
+                    "enrollment_id": e.id,
+                    "sequence_id": e.sequence_id,
+                    "step_id": step.id,
+                    "lead_id": e.lead_id,
+                },
+                "idempotency_key": f"sequence_step_{e.id}_{step.step_no}",
+                "company_id": e.company_id,
+            })
+            row["_last_step_at"] = now
+            result["advanced"] += 1
+
+            later = [n for n in step_numbers[e.sequence_id] if n > step.step_no]
+            if later:
+                next_step = steps[(e.sequence_id, later[0])]
+                row["_next_step_no"] = next_step.step_no
+                row["_next_run_at"] = compute_next_run(next_step, now, timezones.get(e.company_id))
+            else:
+                row["_next_step_no"] = step.step_no + 1
+                row["_status"] = "completed"
+                result["completed"] += 1
+
+        # One executemany for the whole batch. The compare-and-set on
+        # next_step_no makes a row another scheduler already advanced (SQLite,
+        # no SKIP LOCKED) match nothing instead of being advanced twice; the
+        # step job itself is deduplicated by its idempotency key.
+        table = SequenceEnrollment.__table__
+        db.execute(
+            update(table).where(
+                table.c.id == bindparam("_id"),
+                table.c.next_step_no == bindparam("_claimed_step_no")
+            ).values(
+                next_step_no=bindparam("_next_step_no"),
+                status=bindparam("_status"),
+                stop_reason=bindparam("_stop_reason"),
+                last_step_at=bindparam("_last_step_at"),
+                next_run_at=bindparam("_next_run_at"),
+            ),
+            updates
+        )
+
+        inserted = insert_jobs(db, jobs)
+        db.commit()
+
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        db.close()
+
+    if publish:
+        release_jobs(inserted)
+
+    return result
+
+
+def run_scheduler_tick(batch_size: int = DEFAULT_BATCH_SIZE, max_batches: int = 20):
+    """
+    Advance due enrollments batch by batch until none are due or max_batches is hit
+
+    Returns:
+        Aggregated counts across batches
+    """
+    totals = {"claimed": 0, "advanced": 0, "stopped": 0, "completed": 0, "batches": 0}
+    for _ in range(max_batches):
+        result = advance_due_enrollments(batch_size)
+        totals["batches"] += 1
+        for key in ("claimed", "advanced", "stopped", "completed"):
+            totals[key] += result[key]
+        if result["claimed"] < batch_size:
+            break
+    return totals
+
+
+# ============================================================================
+# STEP EXECUTION HELPERS (used by worker.sequence_step)
+# ============================================================================
+
+def has_replied_since(db, lead_id: str, since: datetime) -> bool:
+    """Last-moment stop_on_reply check for a single step about to be sent"""
+    query = db.query(Message.id).filter(
+        Message.lead_id == lead_id,
+        Message.direction == "inbound"
+    )
+    if since:
+        query = query.filter(Message.created_at > since)
+    return query.first() is not None
+
+
+def stop_enrollment(db, enrollment_id: str, reason: str):
+    """Stop an enrollment (caller commits)"""
+    db.query(SequenceEnrollment).filter(SequenceEnrollment.id == enrollment_id).update({
+        "status": "stopped",
+        "stop_reason": reason,
+        "next_run_at": None,
+    })
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -29,6 +29,13 @@ if (Test-Path ".env") {
     }
 }
 
+Write-Host "✅ Migrating database schema..." -ForegroundColor Green
+& ".\.venv\Scripts\python.exe" migrate.py
+if ($LASTEXITCODE -ne 0) {
+    Write-Host "❌ Schema migration failed" -ForegroundColor Red
+    exit 1
+}
+
 Write-Host "✅ Starting FastAPI server..." -ForegroundColor Green
 Write-Host "   Server will be available at: http://127.0.0.1:8000" -ForegroundColor White
 Write-Host "   API Docs: http://127.0.0.1:8000/docs" -ForegroundColor White
@@ -0,0 +1,182 @@
+"""
+Startup
+Boot timing, optional warm-up and import-time reports for API and workers
+
+Import this module first (main.py / worker.py do) so its clock starts
+before the heavy imports:
+
+    startup.mark("imports")   # after the module imports
+    startup.mark("ready")     # when the process starts serving
+
+Boot phases are logged once and served by GET /health.
+
+Warm-up (WARMUP=1) runs when a process is about to serve, never at import:
+    - opens WARMUP_DB_CONNECTIONS pooled DB connections (default: pool size)
+    - connects to the broker and fills the producer pool
+    - workers: imports and builds the default LLM provider client (HTTP pool)
+so the first requests/tasks do not pay for them.
+
+    python startup.py importtime main     # Slowest imports of the API
+    python startup.py importtime worker   # ... of a worker
+"""
+import os
+import sys
+import time
+
+_started = time.perf_counter()
+_phases = {}
+
+WARMUP = os.getenv("WARMUP", "0") == "1"
+
+
+def mark(phase: str) -> float:
+    """Record seconds since boot for `phase` (first call wins)"""
+    if phase not in _phases:
+        _phases[phase] = round(time.perf_counter() - _started, 4)
+    return _phases[phase]
+
+
+def report() -> dict:
+    """Boot phases recorded so far, in seconds since this module was imported"""
+    return dict(_phases)
+
+
+def log_boot(name: str):
+    phases = ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in _phases.items())
+    print(f"🚀 {name} boot (pid {os.getpid()}): {phases}")
+
+
+# ============================================================================
+# WARM-UP
+# ============================================================================
+
+def warm_db(connections: int = None) -> int:
+    """Open pooled connections now (returned to the pool, left open)"""
+    from database import engine
+    from sqlalchemy import text
+
+    pool_size = getattr(engine.pool, "size", lambda: 1)()
+    size = connections or int(os.getenv("WARMUP_DB_CONNECTIONS", "0")) or pool_size
+    opened = []
+    try:
+        for _ in range(size):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            opened.append(conn)
+    finally:
+        for conn in opened:
+            conn.close()
+    return len(opened)
+
+
+def warm_broker():
+    """Connect to the broker and pre-create a producer"""
+    from celery_app import celery
+
+    with celery.connection_for_write() as conn:
+        conn.ensure_connection(max_retries=1)
+    with celery.producer_or_acquire():
+        pass
+
+
+def warm_llm():
+    """Import and build the default provider's client"""
+    import llm_providers
+
+    provider = llm_providers.get_provider(llm_providers.DEFAULT_PROVIDER)
+    if hasattr(provider, "client"):
+        provider.client()
+
+
+def warm_up(broker: bool = True, llm: bool = True) -> dict:
+    """
+    Pre-open DB/broker/HTTP pools; failures are logged, never fatal
+
+    Args:
+        broker: Connect to the broker
+        llm: Build the LLM client (workers only; the API never calls it)
+
+    Returns:
+        {step: seconds or error string}
+    """
+    steps = [("db", warm_db)]
+    if broker:
+        steps.append(("broker", warm_broker))
+    if llm:
+        steps.append(("llm", warm_llm))
+    result = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+            result[name] = round(time.perf_counter() - start, 4)
+        except Exception as e:
+            result[name] = f"failed: {e}"
+            print(f"⚠️ Warm-up {name} failed: {e}")
+    mark("warmup")
+    return result
+
+
+def instrument_celery(app):
+    """Boot logging and warm-up for worker processes"""
+    from celery import signals
+
+    @signals.worker_process_init.connect(weak=False)
+    def _child_init(**kwargs):
+        # Prefork child: never reuse connections inherited from the parent
+        from database import engine
+        engine.dispose(close=False)
+        if WARMUP:
+            warm_up()
+        mark("ready")
+        log_boot("Worker child")
+
+    @signals.worker_ready.connect(weak=False)
+    def _worker_ready(sender=None, **kwargs):
+        pool_cls = getattr(getattr(sender, "controller", None), "pool_cls", None)
+        prefork = pool_cls is not None and "prefork" in getattr(pool_cls, "__module__", str(pool_cls))
+        # Thread/solo pools run tasks in this process; prefork children warm themselves
+        if WARMUP and not prefork:
+            warm_up()
+        mark("ready")
+        log_boot("Worker")
+
+
+# ============================================================================
+# IMPORT-TIME REPORT
+# ============================================================================
+
+def import_times(module: str, top: int = 15) -> list:
+    """
+    Import `module` in a fresh interpreter with -X importtime
+
+    Returns:
+        [(cumulative_ms, package)] for the slowest top-level imports
+    """
+    import subprocess
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if cumulative.strip().isdigit() and not name.startswith("    "):  # Module + direct imports
+            rows.append((int(cumulative) / 1000, name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != "importtime":
+        print(__doc__)
+        sys.exit(1)
+    for ms, name in import_times(sys.argv[2]):
+        print(f"{ms:9.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
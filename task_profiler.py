@@ -0,0 +1,425 @@
+"""
+Task Profiler
+On-demand sampling profiles and slow-task records for Celery tasks
+
+Every task carries a few counters while it runs: query count and DB time
+(SQLAlchemy cursor events), LLM time and channel send time (telemetry
+spans). A task that runs longer than SLOW_TASK_SECONDS leaves a TaskProfile
+row with those numbers.
+
+Sampling profiles are off by default. They are turned on by:
+    - a ProfilingRule (POST /admin/profiling/rules): per job type and/or
+      company, for a fraction of tasks, until it expires. Workers re-read
+      rules every PROFILE_RULES_REFRESH_SECONDS.
+    - SIGUSR2 to a worker process: toggles profiling of every task it runs
+
+A profiled task's thread is sampled every PROFILE_INTERVAL_MS by one
+background thread; the stacks are stored as collapsed "frame;frame count"
+lines (flamegraph.pl / speedscope) on the task's TaskProfile row and
+downloaded from GET /admin/profiling/tasks/{id}/profile.
+
+With no rule active the cost per task is the counters above; the sampler
+thread sleeps until a profiled task starts.
+"""
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+import telemetry
+
+SLOW_TASK_SECONDS = float(os.getenv("SLOW_TASK_SECONDS", "30"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+RULES_REFRESH = float(os.getenv("PROFILE_RULES_REFRESH_SECONDS", "10"))
+RETENTION = timedelta(days=int(os.getenv("PROFILE_RETENTION_DAYS", "7")))
+MAX_STACK_DEPTH = 64
+
+
+class TaskStats:
+    """Counters for one running task"""
+
+    __slots__ = ("task", "job_id", "job_type", "company_id", "started", "queries",
+                 "db_seconds", "llm_seconds", "send_seconds", "profiled", "stacks", "samples")
+
+    def __init__(self, task: str):
+        self.task = task
+        self.job_id = None
+        self.job_type = None
+        self.company_id = None
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.llm_seconds = 0.0
+        self.send_seconds = 0.0
+        self.profiled = False
+        self.stacks = None
+        self.samples = 0
+
+
+_active = ContextVar("task_stats", default=None)
+_signal_all = False
+
+
+# ============================================================================
+# COUNTERS (DB, LLM, SEND)
+# ============================================================================
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get() is not None:
+        conn.info.setdefault("profiler_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _active.get()
+    if stats is None:
+        return
+    starts = conn.info.get("profiler_start")
+    if starts:
+        stats.db_seconds += time.perf_counter() - starts.pop()
+    stats.queries += 1
+
+
+def _on_span(name: str, seconds: float):
+    stats = _active.get()
+    if stats is None:
+        return
+    if name == "llm":
+        stats.llm_seconds += seconds
+    elif name == "channel.send":
+        stats.send_seconds += seconds
+
+
+# ============================================================================
+# RULES
+# ============================================================================
+
+_rules = []
+_rules_loaded_at = 0.0
+_rules_lock = threading.Lock()
+
+
+def _load_rules() -> list:
+    from database import SessionLocal
+    from models import ProfilingRule
+
+    db = SessionLocal()
+    try:
+        rows = db.query(ProfilingRule).filter(ProfilingRule.expires_at > datetime.utcnow()).all()
+        return [(r.job_type, r.company_id, r.sample_rate if r.sample_rate is not None else 1.0) for r in rows]
+    finally:
+        db.close()
+
+
+def _current_rules() -> list:
+    global _rules, _rules_loaded_at
+    now = time.monotonic()
+    if now - _rules_loaded_at < RULES_REFRESH:
+        return _rules
+    with _rules_lock:
+        if now - _rules_loaded_at >= RULES_REFRESH:
+            try:
+                _rules = _load_rules()
+            except Exception as e:
+                print(f"⚠️ Profiling rules refresh failed: {e}")
+            _rules_loaded_at = now
+    return _rules
+
+
+def should_profile(job_type: str, company_id: str) -> bool:
+    if _signal_all:
+        return True
+    for rule_type, rule_company, rate in _current_rules():
+        if rule_type and rule_type != job_type:
+            continue
+        if rule_company and rule_company != company_id:
+            continue
+        if random.random() < rate:
+            return True
+    return False
+
+
+def invalidate_rules():
+    """Re-read rules on the next task (this process)"""
+    global _rules_loaded_at
+    _rules_loaded_at = 0.0
+
+
+# ============================================================================
+# SAMPLER
+# ============================================================================
+
+_profiled_threads = {}
+_sampler_wakeup = threading.Event()
+_sampler_thread = None
+_sampler_lock = threading.Lock()
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample_loop():
+    while True:
+        if not _profiled_threads:
+            _sampler_wakeup.wait()
+            _sampler_wakeup.clear()
+            continue
+        frames = sys._current_frames()
+        for thread_id, stats in list(_profiled_threads.items()):
+            frame = frames.get(thread_id)
+            if frame is not None:
+                stats.stacks[_collapse(frame)] += 1
+                stats.samples += 1
+        del frames
+        time.sleep(PROFILE_INTERVAL)
+
+
+def _start_sampling(stats: TaskStats):
+    global _sampler_thread
+    with _sampler_lock:
+        # A prefork child inherits the parent's thread object but not the thread
+        if _sampler_thread is None or not _sampler_thread.is_alive():
+            _sampler_thread = threading.Thread(target=_sample_loop, name="task-profiler", daemon=True)
+            _sampler_thread.start()
+    stats.profiled = True
+    stats.stacks = Counter()
+    _profiled_threads[threading.get_ident()] = stats
+    _sampler_wakeup.set()
+
+
+def _stop_sampling():
+    _profiled_threads.pop(threading.get_ident(), None)
+
+
+# ============================================================================
+# TASK HOOKS
+# ============================================================================
+
+def job_started(job):
+    """Attach the job to the running task's stats; start sampling if a rule matches"""
+    stats = _active.get()
+    if stats is None:
+        return
+    stats.job_id, stats.job_type, stats.company_id = job.id, job.job_type, job.company_id
+    if not stats.profiled and should_profile(job.job_type, job.company_id):
+        _start_sampling(stats)
+
+
+def _save(stats: TaskStats, duration: float):
+    from database import SessionLocal
+    from models import TaskProfile
+
+    stacks = None
+    if stats.stacks:
+        stacks = "\n".join(f"{stack} {count}" for stack, count in stats.stacks.most_common())
+    db = SessionLocal()
+    try:
+        db.add(TaskProfile(
+            task=stats.task,
+            job_id=stats.job_id,
+            job_type=stats.job_type,
+            company_id=stats.company_id,
+            reason="slow" if duration >= SLOW_TASK_SECONDS else "profiled",
+            duration=duration,
+            query_count=stats.queries,
+            db_seconds=stats.db_seconds,
+            llm_seconds=stats.llm_seconds,
+            send_seconds=stats.send_seconds,
+            samples=stats.samples,
+            stacks=stacks,
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Could not save task profile: {e}")
+    finally:
+        db.close()
+    if duration >= SLOW_TASK_SECONDS:
+        print(f"🐢 Slow task {stats.task} job={stats.job_id} company={stats.company_id} "
+              f"{duration:.1f}s (db {stats.db_seconds:.2f}s/{stats.queries}q, "
+              f"llm {stats.llm_seconds:.2f}s, send {stats.send_seconds:.2f}s)")
+
+
+def _toggle_all(signum, frame):
+    global _signal_all
+    _signal_all = not _signal_all
+    print(f"🔬 Profiling of all tasks {'on' if _signal_all else 'off'} (pid {os.getpid()})")
+
+
+def _install_signal():
+    if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2, _toggle_all)
+
+
+def instrument_celery(app):
+    """Per-task counters, rule-driven sampling and slow-task capture"""
+    from celery import signals
+    from sqlalchemy import event
+    from database import engine
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    telemetry.add_span_listener(_on_span)
+
+    tasks = {}
+
+    @signals.task_prerun.connect(weak=False)
+    def _task_started(task_id=None, task=None, **kwargs):
+        stats = TaskStats(task.name if task else "")
+        tasks[task_id] = (stats, _active.set(stats))
+
+    @signals.task_postrun.connect(weak=False)
+    def _task_finished(task_id=None, **kwargs):
+        entry = tasks.pop(task_id, None)
+        if entry is None:
+            return
+        stats, token = entry
+        duration = time.perf_counter() - stats.started
+        if stats.profiled:
+            _stop_sampling()
+        try:
+            _active.reset(token)
+        except ValueError:
+            _active.set(None)
+        if stats.profiled or duration >= SLOW_TASK_SECONDS:
+            _save(stats, duration)
+
+    @signals.worker_init.connect(weak=False)
+    def _worker_init(**kwargs):
+        _install_signal()
+
+    @signals.worker_process_init.connect(weak=False)
+    def _child_init(**kwargs):
+        _install_signal()
+
+
+# ============================================================================
+# ADMIN
+# ============================================================================
+
+def add_rule(job_type: str = None, company_id: str = None, sample_rate: float = 1.0,
+             minutes: float = 15) -> dict:
+    """Profile matching tasks for the next `minutes`"""
+    from database import SessionLocal
+    from models import ProfilingRule
+
+    db = SessionLocal()
+    try:
+        rule = ProfilingRule(
+            job_type=job_type,
+            company_id=company_id,
+            sample_rate=max(0.0, min(1.0, sample_rate)),
+            expires_at=datetime.utcnow() + timedelta(minutes=minutes),
+        )
+        db.add(rule)
+        db.commit()
+        return _rule_dict(rule)
+    finally:
+        db.close()
+
+
+def _rule_dict(rule) -> dict:
+    return {
+        "id": rule.id,
+        "job_type": rule.job_type,
+        "company_id": rule.company_id,
+        "sample_rate": rule.sample_rate,
+        "expires_at": rule.expires_at.isoformat() if rule.expires_at else None,
+    }
+
+
+def list_rules() -> list:
+    from database import SessionLocal
+    from models import ProfilingRule
+
+    db = SessionLocal()
+    try:
+        rows = db.query(ProfilingRule).filter(
+            ProfilingRule.expires_at > datetime.utcnow()
+        ).order_by(ProfilingRule.created_at).all()
+        return [_rule_dict(r) for r in rows]
+    finally:
+        db.close()
+
+
+def delete_rule(rule_id: str) -> bool:
+    from database import SessionLocal
+    from models import ProfilingRule
+
+    db = SessionLocal()
+    try:
+        deleted = db.query(ProfilingRule).filter(ProfilingRule.id == rule_id).delete()
+        db.commit()
+        return bool(deleted)
+    finally:
+        db.close()
+
+
+def list_profiles(company_id: str = None, job_type: str = None, limit: int = 50) -> list:
+    """Most recent slow/profiled task records (without stacks)"""
+    from database import ReadSessionLocal
+    from models import TaskProfile
+
+    db = ReadSessionLocal()
+    try:
+        query = db.query(TaskProfile)
+        if company_id:
+            query = query.filter(TaskProfile.company_id == company_id)
+        if job_type:
+            query = query.filter(TaskProfile.job_type == job_type)
+        rows = query.order_by(TaskProfile.created_at.desc()).limit(limit).all()
+        return [{
+            "id": p.id,
+            "task": p.task,
+            "job_id": p.job_id,
+            "job_type": p.job_type,
+            "company_id": p.company_id,
+            "reason": p.reason,
+            "duration": round(p.duration, 3),
+            "query_count": p.query_count,
+            "db_seconds": round(p.db_seconds, 3),
+            "llm_seconds": round(p.llm_seconds, 3),
+            "send_seconds": round(p.send_seconds, 3),
+            "samples": p.samples,
+            "created_at": p.created_at.isoformat() if p.created_at else None,
+        } for p in rows]
+    finally:
+        db.close()
+
+
+def get_profile_stacks(profile_id: str):
+    """Collapsed stacks of one profile, or None if it has none"""
+    from database import SessionLocal
+    from models import TaskProfile
+
+    db = SessionLocal()
+    try:
+        row = db.query(TaskProfile.stacks).filter(TaskProfile.id == profile_id).first()
+        return row.stacks if row else None
+    finally:
+        db.close()
+
+
+def purge_profiles(now: datetime = None) -> int:
+    """Delete task profiles older than PROFILE_RETENTION_DAYS"""
+    from database import SessionLocal
+    from models import TaskProfile
+
+    cutoff = (now or datetime.utcnow()) - RETENTION
+    db = SessionLocal()
+    try:
+        deleted = db.query(TaskProfile).filter(TaskProfile.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
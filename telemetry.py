@@ -0,0 +1,494 @@
+"""
+Telemetry
+Prometheus metrics and stage spans for the API, queue, LLM and channels
+
+Metrics live in a small in-process registry and are rendered in the
+Prometheus text format: by the API at GET /metrics and, in workers, by an
+exporter started when WORKER_METRICS_PORT is set (one port per prefork child:
+base + 1 + child index; base for the main process).
+
+Spans time each stage of a request or job. Every span feeds the
+shvya_stage_seconds histogram; spans of sampled traces (TRACE_SAMPLE_RATE)
+are also printed as one-line records keyed by trace id. The trace context
+travels as a W3C traceparent: HTTP header → Job.payload["traceparent"] →
+worker task, so an inbound message and the reply job it caused share one
+trace id.
+
+Recording is a dict lookup and a few additions under a lock per sample, cheap
+enough to leave on in production.
+"""
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+WAIT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+# ============================================================================
+# METRICS REGISTRY
+# ============================================================================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+    def _sample_lines(self, key, value) -> list:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """Mirror a monotonic count kept elsewhere (collectors)"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _sample_lines(self, key, value) -> list:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = f'le="{_number(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(float(total))}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+_registry = []
+_collectors = []
+
+
+def register_collector(collect):
+    """Callable run before each render (e.g. to refresh gauges)"""
+    _collectors.append(collect)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    for collect in _collectors:
+        try:
+            collect()
+        except Exception as e:
+            print(f"⚠️ Metrics collector failed: {e}")
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_SECONDS = Histogram("shvya_http_request_seconds", "API request latency",
+                         ("method", "route", "status"))
+STAGE_SECONDS = Histogram("shvya_stage_seconds", "Time spent per request/job stage", ("stage",))
+STAGE_ERRORS = Counter("shvya_stage_errors_total", "Stages that raised", ("stage",))
+JOB_WAIT_SECONDS = Histogram("shvya_job_wait_seconds",
+                             "Job wait before start: total since enqueue, broker since release",
+                             ("job_type", "phase"), WAIT_BUCKETS)
+TASK_SECONDS = Histogram("shvya_task_seconds", "Celery task run time", ("task", "state"))
+LLM_SECONDS = Histogram("shvya_llm_request_seconds", "LLM call latency",
+                        ("provider", "model", "outcome"))
+LLM_TOKENS = Histogram("shvya_llm_tokens", "Tokens per LLM call",
+                       ("provider", "model", "kind"), TOKEN_BUCKETS)
+LLM_TOKENS_TOTAL = Counter("shvya_llm_tokens_total", "Tokens used", ("provider", "model", "kind"))
+CHANNEL_SECONDS = Histogram("shvya_channel_send_seconds", "Channel adapter send latency",
+                            ("channel", "status"))
+BREAKER_OPEN = Gauge("shvya_breaker_open", "1 while a provider's circuit breaker is open", ("provider",))
+
+
+def _collect_breakers():
+    from retry_policy import get_breaker_stats
+    for provider, snapshot in get_breaker_stats().items():
+        BREAKER_OPEN.set(1 if snapshot["state"] == "open" else 0, provider=provider)
+
+
+register_collector(_collect_breakers)
+
+DB_POOL_CONNECTIONS = Gauge("shvya_db_pool_connections", "Pooled DB connections by state",
+                            ("role", "state"))
+DB_POOL_SATURATION = Gauge("shvya_db_pool_saturation", "Checked-out connections / (pool size + max overflow)",
+                           ("role",))
+DB_REPLICA_LAG = Gauge("shvya_db_replica_lag_seconds", "Last measured replication lag (-1 = unhealthy)",
+                       ("role",))
+DB_READS_ROUTED = Counter("shvya_db_read_sessions_total", "Read sessions by target", ("route",))
+
+
+def _collect_db_pools():
+    from database import get_pool_stats
+    stats = get_pool_stats()
+    for route, count in stats.pop("read_routing").items():
+        DB_READS_ROUTED.set(count, route=route)
+    for role, pool in stats.items():
+        if "checked_out" in pool:
+            for state in ("checked_out", "idle", "overflow"):
+                DB_POOL_CONNECTIONS.set(pool[state], role=role, state=state)
+            DB_POOL_SATURATION.set(pool["saturation"], role=role)
+        if role != "primary":
+            DB_REPLICA_LAG.set(pool["lag_seconds"] if pool["lag_seconds"] is not None else -1, role=role)
+
+
+register_collector(_collect_db_pools)
+
+CACHE_LOOKUPS = Counter("shvya_cache_lookups_total", "Hot-path cache lookups by outcome", ("cache", "result"))
+JOBS_ENQUEUED = Counter("shvya_jobs_enqueued_total",
+                        "Enqueue calls: created, or duplicate key caught by Redis/the database",
+                        ("job_type", "result"))
+INBOUND_DELIVERIES = Counter("shvya_inbound_deliveries_total",
+                             "Inbound webhook deliveries: new, replay caught by Redis/the database, or no provider id",
+                             ("channel", "result"))
+EVENTS_DROPPED = Counter("shvya_events_dropped_total",
+                         "Buffered events dropped because the event log could not keep up")
+STATUS_UPDATES = Counter("shvya_status_updates_total",
+                         "Delivery-status callback updates: received, coalesced, applied, stale, unknown, ...",
+                         ("result",))
+
+
+def record_llm_tokens(provider: str, model: str, prompt_tokens: int, completion_tokens: int):
+    for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if tokens is None:
+            continue
+        LLM_TOKENS.observe(tokens, provider=provider, model=model, kind=kind)
+        LLM_TOKENS_TOTAL.inc(tokens, provider=provider, model=model, kind=kind)
+
+
+# ============================================================================
+# TRACE CONTEXT & SPANS
+# ============================================================================
+
+class TraceContext:
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def child(self) -> "TraceContext":
+        return TraceContext(self.trace_id, _new_id(8), self.sampled)
+
+
+_current = ContextVar("trace_context", default=None)
+_span_listeners = []
+
+
+def add_span_listener(listener):
+    """Call listener(name, seconds) whenever a span ends"""
+    _span_listeners.append(listener)
+
+
+def _new_id(nbytes: int) -> str:
+    return "%0*x" % (nbytes * 2, random.getrandbits(nbytes * 8))
+
+
+def parse_traceparent(value: str):
+    """TraceContext from a W3C traceparent header, or None if malformed"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    return TraceContext(parts[1], parts[2], bool(flags & 1))
+
+
+def new_trace(traceparent: str = None) -> TraceContext:
+    """Continue the given trace, or start a new one with a sampling decision"""
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        return parent.child()
+    return TraceContext(_new_id(16), _new_id(8), random.random() < TRACE_SAMPLE_RATE)
+
+
+def current_trace():
+    return _current.get()
+
+
+def activate(context: TraceContext):
+    """Make `context` current; returns a token for deactivate()"""
+    return _current.set(context)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def continue_trace(traceparent: str):
+    """Adopt a propagated trace for the rest of the current task"""
+    context = parse_traceparent(traceparent)
+    if context is not None:
+        _current.set(context.child())
+
+
+def inject(payload: dict) -> dict:
+    """Copy of a job payload carrying the current traceparent (unchanged if no trace)"""
+    context = _current.get()
+    if context is None or payload is None or "traceparent" in payload:
+        return payload
+    return {**payload, "traceparent": context.traceparent}
+
+
+def _export(context: TraceContext, parent_id: str, name: str, seconds: float, error: bool, attrs: dict):
+    extra = "".join(f" {k}={v}" for k, v in attrs.items())
+    print(f"🔎 trace={context.trace_id} span={context.span_id} parent={parent_id} "
+          f"name={name} ms={seconds * 1000:.1f}{' error=1' if error else ''}{extra}")
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time one stage
+
+    Usage:
+        with span("llm", model=config.key):
+            ...
+    """
+    parent = _current.get()
+    context = parent.child() if parent is not None else None
+    token = _current.set(context) if context is not None else None
+    start = time.perf_counter()
+    error = False
+    try:
+        yield context
+    except Exception:
+        error = True
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=name)
+        for listener in _span_listeners:
+            listener(name, seconds)
+        if token is not None:
+            _current.reset(token)
+            if context.sampled:
+                _export(context, parent.span_id, name, seconds, error, attrs)
+
+
+class StageTimer:
+    """
+    Sequential stages without re-indenting a function body
+
+    Usage:
+        timer = StageTimer("ai_engage")
+        ...load...
+        timer.mark("load")      # records ai_engage.load
+        ...build context...
+        timer.mark("context")   # records ai_engage.context
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        seconds = now - self._last
+        self._last = now
+        name = f"{self.prefix}.{stage}"
+        STAGE_SECONDS.observe(seconds, stage=name)
+        parent = _current.get()
+        if parent is not None and parent.sampled:
+            _export(parent.child(), parent.span_id, name, seconds, False, {})
+
+
+# ============================================================================
+# API MIDDLEWARE
+# ============================================================================
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency by route template, trace per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        context = new_trace(traceparent)
+        token = _current.set(context)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"traceparent", context.traceparent.encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - start
+            route = scope.get("route")
+            HTTP_SECONDS.observe(seconds, method=scope["method"],
+                                 route=getattr(route, "path", "unmatched"), status=status["code"])
+            _current.reset(token)
+
+
+# ============================================================================
+# WORKER EXPORTER & CELERY HOOKS
+# ============================================================================
+
+_exporter = None
+
+
+def start_exporter(port: int):
+    """Serve /metrics on `port` from a daemon thread (no-op if port is 0)"""
+    global _exporter
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    if _exporter is not None:
+        # Inherited from the parent across fork: release its socket
+        _exporter.socket.close()
+        _exporter = None
+    if not port:
+        return
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        _exporter = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    except OSError as e:
+        print(f"⚠️ Metrics exporter could not bind :{port}: {e}")
+        return
+    _exporter.daemon_threads = True
+    threading.Thread(target=_exporter.serve_forever, daemon=True).start()
+    print(f"📈 Metrics exporter on :{port}/metrics")
+
+
+def instrument_celery(app):
+    """Per-task trace context and run-time histogram, plus the worker exporter"""
+    from celery import signals
+
+    tasks = {}
+
+    @signals.task_prerun.connect(weak=False)
+    def _task_started(task_id=None, task=None, **kwargs):
+        tasks[task_id] = (_current.set(new_trace()), time.perf_counter())
+
+    @signals.task_postrun.connect(weak=False)
+    def _task_finished(task_id=None, task=None, state=None, **kwargs):
+        entry = tasks.pop(task_id, None)
+        if entry is None:
+            return
+        token, start = entry
+        TASK_SECONDS.observe(time.perf_counter() - start, task=task.name if task else "", state=state or "")
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # Finished in a different context than it started
+
+    @signals.worker_init.connect(weak=False)
+    def _worker_init(**kwargs):
+        start_exporter(WORKER_METRICS_PORT)
+
+    @signals.worker_process_init.connect(weak=False)
+    def _child_init(**kwargs):
+        from billiard.process import current_process
+        index = getattr(current_process(), "index", 0) or 0
+        start_exporter(WORKER_METRICS_PORT + 1 + index if WORKER_METRICS_PORT else 0)
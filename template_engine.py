@@ -0,0 +1,295 @@
+"""
+Template Engine
+Compile-once rendering of Template.body with bulk personalization
+
+Placeholders:
+    {{name}}                 - Lead column (name, phone, email, source)
+    {{attributes.city}}      - Key in Lead.attributes
+    {{name|there}}           - Fallback used when the value is empty
+
+Template.params declares the variables a template may use, either as a list
+of names or as a {name: default} dict. Compilation fails on undeclared or
+malformed placeholders, so a bad template is rejected once instead of once
+per recipient.
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from database import SessionLocal
+from models import Template, Lead
+
+LEAD_FIELDS = ("name", "phone", "email", "source")
+ATTRIBUTE_PREFIX = "attributes."
+
+_PLACEHOLDER = re.compile(r"\{\{\s*([^{}|]+?)\s*(?:\|\s*([^{}]*?)\s*)?\}\}")
+_FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$")
+
+CACHE_SIZE = 256
+VERSION_CHECK_SECONDS = float(os.getenv("TEMPLATE_VERSION_CHECK_SECONDS", "5"))  # Edits made by other processes
+
+
+class TemplateError(ValueError):
+    """Raised when a template fails compile-time validation"""
+
+
+class CompiledTemplate:
+    """
+    A template parsed into a str.format() pattern plus an ordered field list.
+    Rendering is a single format() call over pre-resolved values.
+    """
+
+    def __init__(self, template_id: str, version, pattern: str, fields: list, defaults: list,
+                 subject: "CompiledTemplate" = None):
+        self.template_id = template_id
+        self.version = version
+        self.pattern = pattern
+        self.fields = fields
+        self.defaults = defaults
+        self.subject = subject
+
+    @property
+    def lead_columns(self) -> set:
+        """Lead columns this template (and its subject) needs"""
+        columns = set()
+        for compiled in (self, self.subject):
+            if compiled is None:
+                continue
+            for field in compiled.fields:
+                columns.add("attributes" if field.startswith(ATTRIBUTE_PREFIX) else field)
+        return columns
+
+    def render(self, row: dict) -> str:
+        """Render against a dict of lead columns (attributes as a nested dict)"""
+        attributes = row.get("attributes") or {}
+        values = []
+        for field, default in zip(self.fields, self.defaults):
+            if field.startswith(ATTRIBUTE_PREFIX):
+                value = attributes.get(field[len(ATTRIBUTE_PREFIX):])
+            else:
+                value = row.get(field)
+            values.append(default if value in (None, "") else value)
+        return self.pattern.format(*values)
+
+
+def compile_text(text: str, params=None, template_id: str = None, version=None) -> CompiledTemplate:
+    """
+    Compile template text
+
+    Args:
+        text: Template body with {{placeholders}}
+        params: Declared variables (list of names or {name: default}); None skips the check
+        template_id: For error messages and cache bookkeeping
+        version: Cache version stamp
+
+    Raises:
+        TemplateError: On malformed or undeclared placeholders
+    """
+    text = text or ""
+    declared_defaults = params if isinstance(params, dict) else {}
+    declared = set(params) if params is not None else None
+
+    pattern = []
+    fields = []
+    defaults = []
+    pos = 0
+    for match in _PLACEHOLDER.finditer(text):
+        literal = text[pos:match.start()]
+        _check_literal(literal, template_id)
+        pattern.append(literal.replace("{", "{{").replace("}", "}}"))
+
+        field, default = match.group(1), match.group(2)
+        if not _FIELD_NAME.match(field):
+            raise TemplateError(f"Template {template_id}: invalid placeholder '{{{{{field}}}}}'")
+        if not field.startswith(ATTRIBUTE_PREFIX) and field not in LEAD_FIELDS:
+            raise TemplateError(f"Template {template_id}: unknown field '{field}'")
+        if declared is not None and field not in declared and _short_name(field) not in declared:
+            raise TemplateError(f"Template {template_id}: '{field}' is not declared in params")
+
+        if default is None:
+            default = declared_defaults.get(field, declared_defaults.get(_short_name(field), ""))
+        pattern.append("{%d}" % len(fields))
+        fields.append(field)
+        defaults.append(default or "")
+        pos = match.end()
+
+    literal = text[pos:]
+    _check_literal(literal, template_id)
+    pattern.append(literal.replace("{", "{{").replace("}", "}}"))
+
+    return CompiledTemplate(template_id, version, "".join(pattern), fields, defaults)
+
+
+def _check_literal(literal: str, template_id: str):
+    if "{{" in literal or "}}" in literal:
+        raise TemplateError(f"Template {template_id}: unbalanced '{{{{' or '}}}}'")
+
+
+def _short_name(field: str) -> str:
+    return field[len(ATTRIBUTE_PREFIX):] if field.startswith(ATTRIBUTE_PREFIX) else field
+
+
+def compile_template(template: Template) -> CompiledTemplate:
+    """Compile a Template row (body plus optional meta.subject)"""
+    version = template.version
+    subject_text = (template.meta or {}).get("subject")
+    subject = compile_text(subject_text, template.params, template.id, version) if subject_text else None
+    compiled = compile_text(template.body, template.params, template.id, version)
+    compiled.subject = subject
+    return compiled
+
+
+# ============================================================================
+# COMPILED TEMPLATE CACHE (LRU keyed by template id, checked against Template.version)
+# ============================================================================
+
+_cache = OrderedDict()  # template_id → (compiled, version checked at)
+_cache_lock = threading.Lock()
+
+_stats = {
+    "compiles": 0,
+    "cache_hits": 0,
+    "renders": 0,
+    "render_seconds": 0.0,
+}
+
+
+def get_compiled(db, template_id: str) -> CompiledTemplate:
+    """
+    Return the compiled template, compiling at most once per (id, version)
+
+    A cached template is served without a query for VERSION_CHECK_SECONDS;
+    after that one integer column is read to confirm it is current. Edits
+    made in this process drop the entry at once (see _invalidate).
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(template_id)
+        if entry is not None and now - entry[1] < VERSION_CHECK_SECONDS:
+            _cache.move_to_end(template_id)
+            _stats["cache_hits"] += 1
+            return entry[0]
+
+    if entry is not None:
+        version = db.query(Template.version).filter(Template.id == template_id).scalar()
+        if version == entry[0].version:
+            with _cache_lock:
+                if template_id in _cache:
+                    _cache[template_id] = (entry[0], now)
+                    _cache.move_to_end(template_id)
+                _stats["cache_hits"] += 1
+            return entry[0]
+
+    template = db.query(Template).filter(Template.id == template_id).first()
+    if template is None:
+        raise TemplateError(f"Template not found: {template_id}")
+    compiled = compile_template(template)
+
+    with _cache_lock:
+        _cache[template_id] = (compiled, now)
+        _cache.move_to_end(template_id)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        _stats["compiles"] += 1
+
+    return compiled
+
+
+@event.listens_for(Template, "after_update")
+def _invalidate(mapper, connection, target):
+    with _cache_lock:
+        _cache.pop(target.id, None)
+
+
+def clear_cache():
+    """Drop all compiled templates"""
+    with _cache_lock:
+        _cache.clear()
+
+
+# ============================================================================
+# BULK PERSONALIZATION
+# ============================================================================
+
+def fetch_lead_columns(db, lead_ids: list, columns: set) -> list:
+    """
+    Columnar fetch: load only the Lead columns a template references
+
+    Returns:
+        List of dicts with id plus the requested columns
+    """
+    names = ["id"] + sorted(columns)
+    selected = [getattr(Lead, name) for name in names]
+    rows = db.query(*selected).filter(Lead.id.in_(lead_ids)).all()
+    return [dict(zip(names, row)) for row in rows]
+
+
+def render_batch(template_id: str, lead_ids: list, db=None, chunk_size: int = 1000) -> dict:
+    """
+    Render one template for many leads
+
+    Args:
+        template_id: Template to render
+        lead_ids: Recipients
+        db: Optional open session (a new one is used otherwise)
+        chunk_size: Leads fetched per query
+
+    Returns:
+        {lead_id: {"body": str, "subject": str or None, "email": ..., "phone": ...}}
+    """
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        compiled = get_compiled(db, template_id)
+        columns = compiled.lead_columns | {"email", "phone"}
+
+        rendered = {}
+        for i in range(0, len(lead_ids), chunk_size):
+            rows = fetch_lead_columns(db, lead_ids[i:i + chunk_size], columns)
+            start = time.perf_counter()
+            for row in rows:
+                rendered[row["id"]] = {
+                    "body": compiled.render(row),
+                    "subject": compiled.subject.render(row) if compiled.subject else None,
+                    "email": row.get("email"),
+                    "phone": row.get("phone"),
+                }
+            _record_renders(len(rows), time.perf_counter() - start)
+
+        return rendered
+    finally:
+        if own_session:
+            db.close()
+
+
+def render_for_lead(db, template_id: str, lead: Lead) -> dict:
+    """Render one template for an already-loaded lead"""
+    compiled = get_compiled(db, template_id)
+    row = {column: getattr(lead, column) for column in compiled.lead_columns}
+    start = time.perf_counter()
+    result = {
+        "body": compiled.render(row),
+        "subject": compiled.subject.render(row) if compiled.subject else None,
+    }
+    _record_renders(1, time.perf_counter() - start)
+    return result
+
+
+def _record_renders(count: int, seconds: float):
+    with _cache_lock:
+        _stats["renders"] += count
+        _stats["render_seconds"] += seconds
+
+
+def get_render_stats():
+    """Compile/cache/render counters, including renders per second"""
+    with _cache_lock:
+        stats = dict(_stats)
+        stats["cached_templates"] = len(_cache)
+    seconds = stats["render_seconds"]
+    stats["renders_per_sec"] = round(stats["renders"] / seconds) if seconds else 0
+    return stats
@@ -0,0 +1,41 @@
+"""
+Shared test setup: a throwaway SQLite database, in-memory Celery broker,
+no Redis (caches fall back to the database). Modules read their settings
+from env at import time, so this runs before any of them is imported.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_db_dir = tempfile.mkdtemp(prefix="shvya-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["CELERY_BROKER_URL"] = "memory://"
+os.environ["CELERY_RESULT_BACKEND"] = "cache+memory://"
+os.environ["CACHE_REDIS_URL"] = ""
+os.environ["TRACE_SAMPLE_RATE"] = "0"
+os.environ["AUTO_MIGRATE"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture(scope="session")
+def schema():
+    """Create the schema once per run"""
+    import migrate
+    migrate.migrate()
+
+
+@pytest.fixture
+def db(schema):
+    from database import SessionLocal
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
@@ -0,0 +1,125 @@
+import uuid
+
+import delivery_status
+from models import Company, Lead, Message
+
+
+def _lead(db):
+    company_id = str(uuid.uuid4())
+    db.add(Company(id=company_id, name="Acme"))
+    lead = Lead(id=str(uuid.uuid4()), company_id=company_id, phone="+919876543210",
+                normalized_phone="+919876543210", email="lead@example.com")
+    db.add(lead)
+    db.commit()
+    return lead
+
+
+def _message(db, lead, channel, external_id, direction="outbound", status="sent"):
+    message = Message(id=str(uuid.uuid4()), lead_id=lead.id, company_id=lead.company_id, channel=channel,
+                      direction=direction, status=status, external_id=external_id)
+    db.add(message)
+    db.commit()
+    return message.id
+
+
+def _status(db, message_id):
+    db.expire_all()
+    return db.get(Message, message_id).status
+
+
+def test_update_matches_channel_and_outbound_only(db):
+    lead = _lead(db)
+    external_id = f"shared-{uuid.uuid4().hex}"
+    cloud = _message(db, lead, "wa_cloud", external_id)
+    web = _message(db, lead, "wa_web", external_id)
+    inbound = _message(db, lead, "email", external_id, direction="inbound", status="received")
+
+    updates = delivery_status.parse_callbacks([{"external_id": external_id, "status": "read",
+                                                "channel": "whatsapp"}])
+    result = delivery_status.apply_updates(updates)
+
+    assert result["applied"] == 1
+    assert _status(db, cloud) == "read"
+    assert _status(db, web) == "sent"
+    assert _status(db, inbound) == "received"
+
+
+def test_update_without_channel_needs_a_unique_match(db):
+    lead = _lead(db)
+    shared = f"shared-{uuid.uuid4().hex}"
+    _message(db, lead, "wa_cloud", shared)
+    _message(db, lead, "wa_web", shared)
+    single = f"single-{uuid.uuid4().hex}"
+    only = _message(db, lead, "email", single)
+
+    result = delivery_status.apply_updates(delivery_status.parse_callbacks([
+        {"external_id": shared, "status": "delivered"},
+        {"external_id": single, "status": "delivered"},
+    ]))
+
+    assert result["applied"] == 1
+    assert [u["external_id"] for u in result["unknown"]] == [shared]
+    assert _status(db, only) == "delivered"
+
+
+def test_late_hard_bounce_suppresses_but_is_stale(db):
+    lead = _lead(db)
+    external_id = f"email-{uuid.uuid4().hex}"
+    message_id = _message(db, lead, "email", external_id, status="failed")
+
+    result = delivery_status.apply_updates(delivery_status.parse_callbacks([
+        {"external_id": external_id, "status": "bounce", "channel": "email", "type": "hard"},
+    ]))
+
+    assert result == {"applied": 0, "stale": 1, "suppressed": 1, "unknown": []}
+    assert _status(db, message_id) == "failed"
+    assert delivery_status.is_suppressed("Lead@Example.com")
+
+
+def _u(status, timestamp):
+    return {"status": status, "timestamp": timestamp}
+
+
+def test_newer_prefers_rank_then_timestamp():
+    assert delivery_status._newer(_u("read", 1), _u("delivered", 2))
+    assert not delivery_status._newer(_u("delivered", 5), _u("read", 1))
+    assert delivery_status._newer(_u("delivered", 3), _u("delivered", 2))
+    assert not delivery_status._newer(_u("delivered", 2), _u("delivered", 2))
+
+
+def test_parse_whatsapp_cloud_webhook():
+    body = {"entry": [{"changes": [{"value": {"statuses": [
+        {"id": "wamid.1", "status": "delivered", "timestamp": "1700000000"},
+        {"id": "wamid.2", "status": "failed", "timestamp": "1700000001",
+         "errors": [{"code": 131026, "title": "Message undeliverable"}]},
+        {"id": "wamid.3", "status": "deleted"},
+    ]}}]}]}
+    updates = delivery_status.parse_callbacks(body)
+    assert [(u["external_id"], u["status"], u["channel"]) for u in updates] == [
+        ("wamid.1", "delivered", "wa_cloud"), ("wamid.2", "failed", "wa_cloud"),
+    ]
+    assert updates[0]["timestamp"] == 1700000000.0
+    assert updates[1]["error"] == "Message undeliverable"
+
+
+def test_parse_generic_updates():
+    updates = delivery_status.parse_callbacks({"updates": [
+        {"sg_message_id": "m1", "event": "Open", "email": " A@Example.COM ", "timestamp": "2026-01-01T00:00:00Z"},
+        {"external_id": "m2", "status": "group_unsubscribe", "channel": "sendgrid", "company_id": "c1"},
+    ]})
+    assert updates[0]["external_id"] == "m1"
+    assert updates[0]["status"] == "read"
+    assert updates[0]["email"] == "a@example.com"
+    assert updates[0]["channel"] is None
+    assert updates[1]["status"] == "unsubscribed"
+    assert updates[1]["channel"] == "email"
+    assert delivery_status.parse_callbacks({"external_id": "m3", "status": "sent"})[0]["status"] == "sent"
+
+
+def test_parse_rejects_unknown_shapes():
+    for body in ("delivered", [1, 2], {"updates": "x"}):
+        try:
+            delivery_status.parse_callbacks(body)
+        except delivery_status.StatusPayloadError:
+            continue
+        raise AssertionError(f"accepted {body!r}")
@@ -0,0 +1,70 @@
+import gzip
+import json
+import os
+from datetime import datetime
+
+import event_log
+from models import Event
+
+
+def _add_events(db, count, created_at):
+    for _ in range(count):
+        db.add(Event(id=event_log.new_event_id(), type="LeadCreated", entity_type="lead",
+                     entity_id="lead-1", payload={"n": 1}, created_at=created_at))
+    db.commit()
+
+
+def _archived_rows(files):
+    rows = 0
+    for path in files:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            rows += sum(1 for line in f if json.loads(line)["type"] == "LeadCreated")
+    return rows
+
+
+def test_retention_rerun_in_same_month_keeps_earlier_archives(db, tmp_path):
+    now = datetime(2026, 10, 15)
+    old = datetime(2025, 1, 10)
+    _add_events(db, 3, old)
+
+    first = event_log.apply_retention(keep_months=12, archive_dir=str(tmp_path), now=now)
+    assert first["archived"] == 3
+    assert len(first["files"]) == 1
+
+    # Nothing expired: no file is created, the earlier archive is untouched
+    second = event_log.apply_retention(keep_months=12, archive_dir=str(tmp_path), now=now)
+    assert second == {"archived": 0, "files": [], "dropped_partitions": []}
+    assert os.path.exists(first["files"][0])
+
+    # Late rows of an old month go to a new file next to the first one
+    _add_events(db, 2, old)
+    third = event_log.apply_retention(keep_months=12, archive_dir=str(tmp_path), now=now)
+    assert third["archived"] == 2
+    assert set(third["files"]).isdisjoint(first["files"])
+    assert _archived_rows(first["files"] + third["files"]) == 5
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".partial")]
+    assert db.query(Event).filter(Event.created_at < datetime(2025, 10, 1)).count() == 0
+
+
+def test_retention_keeps_recent_events(db, tmp_path):
+    now = datetime(2026, 10, 15)
+    _add_events(db, 2, datetime(2026, 9, 1))
+    result = event_log.apply_retention(keep_months=12, archive_dir=str(tmp_path), now=now)
+    assert result["archived"] == 0
+    assert db.query(Event).filter(Event.created_at >= datetime(2026, 9, 1)).count() >= 2
+
+
+def test_failed_archive_deletes_nothing(db, tmp_path, monkeypatch):
+    now = datetime(2026, 10, 15)
+    _add_events(db, 2, datetime(2024, 3, 3))
+
+    def broken(record):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(event_log, "_dumps", broken)
+    try:
+        event_log.apply_retention(keep_months=12, archive_dir=str(tmp_path), now=now)
+    except OSError:
+        pass
+    assert os.listdir(tmp_path) == []
+    assert db.query(Event).filter(Event.created_at < datetime(2024, 4, 1)).count() == 2
@@ -0,0 +1,40 @@
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+import exports
+
+
+def test_watermark_round_trip():
+    created_at = datetime(2026, 3, 1, 12, 30, 5, 123456)
+    watermark = exports.format_watermark(created_at, "msg-1")
+    assert exports.parse_watermark(watermark) == (created_at, "msg-1")
+
+
+def test_watermark_without_id_and_empty():
+    assert exports.parse_watermark("2026-03-01T00:00:00") == (datetime(2026, 3, 1), "")
+    assert exports.parse_watermark(None) == (None, None)
+    assert exports.parse_watermark("") == (None, None)
+
+
+def test_invalid_watermark():
+    with pytest.raises(exports.ExportError):
+        exports.parse_watermark("yesterday|msg-1")
+
+
+def test_failed_parquet_export_removes_its_temp_file(monkeypatch):
+    pytest.importorskip("pyarrow")
+
+    def broken(*args, **kwargs):
+        yield from ()
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(exports, "iter_rows", broken)
+    pattern = "export_messages_"
+    before = {n for n in os.listdir(tempfile.gettempdir()) if n.startswith(pattern)}
+    with pytest.raises(RuntimeError):
+        exports.write_parquet("messages", "company-1")
+    after = {n for n in os.listdir(tempfile.gettempdir()) if n.startswith(pattern)}
+    assert after == before
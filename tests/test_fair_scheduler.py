@@ -0,0 +1,55 @@
+import pytest
+
+import fair_scheduler
+from fair_scheduler import allocate
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(fair_scheduler, "_state", {})
+    monkeypatch.setattr(fair_scheduler, "QUANTUM", 10)
+
+
+def test_window_is_split_by_weight():
+    grants = allocate(70, {"a": 1000, "b": 1000}, 30, {"a": 1.0, "b": 2.0}, {})
+    assert grants == {"a": 10, "b": 20}
+
+
+def test_small_backlog_leaves_the_rest_to_others():
+    grants = allocate(70, {"a": 3, "b": 1000}, 50, {"a": 1.0, "b": 1.0}, {})
+    assert grants == {"a": 3, "b": 47}
+
+
+def test_quota_caps_a_company():
+    quota_left = {"a": 5, "b": None}
+    grants = allocate(70, {"a": 1000, "b": 1000}, 40, {"a": 4.0, "b": 1.0}, quota_left)
+    assert grants == {"a": 5, "b": 35}
+    assert quota_left["a"] == 0
+
+
+def test_never_exceeds_window_or_backlog():
+    backlog = {"a": 7, "b": 2, "c": 100}
+    grants = allocate(70, dict(backlog), 25, {"a": 1.0, "b": 1.0, "c": 1.0}, {})
+    assert sum(grants.values()) == 25
+    assert all(grants[c] <= backlog[c] for c in grants)
+
+
+def test_rounds_rotate_between_equal_companies():
+    served = []
+    for _ in range(4):
+        grants = allocate(70, {"a": 1000, "b": 1000}, 10, {"a": 1.0, "b": 1.0}, {})
+        assert sum(grants.values()) == 10
+        served.append(next(iter(grants)))
+    assert served.count("a") == served.count("b") == 2
+
+
+def test_drained_company_forfeits_credit():
+    allocate(70, {"a": 1000, "b": 1000}, 15, {"a": 1.0, "b": 1.0}, {})
+    allocate(70, {"b": 1000}, 15, {"b": 1.0}, {})
+    assert "a" not in fair_scheduler._state[70]["deficits"]
+
+
+def test_priority_classes_keep_separate_state():
+    allocate(100, {"a": 5}, 10, {"a": 1.0}, {})
+    allocate(70, {"b": 5}, 10, {"b": 1.0}, {})
+    assert set(fair_scheduler._state) == {100, 70}
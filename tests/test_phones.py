@@ -0,0 +1,33 @@
+import pytest
+
+from phones import InvalidPhoneNumber, normalize_phone, try_normalize_phone
+
+
+@pytest.mark.parametrize("raw", [
+    "+91 98765-43210",
+    "0091 9876543210",
+    "919876543210",
+    "09876543210",
+    "9876543210",
+    "919876543210@c.us",
+    " (+91) 98765 43210 ",
+])
+def test_spellings_of_one_number(raw):
+    assert normalize_phone(raw, "91") == "+919876543210"
+
+
+def test_other_country_code():
+    assert normalize_phone("+1 (415) 555-2671", "91") == "+14155552671"
+    assert normalize_phone("4155552671", "1") == "+14155552671"
+
+
+@pytest.mark.parametrize("raw", ["", "   ", "abc", "12", "+1234567890123456789"])
+def test_invalid(raw):
+    with pytest.raises(InvalidPhoneNumber):
+        normalize_phone(raw, "91")
+    assert try_normalize_phone(raw, "91") is None
+
+
+def test_invalid_is_a_value_error():
+    assert issubclass(InvalidPhoneNumber, ValueError)
+    assert try_normalize_phone(None) is None
@@ -0,0 +1,28 @@
+import queue_manager
+from models import Job
+
+
+def test_dispatch_nudge_failure_does_not_fail_enqueue(db, monkeypatch):
+    def broker_down(*args, **kwargs):
+        raise ConnectionError("broker unreachable")
+
+    monkeypatch.setattr(queue_manager, "FAIR_SCHEDULING", True)
+    monkeypatch.setattr(queue_manager, "_last_kick", 0.0)
+    monkeypatch.setattr(queue_manager.celery, "send_task", broker_down)
+
+    job_id = queue_manager.enqueue_job("sequence.step", {"lead_id": "lead-nudge"})
+    job = db.get(Job, job_id)
+    assert job is not None
+    assert job.status == "pending"
+
+
+def test_add_job_counts_created_only_after_release(db):
+    before = queue_manager.get_enqueue_stats()["created"]
+    job = queue_manager.add_job(db, "sequence.step", {"lead_id": "lead-rollback"})
+    db.rollback()
+    assert queue_manager.get_enqueue_stats()["created"] == before
+
+    job = queue_manager.add_job(db, "sequence.step", {"lead_id": "lead-commit"})
+    db.commit()
+    queue_manager.release_added([job])
+    assert queue_manager.get_enqueue_stats()["created"] == before + 1
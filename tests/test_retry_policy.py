@@ -0,0 +1,78 @@
+import smtplib
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+
+import retry_policy
+from circuit_breaker import CircuitOpenError
+from retry_policy import CIRCUIT_OPEN, PERMANENT, THROTTLED, TRANSIENT, classify
+
+
+class _Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class HTTPFailure(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = _Response(status_code, headers)
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+def test_explicit_error_types():
+    assert classify(retry_policy.PermanentError("no")) == (PERMANENT, None)
+    assert classify(retry_policy.TransientError("later")) == (TRANSIENT, None)
+    assert classify(retry_policy.ThrottledError("slow", retry_after=12)) == (THROTTLED, 12)
+
+
+def test_http_statuses():
+    assert classify(HTTPFailure(429, {"Retry-After": "30"})) == (THROTTLED, 30.0)
+    assert classify(HTTPFailure(503, {"retry-after": "7"})) == (TRANSIENT, 7.0)
+    assert classify(HTTPFailure(500)) == (TRANSIENT, None)
+    assert classify(HTTPFailure(408)) == (TRANSIENT, None)
+    assert classify(HTTPFailure(404)) == (PERMANENT, None)
+
+
+def test_smtp_codes():
+    assert classify(smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no")})) == (PERMANENT, None)
+    assert classify(smtplib.SMTPResponseException(421, b"busy")) == (THROTTLED, None)
+    assert classify(smtplib.SMTPResponseException(451, b"try later")) == (TRANSIENT, None)
+    assert classify(smtplib.SMTPResponseException(554, b"rejected")) == (PERMANENT, None)
+
+
+def test_library_and_builtin_errors():
+    assert classify(RateLimitError("slow down"))[0] == THROTTLED
+    assert classify(APITimeoutError("timed out")) == (TRANSIENT, None)
+    assert classify(ConnectionResetError("reset")) == (TRANSIENT, None)
+    assert classify(KeyError("lead_id")) == (PERMANENT, None)
+
+
+def test_circuit_open():
+    assert classify(CircuitOpenError("wa_cloud", 4.5)) == (CIRCUIT_OPEN, 4.5)
+    assert classify(str(CircuitOpenError("smtp", 12))) == (CIRCUIT_OPEN, 12.0)
+
+
+def test_messages():
+    assert classify("HTTP 429 Too Many Requests") == (THROTTLED, None)
+    assert classify("Lead not found") == (PERMANENT, None)
+    assert classify("HTTP 403 forbidden") == (PERMANENT, None)
+    assert classify("connection reset by peer") == (TRANSIENT, None)
+    assert classify(RuntimeError("quota exceeded")) == (THROTTLED, None)
+
+
+def test_parse_retry_after():
+    assert retry_policy.parse_retry_after(None) is None
+    assert retry_policy.parse_retry_after("soon") is None
+    assert retry_policy.parse_retry_after("-5") == 0.0
+    assert retry_policy.parse_retry_after(str(10 ** 9)) == retry_policy.MAX_RETRY_AFTER
+    later = datetime.utcnow() + timedelta(seconds=120)
+    seconds = retry_policy.parse_retry_after(format_datetime(later.replace(microsecond=0), usegmt=False))
+    assert 100 <= seconds <= 120
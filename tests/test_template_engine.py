@@ -0,0 +1,44 @@
+import uuid
+
+import template_engine
+from models import Company, Template
+
+
+def _template(db, body="Hi {{name}}"):
+    company_id = str(uuid.uuid4())
+    db.add(Company(id=company_id, name="Acme"))
+    template = Template(id=str(uuid.uuid4()), company_id=company_id, channel="wa_cloud", name="t",
+                        body=body, params=["name"])
+    db.add(template)
+    db.commit()
+    return template
+
+
+def test_content_edit_bumps_version_and_recompiles(db):
+    template = _template(db)
+    assert template.version == 1
+    assert template_engine.get_compiled(db, template.id).render({"name": "Asha"}) == "Hi Asha"
+
+    template.body = "Hello {{name}}"
+    db.commit()
+    assert template.version == 2
+    assert template_engine.get_compiled(db, template.id).render({"name": "Asha"}) == "Hello Asha"
+
+    template.status = "approved"  # Not rendered: no new version
+    db.commit()
+    assert template.version == 2
+
+
+def test_concurrent_edits_both_commit(db, schema):
+    from database import SessionLocal
+    template = _template(db)
+    other = SessionLocal()
+    try:
+        copy = other.get(Template, template.id)
+        template.body = "First {{name}}"
+        db.commit()
+        copy.body = "Second {{name}}"
+        other.commit()  # No StaleDataError: version is not a lock
+        assert copy.version == 3
+    finally:
+        other.close()
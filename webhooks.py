@@ -0,0 +1,454 @@
+"""
+Webhook Dispatcher
+Async delivery of signed webhooks on a per-process event loop
+
+- One asyncio loop per worker process, running in a background thread, so a
+  slow customer endpoint never holds a prefork worker slot
+- Per-host keep-alive connection pools with bounded concurrency
+- HMAC-SHA256 signatures from cached, pre-keyed HMAC state
+- Per-endpoint circuit breakers
+- Optional batching of several events into one delivery
+- ResultSink hands finished deliveries to a writer thread, so job
+  bookkeeping (DB commits, retries) never runs on the event loop
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import queue
+import ssl
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+PER_HOST_CONCURRENCY = int(os.getenv("WEBHOOK_PER_HOST_CONCURRENCY", "50"))
+REQUEST_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+STALE_AFTER = float(os.getenv("WEBHOOK_STALE_SECONDS", "600"))  # Job without a result by then is retried
+IDLE_TIMEOUT = float(os.getenv("WEBHOOK_IDLE_SECONDS", "30"))  # Below common server keep-alive timeouts
+BATCH_WINDOW = float(os.getenv("WEBHOOK_BATCH_WINDOW", "0.25"))  # seconds
+MAX_BATCH = int(os.getenv("WEBHOOK_MAX_BATCH", "50"))
+
+SIGNATURE_HEADER = "X-Shvya-Signature"
+TIMESTAMP_HEADER = "X-Shvya-Timestamp"
+MAX_RESPONSE_BODY = 64 * 1024  # Larger responses are not drained; the connection is dropped
+
+
+# ============================================================================
+# SIGNING
+# ============================================================================
+
+@lru_cache(maxsize=1024)
+def _keyed_hmac(secret: str):
+    """HMAC state with the key already absorbed; copied per signature"""
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """Signature over '<timestamp>.<body>'"""
+    mac = _keyed_hmac(secret).copy()
+    mac.update(timestamp.encode())
+    mac.update(b".")
+    mac.update(body)
+    return "sha256=" + mac.hexdigest()
+
+
+def verify(secret: str, timestamp: str, body: bytes, signature: str) -> bool:
+    """Receiver-side check (used by tests, stubs and SDK examples)"""
+    return hmac.compare_digest(sign(secret, timestamp, body), signature)
+
+
+# ============================================================================
+# PER-HOST KEEP-ALIVE POOL
+# ============================================================================
+
+class WebhookHTTPError(Exception):
+    """Malformed or truncated HTTP response"""
+
+
+class HostPool:
+    """
+    Keep-alive HTTP/1.1 connections to one origin, at most `size` in use at
+    once. Plain asyncio streams: webhook delivery only needs POST + status
+    code, and a minimal client keeps per-request overhead far below a
+    general-purpose one at thousands of concurrent deliveries.
+    """
+
+    def __init__(self, origin: str, size: int, timeout: float):
+        parts = urlsplit(origin)
+        self.host = parts.hostname
+        self.tls = parts.scheme == "https"
+        self.port = parts.port or (443 if self.tls else 80)
+        self.host_header = parts.netloc
+        self.ssl_context = ssl.create_default_context() if self.tls else None
+        self.timeout = timeout
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def post(self, path: str, body: bytes, headers: dict, admit=None) -> int:
+        """
+        POST and return the status code
+
+        `admit` is checked once a slot is free, so deliveries queued behind a
+        failing host are short-circuited as soon as its breaker opens.
+
+        A failed request is never re-sent here: once bytes are written the
+        receiver may have processed them, and the job retry is the only
+        (visible, backed-off) second delivery. Idle connections the server
+        has closed or that sat longer than WEBHOOK_IDLE_SECONDS are dropped
+        before use instead.
+        """
+        async with self._semaphore:
+            if admit is not None and not admit():
+                raise CircuitOpenError(self.host_header)
+            conn = self._checkout() or await self._connect()
+            try:
+                status, keep_alive = await asyncio.wait_for(
+                    self._roundtrip(conn, path, body, headers), self.timeout
+                )
+            except BaseException:
+                conn[1].close()
+                raise
+            if keep_alive:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                conn[1].close()
+            return status
+
+    def _checkout(self):
+        """Most recently used idle connection that is still usable, else None"""
+        now = time.monotonic()
+        while self._idle:
+            conn, idle_since = self._idle.pop()
+            if now - idle_since < IDLE_TIMEOUT and not conn[0].at_eof() and not conn[1].is_closing():
+                return conn
+            conn[1].close()
+        return None
+
+    async def _connect(self):
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context),
+            self.timeout
+        )
+
+    async def _roundtrip(self, conn, path: str, body: bytes, headers: dict):
+        reader, writer = conn
+        head = [f"POST {path} HTTP/1.1", f"Host: {self.host_header}", f"Content-Length: {len(body)}"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+            raise WebhookHTTPError(f"Bad status line: {status_line[:80]!r}")
+        status = int(parts[1])
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line:
+                raise WebhookHTTPError("Connection closed in headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip().lower()
+
+        keep_alive = response_headers.get("connection") != "close" and parts[0] == b"HTTP/1.1"
+        if response_headers.get("transfer-encoding") == "chunked":
+            await self._drain_chunked(reader)
+        elif "content-length" in response_headers:
+            length = int(response_headers["content-length"])
+            if length > MAX_RESPONSE_BODY:
+                return status, False
+            await reader.readexactly(length)
+        else:
+            keep_alive = False
+
+        return status, keep_alive
+
+    @staticmethod
+    async def _drain_chunked(reader):
+        total = 0
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            total += size
+            if total > MAX_RESPONSE_BODY:
+                raise WebhookHTTPError("Response body too large")
+            await reader.readexactly(size + 2)
+
+    def close(self):
+        for (_, writer), _ in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+# ============================================================================
+# DISPATCHER
+# ============================================================================
+
+class WebhookDispatcher:
+    """
+    Delivery engine; submit() is thread-safe and returns a
+    concurrent.futures.Future resolving to a result dict:
+        {"status": "delivered" | "failed", "status_code": int, "error": str}
+    """
+
+    def __init__(self, per_host_concurrency: int = PER_HOST_CONCURRENCY,
+                 timeout: float = REQUEST_TIMEOUT, batch_window: float = BATCH_WINDOW,
+                 max_batch: int = MAX_BATCH, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._pools = {}
+        self._breakers = {}
+        self._batches = {}
+        self._stats = {
+            "submitted": 0,
+            "delivered": 0,
+            "failed": 0,
+            "short_circuited": 0,
+            "batches": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+        }
+
+    # ------------------------------------------------------------------ loop
+
+    def start(self):
+        """Start the event loop thread (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._started.set()
+        self._loop.run_forever()
+
+    def stop(self):
+        """Close pools and stop the loop thread"""
+        if not self._loop:
+            return
+        self._loop.call_soon_threadsafe(self._close_pools)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def _close_pools(self):
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+    def submit(self, delivery: dict):
+        """
+        Queue a delivery from any thread
+
+        Args:
+            delivery: {url, secret, event, data, endpoint_id?, batch?}
+        """
+        self.start()
+        self._stats["submitted"] += 1
+        return asyncio.run_coroutine_threadsafe(self.dispatch(delivery), self._loop)
+
+    # -------------------------------------------------------------- delivery
+
+    async def dispatch(self, delivery: dict) -> dict:
+        """Deliver one event, either directly or through its endpoint's batch"""
+        if delivery.get("batch"):
+            return await self._add_to_batch(delivery)
+        return await self._post(delivery, {"event": delivery["event"], "data": delivery.get("data")})
+
+    async def _add_to_batch(self, delivery: dict) -> dict:
+        key = delivery.get("endpoint_id") or delivery["url"]
+        future = self._loop.create_future()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = []
+            self._loop.call_later(self.batch_window, self._flush_soon, key, batch)
+        batch.append((delivery, future))
+        if len(batch) >= self.max_batch:
+            self._flush_soon(key, batch)
+        return await future
+
+    def _flush_soon(self, key: str, batch: list):
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+            self._loop.create_task(self._flush_batch(batch))
+
+    async def _flush_batch(self, batch: list):
+        first = batch[0][0]
+        body = {"events": [{"event": d["event"], "data": d.get("data")} for d, _ in batch]}
+        self._stats["batches"] += 1
+        result = await self._post(first, body, count=len(batch))
+        for _, future in batch:
+            if not future.done():
+                future.set_result(result)
+
+    async def _post(self, delivery: dict, body: dict, count: int = 1) -> dict:
+        url = delivery["url"]
+        breaker = self._breaker(delivery.get("endpoint_id") or url)
+        raw = json.dumps(body, separators=(",", ":"), default=str).encode()
+        timestamp = str(int(time.time()))
+        headers = {"Content-Type": "application/json", TIMESTAMP_HEADER: timestamp}
+        if delivery.get("secret"):
+            headers[SIGNATURE_HEADER] = sign(delivery["secret"], timestamp, raw)
+
+        parts = urlsplit(url)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._track_in_flight(count)
+        try:
+            status_code = await self._pool(f"{parts.scheme}://{parts.netloc}").post(
+                path, raw, headers, admit=breaker.allow
+            )
+        except CircuitOpenError:
+            self._stats["short_circuited"] += count
+            return {
+                "status": "failed",
+                "error": f"Circuit open for endpoint (retry in {breaker.retry_after():.0f}s)",
+                "retry_after": breaker.retry_after(),
+            }
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, WebhookHTTPError) as e:
+            breaker.record_failure()
+            self._stats["failed"] += count
+            return {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        finally:
+            self._track_in_flight(-count)
+
+        if status_code < 300:
+            breaker.record_success()
+            self._stats["delivered"] += count
+            return {"status": "delivered", "status_code": status_code}
+
+        # 429/5xx mean the endpoint is struggling; other 4xx mean it is up
+        # but rejected this payload, which says nothing about its health
+        if status_code == 429 or status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        self._stats["failed"] += count
+        return {
+            "status": "failed",
+            "status_code": status_code,
+            "error": f"HTTP {status_code}",
+        }
+
+    # --------------------------------------------------------------- helpers
+
+    def _pool(self, origin: str) -> HostPool:
+        pool = self._pools.get(origin)
+        if pool is None:
+            pool = self._pools[origin] = HostPool(origin, self.per_host_concurrency, self.timeout)
+        return pool
+
+    def _breaker(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(
+                f"webhook:{key}", self.failure_threshold, self.reset_timeout
+            )
+        return breaker
+
+    def _track_in_flight(self, delta: int):
+        self._stats["in_flight"] += delta
+        if self._stats["in_flight"] > self._stats["max_in_flight"]:
+            self._stats["max_in_flight"] = self._stats["in_flight"]
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["open_circuits"] = sorted(
+            key for key, breaker in self._breakers.items() if breaker.state != "closed"
+        )
+        return stats
+
+
+# ============================================================================
+# RESULT HAND-OFF
+# ============================================================================
+
+class ResultSink:
+    """
+    Queue between the dispatcher loop and blocking bookkeeping
+
+    put() is safe to call from a future's done-callback on the loop thread:
+    it only appends to a queue. A writer thread drains the queue and calls
+    handler(items) with up to `max_batch` items at a time, so a burst of
+    finished deliveries becomes a few bulk writes.
+    """
+
+    def __init__(self, handler, max_batch: int = 500, name: str = "webhook-results"):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"received": 0, "batches": 0, "errors": 0}
+
+    def put(self, item):
+        self._stats["received"] += 1
+        self._queue.put(item)
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.handler(batch)
+                self._stats["batches"] += 1
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"❌ {self.name}: failed to record {len(batch)} results: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def join(self):
+        """Block until every result put so far has been handled"""
+        self._queue.join()
+
+    def stats(self) -> dict:
+        return {**self._stats, "pending": self._queue.qsize()}
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> WebhookDispatcher:
+    """Per-process dispatcher, started on first use (i.e. after the worker forks)"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = WebhookDispatcher()
+        return _dispatcher.start()
@@ -2,30 +2,98 @@
 SHVYA Worker - All Priority-Based Tasks
 Implements P1 (AI conversational) and P2 (timed/scheduled) jobs
 """
+import startup  # First: starts the boot clock
 from celery_app import celery
 from database import SessionLocal
-from models import Lead, Message, AIKBDoc, Stage, Job, Event
+from models import Lead, Message, AIKBDoc, AISession, Stage, Job, Sequence, SequenceStep, SequenceEnrollment, Template, WebhookEndpoint, Campaign
 from ai import generate_ai_reply
 from rules import can_ai_reply
-from queue_manager import mark_job_started, mark_job_completed, mark_job_failed
+from queue_manager import (
+    mark_job_started, mark_job_completed, mark_jobs_completed, mark_job_failed, recover_stale_jobs, replay_dlq_jobs
+)
 from channels import ChannelRouter
+from circuit_breaker import CircuitOpenError
+from event_log import log_event
+import campaigns
+import conversation_cache
+import event_log
+import fair_scheduler
+import job_retention
+import lead_scoring
+import llm_providers
+import reports
+import retry_policy
+import sequences
+import task_profiler
+import telemetry
+import template_engine
+import webhooks
 from datetime import datetime, timedelta
 import json
+import uuid
+
+startup.mark("imports")
+startup.instrument_celery(celery)
+
+# Per-task trace context/run-time metrics and the WORKER_METRICS_PORT exporter
+telemetry.instrument_celery(celery)
+# Per-task DB/LLM/send counters, slow-task records and on-demand profiles
+task_profiler.instrument_celery(celery)
 
 
 # ============================================================================
 # P1 TASKS: AI Conversational (Priority 90-100)
 # ============================================================================
 
+def _load_history(db, lead_id: str) -> list:
+    """
+    A lead's messages, oldest first, from the primary
+
+    Not from a replica: can_ai_reply() guards on the last message, and a
+    reply committed after the job was enqueued must be seen or the lead
+    gets a second one.
+    """
+    return db.query(Message).filter(
+        Message.lead_id == lead_id
+    ).order_by(Message.created_at).all()
+
+
+def _load_conversation(db, job: Job, lead_id: str):
+    """
+    Conversation state for an engagement: one Redis read when the
+    conversation is cached and current, else loaded from the database
+    (and cached). None when the lead does not exist.
+    """
+    state = conversation_cache.get(lead_id, job.company_id)
+    if state is not None and conversation_cache.has_message(state, job.payload.get("message_id")):
+        return state
+
+    lead = db.query(Lead).filter(Lead.id == lead_id).first()
+    if not lead:
+        return None
+    stage = db.query(Stage.name).filter(Stage.id == lead.stage_id).scalar() if lead.stage_id else None
+    session = db.query(AISession.memory).filter(
+        AISession.lead_id == lead_id
+    ).order_by(AISession.created_at.desc()).first()
+    kb = state["kb"] if state else None
+    state = conversation_cache.load(
+        lead, stage or "New", _load_history(db, lead_id), session.memory if session else None
+    )
+    state["kb"] = kb
+    return state
+
+
 @celery.task(name="worker.ai_engage", priority=100)
 def ai_engage(job_id: str):
     """
     P1 Task - Priority 100
     AI Engagement: Processes inbound messages and generates AI replies
+    (context from conversation_cache; the database only on a cache miss)
     """
     db = SessionLocal()
     try:
         mark_job_started(job_id)
+        timer = telemetry.StageTimer("ai_engage")
         
         # Get job
         job = db.query(Job).filter(Job.id == job_id).first()
@@ -33,55 +101,62 @@ def ai_engage(job_id: str):
             return {"error": "Job not found"}
         
         lead_id = job.payload.get("lead_id")
-        lead = db.query(Lead).filter(Lead.id == lead_id).first()
+        state = _load_conversation(db, job, lead_id)
         
-        if not lead:
+        if not state:
             mark_job_failed(job_id, "Lead not found")
             return {"error": "Lead not found"}
+        lead = state["lead"]
+        messages = state["messages"]
 
-        # Get all messages for this lead
-        messages = db.query(Message).filter(
-            Message.lead_id == lead_id
-        ).order_by(Message.created_at).all()
+        timer.mark("load")
 
         # Check if AI should reply
         if not can_ai_reply(messages):
             mark_job_completed(job_id)
             return {"status": "skipped", "reason": "Last message was outbound"}
 
-        # Get stage info
-        stage = db.query(Stage).filter(Stage.id == lead.stage_id).first() if lead.stage_id else None
-        stage_name = stage.name if stage else "New"
+        # Determine channel (prefer WhatsApp)
+        channel = "wa_web"  # Default to WhatsApp Web for now
+        
+        # Defer (without spending the attempt) while a dependency is down
+        llm_providers.ensure_available(lead["company_id"])
+        retry_policy.ensure_available(retry_policy.provider_for_channel(channel))
 
         # Get company KB docs (top 3 most relevant - simple version)
-        kb_docs = db.query(AIKBDoc).filter(
-            AIKBDoc.company_id == lead.company_id
-        ).limit(3).all() if lead.company_id else []
+        kb_docs = state["kb"]
+        if kb_docs is None and lead["company_id"]:
+            kb_docs = conversation_cache.put_kb(lead["company_id"], db.query(AIKBDoc).filter(
+                AIKBDoc.company_id == lead["company_id"]
+            ).limit(conversation_cache.KB_DOCS).all())
         
         kb_context = "\n\nKnowledge Base:\n" + "\n".join([
-            f"- {doc.title}: {doc.content[:200]}..." for doc in kb_docs
+            f"- {doc['title']}: {doc['content']}..." for doc in kb_docs
         ]) if kb_docs else ""
 
-        # Build context from conversation history
-        context = f"Lead: {lead.name or lead.phone}\nStage: {stage_name}{kb_context}\n\nConversation:\n"
+        # Build context from conversation history (and the rolling summary)
+        memory = state["memory"]
+        summary = f"\nSummary: {memory['summary']}" if memory.get("summary") else ""
+        context = f"Lead: {lead['name'] or lead['phone']}\nStage: {state['stage']}{summary}{kb_context}\n\nConversation:\n"
         for msg in messages[-5:]:  # Last 5 messages
             context += f"{msg.direction.upper()}: {msg.body}\n"
+        timer.mark("context")
 
-        # Generate AI reply
-        ai_response = generate_ai_reply(context)
-        
-        # Determine channel (prefer WhatsApp)
-        channel = "wa_web"  # Default to WhatsApp Web for now
+        # Generate AI reply (P1: hedge against a slow model response)
+        ai_response = generate_ai_reply(context, company_id=lead["company_id"], hedge=True)
+        timer.mark("llm")
         
         # Route message through channel adapter
         send_result = ChannelRouter.send(channel, {
-            "phone": lead.phone,
+            "phone": lead["phone"],
             "body": ai_response.get("reply", "")
         })
+        timer.mark("send")
         
-        # Save AI reply to database
+        # Save AI reply to database (and the cached conversation)
         reply_msg = Message(
             lead_id=lead_id,
+            company_id=lead["company_id"],
             channel=channel,
             direction="outbound",
             body=ai_response.get("reply", ""),
@@ -90,18 +165,16 @@ def ai_engage(job_id: str):
             sent_at=datetime.utcnow()
         )
         db.add(reply_msg)
+        db.commit()
+        conversation_cache.record_messages([reply_msg])
         
-        # Log event
-        event = Event(
-            type="AIEngageCompleted",
-            entity_type="lead",
-            entity_id=lead_id,
-            payload={"reply": ai_response.get("reply"), "channel": channel}
+        log_event(
+            "AIEngageCompleted", "lead", lead_id,
+            {"reply": ai_response.get("reply"), "channel": channel, "status": send_result.get("status")},
+            company_id=lead["company_id"]
         )
-        db.add(event)
-        
-        db.commit()
         mark_job_completed(job_id)
+        timer.mark("persist")
 
         return {
             "status": "completed",
@@ -113,7 +186,7 @@ def ai_engage(job_id: str):
     
     except Exception as e:
         db.rollback()
-        mark_job_failed(job_id, str(e))
+        mark_job_failed(job_id, e)
         return {"error": str(e)}
     finally:
         db.close()
@@ -140,6 +213,11 @@ def followup_bumpup(job_id: str):
             mark_job_failed(job_id, "Lead not found")
             return {"error": "Lead not found"}
         
+        # Send via preferred channel (WhatsApp only, never email)
+        channel = "wa_web"
+        llm_providers.ensure_available(lead.company_id)
+        retry_policy.ensure_available(retry_policy.provider_for_channel(channel))
+        
         # Get last bot message to avoid repetition
         last_msg = db.query(Message).filter(
             Message.lead_id == lead_id,
@@ -153,10 +231,8 @@ def followup_bumpup(job_id: str):
         ]
         
         context = f"Lead: {lead.phone}\n{bump_up_prompts[0]}"
-        ai_response = generate_ai_reply(context)
+        ai_response = generate_ai_reply(context, company_id=lead.company_id, hedge=True)
         
-        # Send via preferred channel (WhatsApp only, never email)
-        channel = "wa_web"
         send_result = ChannelRouter.send(channel, {
             "phone": lead.phone,
             "body": ai_response.get("reply", "")
@@ -165,6 +241,7 @@ def followup_bumpup(job_id: str):
         # Save message
         msg = Message(
             lead_id=lead_id,
+            company_id=lead.company_id,
             channel=channel,
             direction="outbound",
             body=ai_response.get("reply", ""),
@@ -174,13 +251,20 @@ def followup_bumpup(job_id: str):
         )
         db.add(msg)
         db.commit()
+        conversation_cache.record_messages([msg])
+        
+        log_event(
+            "MessageSent", "message", msg.id,
+            {"lead_id": lead_id, "channel": channel, "status": send_result.get("status"), "source": "followup"},
+            company_id=lead.company_id
+        )
         
         mark_job_completed(job_id)
         return {"status": "completed", "lead_id": lead_id}
     
     except Exception as e:
         db.rollback()
-        mark_job_failed(job_id, str(e))
+        mark_job_failed(job_id, e)
         return {"error": str(e)}
     finally:
         db.close()
@@ -201,6 +285,7 @@ def ai_summary(job_id: str):
             return {"error": "Job not found"}
         
         lead_id = job.payload.get("lead_id")
+        lead = db.query(Lead).filter(Lead.id == lead_id).first()
         
         # Get all messages
         messages = db.query(Message).filter(
@@ -213,21 +298,31 @@ def ai_summary(job_id: str):
         ])
         
         summary_prompt = f"Summarize this conversation in 3-5 sentences:\n{conversation}"
-        summary = generate_ai_reply(summary_prompt)
+        summary = generate_ai_reply(summary_prompt, company_id=lead.company_id if lead else None)
         
         # Update lead attributes with summary
-        lead = db.query(Lead).filter(Lead.id == lead_id).first()
         if lead:
             lead.attributes = lead.attributes or {}
             lead.attributes["ai_summary"] = summary.get("reply")
+            # ... and as the rolling memory of the conversation (AI context)
+            memory = {"summary": summary.get("reply"), "summarized_at": datetime.utcnow().isoformat()}
+            session = db.query(AISession).filter(
+                AISession.lead_id == lead_id
+            ).order_by(AISession.created_at.desc()).first()
+            if session is None:
+                session = AISession(lead_id=lead_id)
+                db.add(session)
+            session.memory = memory
+            session.last_turn_at = datetime.utcnow()
             db.commit()
+            conversation_cache.update_memory(lead_id, memory)
         
         mark_job_completed(job_id)
         return {"status": "completed", "summary": summary.get("reply")}
     
     except Exception as e:
         db.rollback()
-        mark_job_failed(job_id, str(e))
+        mark_job_failed(job_id, e)
         return {"error": str(e)}
     finally:
         db.close()
@@ -242,8 +337,113 @@ def sequence_step(job_id: str):
     """
     P2 Task - Priority 70
     Sequence Step: Execute a step in a follow-up sequence
+    (enrollments are claimed and advanced in bulk by sequence_scheduler)
+    """
+    db = SessionLocal()
+    try:
+        mark_job_started(job_id)
+        
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            return {"error": "Job not found"}
+        
+        enrollment = db.query(SequenceEnrollment).filter(
+            SequenceEnrollment.id == job.payload.get("enrollment_id")
+        ).first()
+        step = db.query(SequenceStep).filter(
+            SequenceStep.id == job.payload.get("step_id")
+        ).first()
+        if not enrollment or not step:
+            mark_job_failed(job_id, "Enrollment or step not found")
+            return {"error": "Enrollment or step not found"}
+        
+        lead = db.query(Lead).filter(Lead.id == enrollment.lead_id).first()
+        if not lead:
+            mark_job_failed(job_id, "Lead not found")
+            return {"error": "Lead not found"}
+        
+        # Last-moment stop check: a reply may have landed after the scheduler
+        # claimed this step (last_step_at is the claim time)
+        if step.stop_on_reply and sequences.has_replied_since(db, lead.id, enrollment.last_step_at):
+            sequences.stop_enrollment(db, enrollment.id, "replied")
+            db.commit()
+            mark_job_completed(job_id)
+            return {"status": "skipped", "reason": "Lead replied"}
+        
+        sequence = db.query(Sequence).filter(Sequence.id == enrollment.sequence_id).first()
+        channel = sequence.channel if sequence and sequence.channel else "wa_web"
+        retry_policy.ensure_available(retry_policy.provider_for_channel(channel))
+        if step.ai_flag:
+            llm_providers.ensure_available(lead.company_id)
+        
+        content = template_engine.render_for_lead(db, step.template_id, lead) if step.template_id else {}
+        body = content.get("body", "")
+        
+        if step.ai_flag:
+            context = f"Lead: {lead.name or lead.phone}\nWrite a follow-up based on:\n{body}"
+            body = generate_ai_reply(context, company_id=lead.company_id).get("reply", "")
+        
+        send_result = ChannelRouter.send(channel, {
+            "phone": lead.phone,
+            "email": lead.email,
+            "company_id": lead.company_id,
+            "subject": content.get("subject"),
+            "body": body,
+            "template_id": step.template_id,
+        })
+        
+        msg = Message(
+            lead_id=lead.id,
+            company_id=lead.company_id,
+            channel=channel,
+            direction="outbound",
+            template_id=step.template_id,
+            body=body,
+            status=send_result.get("status"),
+            external_id=send_result.get("external_id"),
+            error=send_result.get("error"),
+            sent_at=datetime.utcnow()
+        )
+        db.add(msg)
+        db.commit()
+        conversation_cache.record_messages([msg])
+        
+        log_event(
+            "SequenceStepSent", "lead", lead.id,
+            {"sequence_id": enrollment.sequence_id, "step_no": step.step_no, "channel": channel,
+             "status": send_result.get("status")},
+            company_id=lead.company_id
+        )
+        
+        mark_job_completed(job_id)
+        return {"status": "completed", "lead_id": lead.id, "step_no": step.step_no}
+    
+    except Exception as e:
+        db.rollback()
+        mark_job_failed(job_id, e)
+        return {"error": str(e)}
+    finally:
+        db.close()
+
+
+@celery.task(name="worker.sequence_scheduler")
+def sequence_scheduler():
+    """
+    Periodic (Celery beat) - claims due enrollments in batches and
+    bulk-enqueues their sequence.step jobs
+    """
+    return sequences.run_scheduler_tick()
+
+
+@celery.task(name="worker.campaign_send", priority=55)
+def campaign_send(job_id: str):
+    """
+    P2 Task - Priority 55
+    Campaign Send: one broadcast message to one lead
+    (jobs are fanned out and paced by campaign_scheduler)
     """
     db = SessionLocal()
+    campaign_id = None
     try:
         mark_job_started(job_id)
         
@@ -251,28 +451,151 @@ def sequence_step(job_id: str):
         if not job:
             return {"error": "Job not found"}
         
-        # TODO: Implement sequence step logic
-        # - Get sequence step details
-        # - Check stop conditions (reply received, stage changed)
-        # - Send message via appropriate channel
-        # - Schedule next step if needed
+        campaign_id = job.payload.get("campaign_id")
+        campaign = db.query(Campaign).filter(Campaign.id == campaign_id).first()
+        lead = db.query(Lead).filter(Lead.id == job.payload.get("lead_id")).first()
+        if not campaign or not lead:
+            mark_job_failed(job_id, "Campaign or lead not found")
+            return {"error": "Campaign or lead not found"}
+        
+        if campaign.status == "cancelled":
+            mark_job_completed(job_id)
+            return {"status": "skipped", "reason": "Campaign cancelled"}
+        
+        retry_policy.ensure_available(retry_policy.provider_for_channel(campaign.channel))
+        content = template_engine.render_for_lead(db, campaign.template_id, lead)
+        
+        send_result = ChannelRouter.send(campaign.channel, {
+            "phone": lead.phone,
+            "email": lead.email,
+            "company_id": lead.company_id,
+            "subject": content.get("subject"),
+            "body": content.get("body", ""),
+            "template_id": campaign.template_id,
+        })
+        
+        msg = Message(
+            id=str(uuid.uuid4()),
+            lead_id=lead.id,
+            company_id=lead.company_id,
+            channel=campaign.channel,
+            direction="outbound",
+            template_id=campaign.template_id,
+            body=content.get("body", ""),
+            status=send_result.get("status"),
+            external_id=send_result.get("external_id"),
+            error=send_result.get("error"),
+            sent_at=datetime.utcnow()
+        )
+        db.add(msg)
+        campaigns.record_result(db, campaign.id, "sent" if send_result.get("status") == "sent" else "failed")
+        db.commit()
+        conversation_cache.record_messages([msg])
+        
+        log_event(
+            "MessageSent", "message", msg.id,
+            {"lead_id": lead.id, "channel": campaign.channel, "status": send_result.get("status"),
+             "source": "campaign", "campaign_id": campaign.id},
+            company_id=lead.company_id
+        )
         
         mark_job_completed(job_id)
-        return {"status": "completed", "message": "Sequence step executed"}
+        return {"status": "completed", "lead_id": lead.id, "campaign_id": campaign.id}
     
     except Exception as e:
         db.rollback()
-        mark_job_failed(job_id, str(e))
+        decision = mark_job_failed(job_id, e)
+        if campaign_id and decision and decision["action"] == "dlq":
+            campaigns.record_result(db, campaign_id, "failed")
+            db.commit()
         return {"error": str(e)}
     finally:
         db.close()
 
 
+@celery.task(name="worker.campaign_scheduler")
+def campaign_scheduler():
+    """
+    Periodic (Celery beat) - fan out the next paced batch of every
+    running broadcast campaign
+    """
+    return campaigns.advance_campaigns()
+
+
+@celery.task(name="worker.lead_scoring")
+def lead_scoring_task(company_id: str = None):
+    """
+    Periodic (Celery beat) - rescore active leads (Lead.priority), one
+    vectorized pass per company
+    """
+    return lead_scoring.score_all(company_id)
+
+
+@celery.task(name="worker.events_maintenance")
+def events_maintenance():
+    """
+    Periodic (Celery beat) - pre-create monthly events partitions,
+    archive and drop expired ones
+    """
+    return event_log.run_maintenance()
+
+
+@celery.task(name="worker.fair_dispatch")
+def fair_dispatch():
+    """
+    Periodic (Celery beat) and on enqueue - release pending jobs to the
+    broker, fairly across companies
+    """
+    return fair_scheduler.dispatch()
+
+
+@celery.task(name="worker.jobs_retention")
+def jobs_retention():
+    """
+    Periodic (Celery beat) - move old finished jobs to jobs_archive and
+    purge expired idempotency keys, in throttled batches
+    (also drops old task profiles)
+    """
+    result = job_retention.apply_job_retention()
+    result["profiles_purged"] = task_profiler.purge_profiles()
+    return result
+
+
+@celery.task(name="worker.webhooks_recover")
+def webhooks_recover():
+    """
+    Periodic (Celery beat) - retry webhook jobs whose worker stopped before
+    the delivery result was recorded
+    """
+    return {"recovered": recover_stale_jobs("webhook.reminder", timedelta(seconds=webhooks.STALE_AFTER))}
+
+
+@celery.task(name="worker.reports_refresh")
+def reports_refresh():
+    """
+    Periodic (Celery beat) - apply new events to cached reports,
+    recompute invalidated/overdue ones in full
+    """
+    return reports.refresh_all()
+
+
+@celery.task(name="worker.dlq_replay")
+def dlq_replay(**filters):
+    """
+    Admin - long-running, rate-limited DLQ replay (see queue_manager.replay_dlq_jobs)
+    """
+    for key in ("since", "until"):
+        if filters.get(key):
+            filters[key] = datetime.fromisoformat(filters[key])  # Already naive UTC (see main._utc)
+    return replay_dlq_jobs(**filters)
+
+
 @celery.task(name="worker.email_sequence", priority=60)
 def email_sequence(job_id: str):
     """
     P2 Task - Priority 60
     Email Sequence: Send scheduled email from sequence
+    Payload: template_id plus lead_id or lead_ids (campaign batch)
     """
     db = SessionLocal()
     try:
@@ -282,18 +605,79 @@ def email_sequence(job_id: str):
         if not job:
             return {"error": "Job not found"}
         
-        # TODO: Implement email sequence logic
-        # - Get email template
-        # - Personalize content
-        # - Send via EmailAdapter
-        # - Handle bounces/unsubscribes
+        template_id = job.payload.get("template_id")
+        lead_id = job.payload.get("lead_id")
+        lead_ids = [l for l in job.payload.get("lead_ids") or [lead_id] if l]
+        if not template_id or not lead_ids:
+            mark_job_failed(job_id, "Payload needs template_id and lead_id or lead_ids")
+            return {"error": "Payload needs template_id and lead_id or lead_ids"}
+        retry_policy.ensure_available("smtp")
+        
+        # Compile once (cached), render every recipient from one columnar fetch
+        rendered = template_engine.render_batch(template_id, lead_ids, db=db)
+        
+        company_id = db.query(Template.company_id).filter(Template.id == template_id).scalar()
+        sent = 0
+        messages = []
+        sent_events = []
+        deferred = None
+        for index, (lead_id, content) in enumerate(rendered.items()):
+            if not content["email"]:
+                continue
+            try:
+                send_result = ChannelRouter.send("email", {
+                    "email": content["email"],
+                    "company_id": company_id,
+                    "subject": content["subject"],
+                    "body": content["body"],
+                })
+            except CircuitOpenError as e:
+                # SMTP breaker opened mid-batch: keep what was sent, retry the rest later
+                deferred = e
+                remaining = list(rendered)[index:]
+                job.payload = {**job.payload, "lead_ids": remaining, "lead_id": None}
+                break
+            message_id = str(uuid.uuid4())
+            messages.append(Message(
+                id=message_id,
+                lead_id=lead_id,
+                company_id=company_id,
+                channel="email",
+                direction="outbound",
+                template_id=template_id,
+                body=content["body"],
+                status=send_result.get("status"),
+                external_id=send_result.get("external_id"),
+                error=send_result.get("error"),
+                sent_at=datetime.utcnow()
+            ))
+            sent_events.append({
+                "message_id": message_id,
+                "lead_id": lead_id,
+                "channel": "email",
+                "status": send_result.get("status"),
+                "source": "email_sequence",
+            })
+            if send_result.get("status") == "sent":
+                sent += 1
+        
+        db.add_all(messages)
+        db.commit()
+        conversation_cache.record_messages(messages)
+        
+        for event_payload in sent_events:
+            log_event("MessageSent", "message", event_payload.pop("message_id"), event_payload,
+                      company_id=company_id)
+        
+        if deferred:
+            raise deferred
         
         mark_job_completed(job_id)
-        return {"status": "completed", "message": "Email sent"}
+        return {"status": "completed", "message": "Email sent", "sent": sent, "rendered": len(rendered)}
     
     except Exception as e:
         db.rollback()
-        mark_job_failed(job_id, str(e))
+        mark_job_failed(job_id, e)
         return {"error": str(e)}
     finally:
         db.close()
@@ -304,27 +688,65 @@ def webhook_reminder(job_id: str):
     """
     P2 Task - Priority 50
     Webhook Reminder: Send webhook notification
+    Payload: endpoint_id, event, data
+    
+    The delivery runs on the per-process async dispatcher; this task only
+    hands it over, so the worker slot is freed immediately. Results are
+    recorded in batches by a writer thread (never on the dispatcher loop).
+    The broker message is acked when the task returns, so a job whose
+    worker stops mid-delivery stays in processing until webhooks_recover
+    retries it (WEBHOOK_STALE_SECONDS).
     """
     db = SessionLocal()
     try:
-        mark_job_started(job_id)
-        
         job = db.query(Job).filter(Job.id == job_id).first()
         if not job:
             return {"error": "Job not found"}
+        if job.status == "completed":
+            # Recovered as stale, but the original delivery finished after all
+            return {"status": "skipped", "reason": "Already delivered"}
+        mark_job_started(job_id)
         
-        # TODO: Implement webhook logic
-        # - Get webhook URL and payload
-        # - Sign request
-        # - Send with retry logic
+        endpoint = db.query(WebhookEndpoint).filter(
+            WebhookEndpoint.id == job.payload.get("endpoint_id")
+        ).first()
+        if not endpoint or not endpoint.active:
+            mark_job_failed(job_id, "Webhook endpoint not found or inactive")
+            return {"error": "Webhook endpoint not found or inactive"}
+        
+        future = webhooks.get_dispatcher().submit({
+            "endpoint_id": endpoint.id,
+            "url": endpoint.url,
+            "secret": endpoint.secret,
+            "batch": endpoint.batch_events,
+            "event": job.payload.get("event", "reminder"),
+            "data": job.payload.get("data"),
+        })
+        future.add_done_callback(lambda f: webhook_results.put((job_id, f)))
         
-        mark_job_completed(job_id)
-        return {"status": "completed", "message": "Webhook sent"}
+        return {"status": "dispatched", "endpoint_id": endpoint.id}
     
     except Exception as e:
         db.rollback()
-        mark_job_failed(job_id, str(e))
+        mark_job_failed(job_id, e)
         return {"error": str(e)}
     finally:
         db.close()
 
+
+def _record_webhook_results(batch: list):
+    """ResultSink handler - one UPDATE for the delivered jobs, retry policy for the rest"""
+    delivered = []
+    for job_id, future in batch:
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"status": "failed", "error": str(e)}
+        if result.get("status") == "delivered":
+            delivered.append(job_id)
+        else:
+            mark_job_failed(job_id, result.get("error", "Webhook delivery failed"), result.get("retry_after"))
+    mark_jobs_completed(delivered)
+
+
+webhook_results = webhooks.ResultSink(_record_webhook_results)
@@ -0,0 +1,98 @@
+"""
+Worker Profiles
+Launch a Celery worker tuned for one queue class
+
+    python worker_profiles.py p1          # AI replies: prefork, prefetch 1, autoscaled
+    python worker_profiles.py p2          # Sequence steps: prefork, autoscaled wider
+    python worker_profiles.py io          # Email/webhook sends: thread pool, high concurrency
+    python worker_profiles.py control --beat
+    python worker_profiles.py all         # Single worker for development
+    python worker_profiles.py p1 --print  # Show the command instead of running it
+
+Extra arguments after `--` are passed to `celery worker` unchanged, e.g.
+`python worker_profiles.py p2 -- --pool solo` on Windows (no prefork there).
+"""
+import argparse
+import os
+import sys
+
+from celery_app import QUEUES
+
+PROFILES = {
+    "p1": {
+        "queues": ["p1"],
+        "pool": "prefork",
+        "autoscale": (int(os.getenv("P1_MAX_CONCURRENCY", "8")), int(os.getenv("P1_MIN_CONCURRENCY", "2"))),
+        "prefetch": 1,  # Never hold a reply behind another slow one
+    },
+    "p2": {
+        "queues": ["p2"],
+        "pool": "prefork",
+        "autoscale": (int(os.getenv("P2_MAX_CONCURRENCY", "32")), int(os.getenv("P2_MIN_CONCURRENCY", "2"))),
+        "prefetch": 4,
+    },
+    "io": {
+        # Tasks here mostly wait on SMTP/HTTP; threads are cheap to keep many of
+        "queues": ["io"],
+        "pool": "threads",
+        "concurrency": int(os.getenv("IO_CONCURRENCY", "64")),
+        "prefetch": 4,
+    },
+    "control": {
+        "queues": ["control"],
+        "pool": "threads",
+        "concurrency": 4,
+        "prefetch": 1,
+    },
+    "all": {
+        "queues": list(QUEUES),
+        "pool": "prefork",
+        "concurrency": 4,
+        "prefetch": 1,
+    },
+}
+
+
+def build_command(profile: str, beat: bool = False, loglevel: str = "info", extra: list = None) -> list:
+    """argv for `celery worker` with the profile's settings"""
+    spec = PROFILES[profile]
+    argv = [
+        sys.executable, "-m", "celery", "-A", "worker", "worker",
+        "-Q", ",".join(spec["queues"]),
+        "-n", f"{profile}@%h",
+        "--pool", spec["pool"],
+        "--prefetch-multiplier", str(spec["prefetch"]),
+        "--loglevel", loglevel,
+    ]
+    if "autoscale" in spec:
+        argv += ["--autoscale", "{},{}".format(*spec["autoscale"])]
+    else:
+        argv += ["--concurrency", str(spec["concurrency"])]
+    if beat:
+        argv.append("--beat")
+    return argv + (extra or [])
+
+
+def main():
+    args_in = sys.argv[1:]
+    extra = []
+    if "--" in args_in:
+        split = args_in.index("--")
+        args_in, extra = args_in[:split], args_in[split + 1:]
+
+    parser = argparse.ArgumentParser(description="Launch a Celery worker profile")
+    parser.add_argument("profile", choices=sorted(PROFILES))
+    parser.add_argument("--beat", action="store_true", help="Embed the beat scheduler (one per deployment)")
+    parser.add_argument("--loglevel", default="info")
+    parser.add_argument("--print", dest="print_only", action="store_true", help="Print the command only")
+    args = parser.parse_args(args_in)
+
+    argv = build_command(args.profile, args.beat, args.loglevel, extra)
+    print(" ".join(argv))
+    if args.print_only:
+        return
+    os.execv(argv[0], argv)
+
+
+if __name__ == "__main__":
+    main()